@@ -3,3 +3,10 @@ from django.apps import AppConfig
 
 class CoreConfig(AppConfig):
     name = 'core'
+
+    def ready(self):
+        # models cannot be imported before the app registry is ready
+        # pylint: disable=import-outside-toplevel
+        from core.provisioning import ChaincodeResolver
+        from votechain.hyperledger import set_chaincode_resolver
+        set_chaincode_resolver(ChaincodeResolver())
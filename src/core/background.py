@@ -0,0 +1,52 @@
+""" Module running request side effects on a per-process worker pool """
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.db import close_old_connections
+from votechain.settings import BACKGROUND_WORKERS
+
+
+_executor = None  # pylint: disable=invalid-name
+_executor_pid = None  # pylint: disable=invalid-name
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    """ Returns the process' executor, a forked child gets its own """
+    global _executor, _executor_pid  # pylint: disable=global-statement
+    pid = os.getpid()
+    if _executor is None or _executor_pid != pid:
+        with _executor_lock:
+            if _executor is None or _executor_pid != pid:
+                _executor = ThreadPoolExecutor(
+                    max_workers=BACKGROUND_WORKERS,
+                    thread_name_prefix="votechain-worker"
+                )
+                _executor_pid = pid
+    return _executor
+
+
+def _run(function, args, kwargs):
+    """ Runs a job with its own, fresh database connection """
+    close_old_connections()
+    try:
+        return function(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+def submit(function, *args, **kwargs):
+    """ Runs a function on the worker pool, returns a concurrent.futures.Future """
+    return _get_executor().submit(_run, function, args, kwargs)
+
+
+def _reset_after_fork():
+    """ Drops the inherited executor and lock in a freshly forked child """
+    global _executor, _executor_pid, _executor_lock  # pylint: disable=global-statement
+    _executor = None
+    _executor_pid = None
+    _executor_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
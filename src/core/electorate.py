@@ -0,0 +1,223 @@
+""" Module assigning tokens to the voters of uploaded electorate files, one chunk at a time """
+import csv
+import json
+import os
+import uuid
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from core.models.models import ElectorateUpload, VoteIdentificationToken
+from votechain.settings import ELECTORATE_CHUNK_SIZE, ELECTORATE_UPLOAD_PATH
+
+EMAIL_COLUMN = "email"
+NDJSON_EXTENSIONS = (".ndjson", ".jsonl")
+# longest record of an electorate file, in bytes, longer ones are rejected without being read whole
+MAX_LINE = 4096
+QUOTE = ord('"')
+FIELD_ENDS = b",\r\n"
+# quoting state of a CSV record before its first byte, see _scan_quotes
+RECORD_START = (False, False, True)
+
+
+class _Superseded(Exception):
+    """ Raised when another worker committed the chunk first """
+
+
+def guess_format(name):
+    """ Returns the format of an electorate file from its name, CSV unless it is NDJSON """
+    if os.path.splitext(name or "")[1].lower() in NDJSON_EXTENSIONS:
+        return ElectorateUpload.NDJSON
+    return ElectorateUpload.CSV
+
+
+def store(poll, upload, file_format):
+    """ Copies an uploaded file to the upload directory piece by piece and records its job """
+    os.makedirs(ELECTORATE_UPLOAD_PATH, exist_ok=True)
+    name = "{0}-{1}.{2}".format(poll.id, uuid.uuid4(), file_format)
+    path = os.path.join(ELECTORATE_UPLOAD_PATH, name)
+    with open(path, "wb") as destination:
+        for piece in upload.chunks():
+            destination.write(piece)
+    return ElectorateUpload.objects.create(
+        poll=poll,
+        path=path,
+        format=file_format,
+        size=os.path.getsize(path)
+    )
+
+
+def _scan_quotes(data, state):
+    """
+    Follows the quoting of a piece of a CSV record, returns the state (quoted, closed, field_start)
+    after it from the one before it. The record goes on on the next line while quoted.
+    Quotes only open a field and a doubled quote within one stands for itself,
+    as the csv module reads them.
+    """
+    quoted, closed, field_start = state
+    if not quoted and b'"' not in data:
+        return (False, False, data[-1:] in FIELD_ENDS) if data else state
+    for byte in data:
+        if quoted:
+            if byte == QUOTE:
+                quoted, closed = False, True
+            continue
+        if byte == QUOTE and (field_start or closed):
+            quoted = True
+        field_start = byte in FIELD_ENDS
+        closed = False
+    return quoted, closed, field_start
+
+
+def _read_record(source, file_format):
+    """
+    Reads the next record of a file: a line, in CSV also the lines a quoted field spans.
+    Returns b"" at the end of the file and None for a record longer than MAX_LINE,
+    which is skipped a piece at a time.
+    """
+    record = b""
+    state = RECORD_START
+    while True:
+        line = source.readline(MAX_LINE + 1 - len(record))
+        record += line
+        if file_format == ElectorateUpload.CSV:
+            state = _scan_quotes(line, state)
+        if len(record) > MAX_LINE:
+            while line and (not line.endswith(b"\n") or state[0]):
+                line = source.readline(MAX_LINE)
+                if file_format == ElectorateUpload.CSV:
+                    state = _scan_quotes(line, state)
+            return None
+        if not line or not state[0]:
+            return record
+
+
+def _csv_layout(path):
+    """
+    Returns the column of emails in a CSV file and the length of its header record,
+    a file without an "email" header has them in its first column
+    """
+    with open(path, "rb") as source:
+        first = _read_record(source, ElectorateUpload.CSV)
+    if first is None:
+        return 0, 0
+    try:
+        row = next(csv.reader([first.decode("utf-8-sig")]), [])
+    except UnicodeDecodeError:
+        return 0, 0
+    names = [name.strip().lower() for name in row]
+    if EMAIL_COLUMN in names:
+        return names.index(EMAIL_COLUMN), len(first)
+    return 0, 0
+
+
+def _parse(record, file_format, column):
+    """
+    Returns the email of a record, "" for a blank line
+    and None for one without a valid email
+    """
+    try:
+        text = record.decode("utf-8-sig").strip()
+        if not text:
+            return ""
+        if file_format == ElectorateUpload.NDJSON:
+            value = json.loads(text)
+            if isinstance(value, dict):
+                value = value.get(EMAIL_COLUMN)
+        else:
+            row = next(csv.reader([text]))
+            value = row[column] if column < len(row) else None
+        if not isinstance(value, str):
+            return None
+        value = value.strip()
+        validate_email(value)
+    except (UnicodeDecodeError, ValueError, ValidationError):
+        return None
+    return value
+
+
+def _read_chunk(source, file_format, column):
+    """
+    Reads up to ELECTORATE_CHUNK_SIZE records,
+    returns their emails and the count of records and rejects.
+    Records are counted as lines.
+    """
+    emails = []
+    lines = rejected = 0
+    while lines < ELECTORATE_CHUNK_SIZE:
+        record = _read_record(source, file_format)
+        if record is None:
+            lines += 1
+            rejected += 1
+            continue
+        if not record:
+            break
+        email = _parse(record, file_format, column)
+        if email == "":
+            continue
+        lines += 1
+        if email is None:
+            rejected += 1
+        else:
+            emails.append(email)
+    return emails, lines, rejected
+
+
+def _commit_chunk(upload, emails, lines, rejected, offset):
+    """ Assigns tokens of a chunk and moves the upload past it in the same transaction """
+    with transaction.atomic():
+        assigned = VoteIdentificationToken.assign_tokens(upload.poll, emails)
+        moved = ElectorateUpload.objects \
+            .filter(id=upload.id, offset=upload.offset) \
+            .update(
+                offset=offset,
+                lines=F("lines") + lines,
+                assigned=F("assigned") + len(assigned),
+                rejected=F("rejected") + rejected,
+                updated=timezone.now()
+            )
+        if not moved:
+            raise _Superseded()
+    upload.offset = offset
+
+
+def run_upload(upload_id):
+    """
+    Processes an electorate file from the last committed chunk on.
+    Several workers may run the same upload, only one of them commits each chunk.
+    """
+    upload = ElectorateUpload.objects.select_related("poll").get(id=upload_id)
+    if upload.status == ElectorateUpload.DONE:
+        return upload
+    ElectorateUpload.objects \
+        .filter(id=upload.id) \
+        .update(status=ElectorateUpload.RUNNING, error="", updated=timezone.now())
+    try:
+        column, header = 0, 0
+        if upload.format == ElectorateUpload.CSV:
+            column, header = _csv_layout(upload.path)
+        with open(upload.path, "rb") as source:
+            source.seek(max(upload.offset, header))
+            while True:
+                emails, lines, rejected = _read_chunk(source, upload.format, column)
+                if not lines and source.tell() == upload.offset:
+                    break
+                _commit_chunk(upload, emails, lines, rejected, source.tell())
+    except _Superseded:
+        return upload
+    except Exception as ex:
+        print(ex)
+        ElectorateUpload.objects \
+            .filter(id=upload.id) \
+            .update(status=ElectorateUpload.FAILED, error=str(ex), updated=timezone.now())
+        raise ex
+    ElectorateUpload.objects \
+        .filter(id=upload.id) \
+        .update(status=ElectorateUpload.DONE, updated=timezone.now())
+    upload.status = ElectorateUpload.DONE
+    try:
+        os.remove(upload.path)
+    except OSError as ex:
+        print(ex)
+    return upload
@@ -0,0 +1,132 @@
+""" Module maintaining and reading the local index of committed votes """
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from core.models.models import Poll, LedgerCheckpoint, LedgerTally, LedgerVote
+from votechain.block_events import VOTE, ADD_CANDIDATE, DELETE_CANDIDATE
+from votechain.hyperledger import CHANNEL
+from votechain.settings import LEDGER_INDEX, LEDGER_INDEX_GRACE
+
+
+def get_checkpoint():
+    """ Returns the checkpoint of the indexed channel """
+    checkpoint, _ = LedgerCheckpoint.objects.get_or_create(channel=CHANNEL)
+    return checkpoint
+
+
+def _apply_votes(poll_id, votes):
+    """ Indexes (receipt, candidate) pairs of a poll, a receipt is counted once """
+    receipts = {}
+    for receipt, candidate in votes:
+        receipts.setdefault(receipt, candidate)
+    known = set(
+        LedgerVote.objects
+        .filter(receipt__in=list(receipts))
+        .values_list("receipt", flat=True)
+    )
+    new_votes = [
+        LedgerVote(receipt=receipt, poll_id=poll_id, candidate_name=candidate)
+        for receipt, candidate in receipts.items() if receipt not in known
+    ]
+    LedgerVote.objects.bulk_create(new_votes)
+    increments = {}
+    for vote in new_votes:
+        increments[vote.candidate_name] = increments.get(vote.candidate_name, 0) + 1
+    for candidate, count in increments.items():
+        LedgerTally.objects.get_or_create(poll_id=poll_id, candidate_name=candidate)
+        LedgerTally.objects \
+            .filter(poll_id=poll_id, candidate_name=candidate) \
+            .update(votes=F("votes") + count)
+
+
+def apply_block(decoded_block, get_poll_id):
+    """
+    Applies a decoded block to the index together with the checkpoint,
+    so every block is indexed exactly once.
+    get_poll_id(chaincode_name, namespace) maps a change to its poll.
+    """
+    with transaction.atomic():
+        checkpoint = LedgerCheckpoint.objects.select_for_update().get(channel=CHANNEL)
+        if decoded_block.number <= checkpoint.block_number:
+            return checkpoint
+        by_poll = {}
+        for change in decoded_block.changes:
+            poll_id = get_poll_id(change.chaincode_name, change.namespace)
+            if poll_id is not None:
+                by_poll.setdefault(poll_id, []).append(change)
+        existing_polls = dict(
+            Poll.objects.filter(id__in=list(by_poll)).values_list("id", "vote_shards")
+        )
+        for poll_id, shards in existing_polls.items():
+            votes = []
+            for change in by_poll[poll_id]:
+                if change.kind == VOTE:
+                    votes.append((change.receipt, change.candidate))
+                    continue
+                _apply_votes(poll_id, votes)
+                votes = []
+                if change.kind == ADD_CANDIDATE and shards:
+                    # AddCandidates only resets the base counter,
+                    # votes of sharded polls are kept in shards
+                    LedgerTally.objects.get_or_create(
+                        poll_id=poll_id,
+                        candidate_name=change.candidate
+                    )
+                elif change.kind == ADD_CANDIDATE:
+                    # AddCandidates resets the counter of a candidate added again
+                    LedgerTally.objects.update_or_create(
+                        poll_id=poll_id,
+                        candidate_name=change.candidate,
+                        defaults={"votes": 0}
+                    )
+                elif change.kind == DELETE_CANDIDATE:
+                    LedgerTally.objects \
+                        .filter(poll_id=poll_id, candidate_name=change.candidate) \
+                        .delete()
+            _apply_votes(poll_id, votes)
+        checkpoint.block_number = decoded_block.number
+        if decoded_block.time is not None:
+            checkpoint.block_time = decoded_block.time
+        checkpoint.save()
+    return checkpoint
+
+
+def mark_synced(channel_height):
+    """ Records that the index contains every block of a channel with a given height """
+    LedgerCheckpoint.objects \
+        .filter(channel=CHANNEL, block_number__gte=channel_height - 1) \
+        .update(synced_at=timezone.now())
+
+
+def is_current(poll):
+    """
+    Checks whether the index contains every vote of an ended poll,
+    i.e. it has caught up with the channel after the poll ended and votes had time to commit.
+    """
+    if not LEDGER_INDEX:
+        return False
+    checkpoint = LedgerCheckpoint.objects.filter(channel=CHANNEL).first()
+    if checkpoint is None or checkpoint.synced_at is None:
+        return False
+    return checkpoint.synced_at >= poll.end + timedelta(seconds=LEDGER_INDEX_GRACE)
+
+
+def get_results(poll):
+    """ Returns indexed results in GetResults format or None when the index is behind """
+    if not is_current(poll):
+        return None
+    return {
+        candidate: str(votes) for candidate, votes in
+        LedgerTally.objects.filter(poll=poll).values_list("candidate_name", "votes")
+    }
+
+
+def get_vote(poll, receipt):
+    """ Returns the indexed candidate of a vote or None when it is not indexed """
+    if not LEDGER_INDEX:
+        return None
+    return LedgerVote.objects \
+        .filter(receipt=receipt, poll=poll) \
+        .values_list("candidate_name", flat=True) \
+        .first()
@@ -0,0 +1,146 @@
+""" Module sending emails over a pool of concurrent SMTP connections """
+import smtplib
+import socket
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from django.core import mail
+from votechain import metrics
+
+# errors after which the message is sent again once on a fresh connection,
+# a relay dropping the connection after it took the message but before it answered gets it twice
+RECONNECT_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError, socket.timeout)
+
+sent_total = metrics.counter("mail_sent", "Emails accepted by the SMTP relay")
+failed_total = metrics.counter("mail_failed", "Emails the SMTP relay did not accept")
+reconnects = metrics.counter("mail_reconnects", "SMTP connections opened again after they dropped")
+send_seconds = metrics.histogram(
+    "mail_send_seconds",
+    "Time to hand an email over to the SMTP relay"
+)
+
+Delivery = namedtuple("Delivery", ["recipient", "error"])
+
+
+class RateLimiter():
+    """ Spaces calls from all threads evenly, at most rate per second, 0 means unlimited """
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """ Blocks until the caller may go """
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class MailPool():
+    """
+    Sends emails from size threads, each over its own SMTP connection kept open between emails.
+    The relay is sent at most rate emails per second altogether.
+    A connection is opened again after max_per_connection emails, as relays limit them per session,
+    and when it dropped, in which case the email is sent once more.
+    Where the session dropped is not known, a drop after the message data was sent
+    delivers it twice, so delivery is at least once, like the outbox retrying emails
+    of a crashed worker.
+    A relay refusing some recipients of an email only is not reported, Django's backend drops
+    that answer; the outbox sends every email to a single recipient.
+    """
+    def __init__(self, size, rate=0, max_per_connection=0, connection_factory=None):
+        self.size = size
+        self.max_per_connection = max_per_connection
+        self.limiter = RateLimiter(rate)
+        self._connection_factory = connection_factory or \
+            (lambda: mail.get_connection(fail_silently=False))
+        self._executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="votechain-mail")
+        self._local = threading.local()
+        self._connections = set()
+        self._connections_lock = threading.Lock()
+
+    def _connection(self):
+        """ Returns the open connection of the current thread, opening one when needed """
+        connection = getattr(self._local, "connection", None)
+        if connection is not None and self.max_per_connection \
+                and self._local.sent >= self.max_per_connection:
+            self._drop_connection()
+            connection = None
+        if connection is None:
+            connection = self._connection_factory()
+            connection.open()
+            self._local.connection = connection
+            self._local.sent = 0
+            with self._connections_lock:
+                self._connections.add(connection)
+        return connection
+
+    def _drop_connection(self):
+        """ Closes the connection of the current thread, ignoring errors of a broken one """
+        connection = getattr(self._local, "connection", None)
+        self._local.connection = None
+        if connection is None:
+            return
+        with self._connections_lock:
+            self._connections.discard(connection)
+        try:
+            connection.close()
+        except Exception as ex:
+            print(ex)
+
+    def _send(self, message):
+        """ Sends one email, returns the delivery of each of its recipients """
+        error = None
+        self.limiter.wait()
+        started = time.monotonic()
+        for _ in range(2):
+            try:
+                self._connection().send_messages([message])
+                self._local.sent += 1
+                error = None
+                break
+            except RECONNECT_ERRORS as ex:
+                print(ex)
+                self._drop_connection()
+                reconnects.inc()
+                error = ex
+            except Exception as ex:
+                print(ex)
+                # the session may be in any state after an error, a fresh one is safer
+                self._drop_connection()
+                error = ex
+                break
+        send_seconds.observe(time.monotonic() - started)
+        recipients = message.recipients()
+        refused = getattr(error, "recipients", None)
+        if isinstance(refused, dict):
+            # the relay refused these recipients only
+            failed_total.inc(len(refused))
+            sent_total.inc(len(recipients) - len(refused))
+            return [Delivery(recipient, refused.get(recipient)) for recipient in recipients]
+        (sent_total if error is None else failed_total).inc(len(recipients))
+        return [Delivery(recipient, error) for recipient in recipients]
+
+    def send(self, messages):
+        """
+        Sends EmailMessages in parallel, returns the deliveries of each message,
+        a Delivery per recipient whose error is None when the relay accepted it
+        """
+        return list(self._executor.map(self._send, messages))
+
+    def close(self):
+        """ Waits for the threads and closes their connections """
+        self._executor.shutdown()
+        with self._connections_lock:
+            connections, self._connections = self._connections, set()
+        for connection in connections:
+            try:
+                connection.close()
+            except Exception as ex:
+                print(ex)
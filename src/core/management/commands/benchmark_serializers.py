@@ -0,0 +1,119 @@
+""" Command comparing DRF serializers with the serializers of .values() rows """
+import time
+from datetime import timedelta
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from core.models.models import Poll, Candidate, Voter
+from core.serializers.fast import poll_values, voter_values
+from core.serializers.serializers import PollSerializer, VoterSerializer
+
+
+def best_of(repeat, function):
+    """ Returns the fastest of repeat runs of function in seconds, and its output """
+    best, output = None, None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        output = function()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, output
+
+
+class Command(BaseCommand):
+    help = "Times poll and voter serialization with DRF serializers and from .values() rows, " \
+        "on generated data"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--polls", type=int, default=1000, help="polls generated")
+        parser.add_argument("--candidates", type=int, default=5, help="candidates per poll")
+        parser.add_argument(
+            "--voters",
+            type=int,
+            default=1000,
+            help="voters generated, a tenth of them in every poll"
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=5,
+            help="runs of each serializer, the best is kept"
+        )
+
+    def generate(self, options):
+        """ Creates the polls, candidates and voters serialized """
+        datenow = timezone.now()
+        Poll.objects.bulk_create([
+            Poll(title="benchmark{0}".format(index), start=datenow, end=datenow + timedelta(days=1))
+            for index in range(options["polls"])
+        ])
+        polls = list(
+            Poll.objects.filter(title__startswith="benchmark").order_by("id")[:options["polls"]]
+        )
+        Candidate.objects.bulk_create([
+            Candidate(name="candidate{0}".format(index), poll=poll)
+            for poll in polls
+            for index in range(options["candidates"])
+        ])
+        user_model = get_user_model()
+        user_model.objects.bulk_create([
+            user_model(
+                username="benchmark{0}".format(index),
+                email="benchmark{0}@benchmark.com".format(index)
+            )
+            for index in range(options["voters"])
+        ])
+        users = user_model.objects.filter(username__startswith="benchmark")
+        Voter.objects.bulk_create([Voter(user=user) for user in users])
+        voters = Voter.objects.filter(user__username__startswith="benchmark")
+        Voter.polls.through.objects.bulk_create([
+            Voter.polls.through(voter_id=voter.id, poll_id=poll.id)
+            for voter in voters[:max(1, options["voters"] // 10)]
+            for poll in polls
+        ])
+        return Poll.objects.filter(title__startswith="benchmark"), voters
+
+    def compare(self, name, repeat, drf, fast):
+        """ Times both serializers, checks their outputs are the same and reports the speedup """
+        drf_time, drf_data = best_of(repeat, drf)
+        fast_time, fast_data = best_of(repeat, fast)
+        if JSONRenderer().render(drf_data) != JSONRenderer().render(fast_data):
+            raise CommandError("{0}: outputs differ".format(name))
+        self.stdout.write("{0}: {1} objects, drf {2:.1f} ms, values {3:.1f} ms, {4:.1f}x".format(
+            name,
+            len(fast_data),
+            drf_time * 1000,
+            fast_time * 1000,
+            drf_time / fast_time if fast_time else float("inf")
+        ))
+
+    def handle(self, *args, **options):
+        # the generated data is rolled back, so the command can run against any database
+        with transaction.atomic():
+            polls, voters = self.generate(options)
+            repeat = options["repeat"]
+            self.compare(
+                "polls",
+                repeat,
+                lambda: PollSerializer(polls.prefetch_related("candidates"), many=True).data,
+                lambda: poll_values.serialize(poll_values.values(polls))
+            )
+            fields = ["id", "title", "start", "end"]
+            self.compare(
+                "polls without candidates",
+                repeat,
+                lambda: PollSerializer(polls, many=True, fields=fields).data,
+                lambda: poll_values.serialize(poll_values.values(polls, fields), fields)
+            )
+            self.compare(
+                "voters",
+                repeat,
+                lambda: VoterSerializer(
+                    voters.select_related("user").prefetch_related("polls"),
+                    many=True
+                ).data,
+                lambda: voter_values.serialize(voter_values.values(voters))
+            )
+            transaction.set_rollback(True)
@@ -0,0 +1,50 @@
+""" Command delivering emails queued in the outbox """
+import time
+from django.core.management.base import BaseCommand
+from core.mailer import MailPool
+from core.outbox import deliver, purge
+from votechain.settings import OUTBOX_BATCH_SIZE, OUTBOX_LEASE, OUTBOX_WORKERS, OUTBOX_RETENTION, \
+    MAIL_RATE_LIMIT, MAIL_MAX_PER_CONNECTION
+
+
+class Command(BaseCommand):
+    help = "Sends queued emails over reused SMTP connections and retries failed ones with backoff"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, default=5, help="seconds between passes")
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=OUTBOX_BATCH_SIZE,
+            help="emails taken per query"
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=OUTBOX_WORKERS,
+            help="parallel SMTP connections"
+        )
+        parser.add_argument(
+            "--rate",
+            type=float,
+            default=MAIL_RATE_LIMIT,
+            help="emails per second sent to the relay, 0 means unlimited"
+        )
+        parser.add_argument("--once", action="store_true", help="deliver once and exit")
+
+    def handle(self, *args, **options):
+        pool = MailPool(options["workers"], options["rate"], MAIL_MAX_PER_CONNECTION)
+        try:
+            while True:
+                sent, failed = deliver(pool, options["batch_size"], OUTBOX_LEASE)
+                if sent or failed:
+                    self.stdout.write("sent {0} emails, {1} failed".format(sent, failed))
+                # a full batch means more are likely due, so the next one is taken right away
+                if sent + failed == options["batch_size"]:
+                    continue
+                purge(OUTBOX_RETENTION)
+                if options["once"]:
+                    return
+                time.sleep(options["interval"])
+        finally:
+            pool.close()
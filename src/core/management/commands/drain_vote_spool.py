@@ -0,0 +1,67 @@
+""" Command replaying spooled votes into the ledger """
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from core.models.models import Trail, VoteReceipt
+from core.views.voter_view import replay_vote, send_vvpat
+from votechain.settings import VOTE_SPOOL_RETENTION
+from votechain.spool import get_vote_spool, receipt_for
+
+
+def settle_receipts(spool, chunk_size):
+    """
+    Marks asynchronous votes committed once their spooled vote was drained and sends their vvpats.
+    The spool does not know the vits of its votes, so pending votes are matched
+    through the ledger receipts derived from their vits.
+    Returns the number of votes marked committed.
+    """
+    settled = 0
+    last_id = 0
+    while True:
+        rows = list(
+            VoteReceipt.objects
+            .filter(status=VoteReceipt.PENDING, id__gt=last_id)
+            .order_by("id")
+            .values_list("id", "vit__token")[:chunk_size]
+        )
+        if not rows:
+            return settled
+        last_id = rows[-1][0]
+        receipts = {receipt_for(token): receipt_id for receipt_id, token in rows}
+        drained = spool.drained_receipts(receipts)
+        ledger_receipts = {receipts[receipt]: receipt for receipt in drained}
+        committed = VoteReceipt.objects \
+            .select_related("user", "poll") \
+            .filter(id__in=ledger_receipts)
+        for receipt in committed:
+            with transaction.atomic():
+                # a vote settled meanwhile by its background job already sent its vvpat
+                if not VoteReceipt.objects \
+                        .filter(id=receipt.id, status=VoteReceipt.PENDING) \
+                        .update(status=VoteReceipt.COMMITTED):
+                    continue
+                vvpat = Trail.generate_token(ledger_receipts[receipt.id])
+                send_vvpat(receipt.user, receipt.poll, vvpat)
+            settled += 1
+
+
+class Command(BaseCommand):
+    help = "Replays votes from the local spool into the ledger, exactly once per vit"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, default=5, help="seconds between passes")
+        parser.add_argument("--chunk-size", type=int, default=100, help="votes read per query")
+        parser.add_argument("--once", action="store_true", help="drain once and exit")
+
+    def handle(self, *args, **options):
+        spool = get_vote_spool()
+        while True:
+            drained, failed = spool.drain(replay_vote, options["chunk_size"])
+            # before pruning, which forgets drained votes
+            settle_receipts(spool, options["chunk_size"])
+            spool.prune(VOTE_SPOOL_RETENTION)
+            if drained or failed:
+                self.stdout.write("drained {0} votes, {1} failed".format(drained, failed))
+            if options["once"]:
+                return
+            time.sleep(options["interval"])
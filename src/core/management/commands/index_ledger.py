@@ -0,0 +1,38 @@
+""" Command materializing committed votes into the local ledger index """
+import queue
+import time
+from django.core.management.base import BaseCommand
+from core.ledger_index import get_checkpoint, apply_block, mark_synced
+from votechain.block_events import decode_block
+from votechain.hyperledger import get_network_client
+
+
+class Command(BaseCommand):
+    help = "Listens to committed blocks and keeps the local tally and vote index up to date"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sync-interval",
+            type=float,
+            default=10,
+            help="seconds between comparisons with the channel height"
+        )
+
+    def handle(self, *args, **options):
+        client = get_network_client()
+        checkpoint = get_checkpoint()
+        blocks = queue.Queue()
+        # blocks arrive on the client's loop thread and are indexed here
+        stream = client.listen_blocks(checkpoint.block_number + 1, blocks.put)
+        self.stdout.write("indexing from block {0}".format(checkpoint.block_number + 1))
+        next_sync = time.monotonic()
+        while not stream.done():
+            try:
+                block = blocks.get(timeout=options["sync_interval"])
+                checkpoint = apply_block(decode_block(block), client.get_poll_id)
+            except queue.Empty:
+                pass
+            if blocks.empty() and time.monotonic() >= next_sync:
+                mark_synced(client.get_channel_height())
+                next_sync = time.monotonic() + options["sync_interval"]
+        stream.result()
@@ -0,0 +1,43 @@
+""" Command moving polls from their own chaincode to the shared multi-poll chaincode """
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from core.models.models import Poll
+from core.provisioning import provision_poll
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves polls that have not started yet to the shared chaincode. "
+        "Polls that already started keep their own chaincode, "
+        "so their votes and receipts stay verifiable."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "polls",
+            nargs="*",
+            type=int,
+            help="ids of polls to move, all by default"
+        )
+
+    def handle(self, *args, **options):
+        polls = Poll.objects.filter(shared_chaincode=False)
+        if options["polls"]:
+            polls = polls.filter(id__in=options["polls"])
+        for poll_id in polls.order_by("id").values_list("id", flat=True):
+            with transaction.atomic():
+                # locked like candidate changes, so none are lost while the poll moves
+                poll = Poll.objects.select_for_update().get(id=poll_id)
+                if poll.start is not None and poll.start <= timezone.now():
+                    self.stdout.write("poll {0} has started, keeping its chaincode".format(poll_id))
+                    continue
+                poll.shared_chaincode = True
+                poll.provisioning_status = Poll.PROVISIONING
+                poll.save(update_fields=["shared_chaincode", "provisioning_status"])
+            try:
+                provision_poll(poll_id)
+            except Exception as ex:
+                self.stderr.write("poll {0}: {1}".format(poll_id, ex))
+                continue
+            self.stdout.write("poll {0} moved to the shared chaincode".format(poll_id))
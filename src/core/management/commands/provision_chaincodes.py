@@ -0,0 +1,40 @@
+""" Command provisioning chaincodes of new polls and keeping the warm pool filled """
+import time
+from django.core.management.base import BaseCommand
+from core.models.models import Poll
+from core.provisioning import provision_poll, expire_stale, fill_pool
+from votechain.settings import CHAINCODE_POOL_SIZE, LEDGER_TIMEOUT
+
+
+class Command(BaseCommand):
+    help = "Binds chaincodes to polls still provisioning " \
+        "and keeps instantiated chaincodes ready for new ones"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, default=10, help="seconds between passes")
+        parser.add_argument(
+            "--pool-size",
+            type=int,
+            default=CHAINCODE_POOL_SIZE,
+            help="unbound chaincodes kept instantiated"
+        )
+        parser.add_argument("--once", action="store_true", help="run a single pass and exit")
+
+    def handle(self, *args, **options):
+        while True:
+            expire_stale(LEDGER_TIMEOUT * 2)
+            polls = Poll.objects \
+                .exclude(provisioning_status=Poll.READY) \
+                .order_by("id") \
+                .values_list("id", flat=True)
+            for poll_id in polls:
+                try:
+                    provision_poll(poll_id)
+                except Exception as ex:
+                    self.stderr.write("poll {0}: {1}".format(poll_id, ex))
+            deployed = fill_pool(options["pool_size"])
+            if deployed:
+                self.stdout.write("instantiated {0} pooled chaincodes".format(deployed))
+            if options["once"]:
+                return
+            time.sleep(options["interval"])
@@ -0,0 +1,48 @@
+""" Command resuming electorate uploads whose job stopped before the end of the file """
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from core.electorate import run_upload
+from core.models.models import ElectorateUpload
+
+
+class Command(BaseCommand):
+    help = "Resumes electorate uploads from their last committed chunk"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, default=30, help="seconds between passes")
+        parser.add_argument(
+            "--stale",
+            type=float,
+            default=60,
+            help="seconds without progress after which a running upload is resumed"
+        )
+        parser.add_argument(
+            "--retry-failed",
+            action="store_true",
+            help="resume failed uploads as well"
+        )
+        parser.add_argument("--once", action="store_true", help="run a single pass and exit")
+
+    def handle(self, *args, **options):
+        while True:
+            statuses = [ElectorateUpload.PENDING, ElectorateUpload.RUNNING]
+            if options["retry_failed"]:
+                statuses.append(ElectorateUpload.FAILED)
+            uploads = ElectorateUpload.objects \
+                .filter(
+                    status__in=statuses,
+                    updated__lte=timezone.now() - timedelta(seconds=options["stale"])
+                ) \
+                .order_by("id") \
+                .values_list("id", flat=True)
+            for upload_id in uploads:
+                try:
+                    upload = run_upload(upload_id)
+                    self.stdout.write("upload {0}: {1}".format(upload_id, upload.status))
+                except Exception as ex:
+                    self.stderr.write("upload {0}: {1}".format(upload_id, ex))
+            if options["once"]:
+                return
+            time.sleep(options["interval"])
@@ -0,0 +1,47 @@
+""" Module containing middleware bounding the time requests spend on the ledger """
+import concurrent.futures
+import math
+from django.http import JsonResponse
+from votechain.gateway import GatewayBusyError, set_deadline
+from votechain.settings import REQUEST_DEADLINE
+
+DEADLINE_HEADER = "HTTP_X_REQUEST_TIMEOUT"
+
+
+class LedgerDeadlineMiddleware():
+    """
+    Gives ledger calls of a request a deadline, REQUEST_DEADLINE seconds
+    or less when asked for with the X-Request-Timeout header (in seconds).
+    Answers requests refused by the ledger gateway with 503 and Retry-After,
+    and requests that ran out of time waiting for the ledger with 504.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def _timeout(self, request):
+        """ Returns the number of seconds the request may spend on the ledger """
+        try:
+            requested = float(request.META.get(DEADLINE_HEADER, REQUEST_DEADLINE))
+        except ValueError:
+            requested = REQUEST_DEADLINE
+        # nan and inf parse as floats too
+        if not math.isfinite(requested) or requested <= 0:
+            requested = REQUEST_DEADLINE
+        return min(requested, REQUEST_DEADLINE)
+
+    def __call__(self, request):
+        set_deadline(self._timeout(request))
+        try:
+            return self.get_response(request)
+        finally:
+            set_deadline(None)
+
+    def process_exception(self, request, exception):
+        """ Answers refused or timed out ledger calls with 503 or 504 instead of 500 """
+        if isinstance(exception, GatewayBusyError):
+            response = JsonResponse({"detail": str(exception)}, status=503)
+            response["Retry-After"] = str(max(1, math.ceil(exception.retry_after)))
+            return response
+        if isinstance(exception, concurrent.futures.TimeoutError):
+            return JsonResponse({"detail": "Ledger did not answer in time"}, status=504)
+        return None
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_delete_vote'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='poll',
+            name='vote_shards',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
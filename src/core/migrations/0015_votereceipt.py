@@ -0,0 +1,31 @@
+# Generated by Django 3.1.14 on 2026-10-18 06:48
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0014_poll_vote_shards'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VoteReceipt',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('receipt', models.UUIDField(default=uuid.uuid4, unique=True)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('committed', 'Committed'), ('failed', 'Failed')], default='pending', max_length=16)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('candidate', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.Candidate')),
+                ('poll', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.Poll')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('vit', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='core.VoteIdentificationToken')),
+            ],
+        ),
+    ]
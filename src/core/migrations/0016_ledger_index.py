@@ -0,0 +1,46 @@
+# Generated by Django 3.1.14 on 2026-10-18 06:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_votereceipt'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('channel', models.CharField(max_length=256, unique=True)),
+                ('block_number', models.BigIntegerField(default=-1)),
+                ('block_time', models.DateTimeField(null=True)),
+                ('synced_at', models.DateTimeField(null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LedgerVote',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('receipt', models.CharField(max_length=128, unique=True)),
+                ('candidate_name', models.CharField(max_length=500)),
+                ('poll', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.Poll')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LedgerTally',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('candidate_name', models.CharField(max_length=500)),
+                ('votes', models.BigIntegerField(default=0)),
+                ('poll', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.Poll')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='ledgertally',
+            constraint=models.UniqueConstraint(fields=('poll', 'candidate_name'), name='UQ_LedgerTally_poll_candidate_name'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.1.14 on 2026-10-18 06:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_ledger_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='poll',
+            name='provisioning_status',
+            field=models.CharField(choices=[('provisioning', 'Provisioning'), ('ready', 'Ready'), ('failed', 'Failed')], default='ready', max_length=16),
+        ),
+        migrations.CreateModel(
+            name='ChaincodeInstance',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=256, unique=True)),
+                ('status', models.CharField(choices=[('provisioning', 'Provisioning'), ('ready', 'Ready'), ('failed', 'Failed')], default='provisioning', max_length=16)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('poll', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='chaincode', to='core.Poll')),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-18 07:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_chaincode_provisioning'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='poll',
+            name='shared_chaincode',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.1.14 on 2026-10-18 07:18
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_outbox_email'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ElectorateUpload',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('path', models.CharField(max_length=1024)),
+                ('format', models.CharField(choices=[('csv', 'CSV'), ('ndjson', 'NDJSON')], default='csv', max_length=8)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=16)),
+                ('size', models.BigIntegerField(default=0)),
+                ('offset', models.BigIntegerField(default=0)),
+                ('lines', models.BigIntegerField(default=0)),
+                ('assigned', models.BigIntegerField(default=0)),
+                ('rejected', models.BigIntegerField(default=0)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('poll', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.Poll')),
+            ],
+        ),
+    ]
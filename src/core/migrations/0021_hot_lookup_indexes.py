@@ -0,0 +1,39 @@
+# Generated by Django 3.1.14 on 2026-10-18 07:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_electorate_upload'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='poll',
+            name='end',
+            field=models.DateTimeField(db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='trail',
+            name='trail_token',
+            field=models.CharField(db_index=True, max_length=512),
+        ),
+        migrations.AddIndex(
+            model_name='poll',
+            index=models.Index(fields=['isActive', 'end'], name='core_poll_active_end_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='voteidentificationtoken',
+            index=models.Index(fields=['poll', 'used'], name='core_vit_poll_used_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='voteidentificationtoken',
+            index=models.Index(fields=['poll', 'assigned'], name='core_vit_poll_assigned_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='voteidentificationtoken',
+            constraint=models.UniqueConstraint(fields=('token',), name='UQ_VoteIdentificationToken_token'),
+        ),
+    ]
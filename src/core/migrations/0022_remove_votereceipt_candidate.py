@@ -0,0 +1,17 @@
+# Generated by Django 3.1.14 on 2026-10-18 09:02
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0021_hot_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='votereceipt',
+            name='candidate',
+        ),
+    ]
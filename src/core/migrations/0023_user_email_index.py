@@ -0,0 +1,20 @@
+# Generated by Django 3.1.14 on 2026-10-18 10:12
+
+from django.conf import settings
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0022_remove_votereceipt_candidate'),
+    ]
+
+    operations = [
+        # token assignment looks voters up by email, the auth app's user table has no index on it
+        migrations.RunSQL(
+            sql='CREATE INDEX core_user_email_idx ON auth_user (email)',
+            reverse_sql='DROP INDEX core_user_email_idx ON auth_user',
+        ),
+    ]
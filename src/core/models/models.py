@@ -1,28 +1,48 @@
 """ Module defining system's models """
 from collections import namedtuple
 import uuid
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth import get_user_model
-from django.core.mail import send_mail
 from django.db.models.signals import post_save
-from django.db.models import F, Q
+from django.db.models import Exists, F, OuterRef, Q
 from django.dispatch import receiver
 from django.utils import timezone
-from django.core.signing import Signer, BadSignature
-from votechain.settings import DEFAULT_FROM_EMAIL
+from core import background, vvpat
+from votechain.settings import VVPAT_AUDIT_TRAIL
 
 
 User = get_user_model()
+# emails resolved and tokens inserted per query when assigning tokens in bulk
+ASSIGN_CHUNK_SIZE = 500
 
 
 class Poll(models.Model):
     """ Represents a poll or election """
+    PROVISIONING = "provisioning"
+    READY = "ready"
+    FAILED = "failed"
+    PROVISIONING_STATUS_CHOICES = (
+        (PROVISIONING, "Provisioning"),
+        (READY, "Ready"),
+        (FAILED, "Failed"),
+    )
+
     id = models.BigAutoField(primary_key=True)
     title = models.CharField(max_length=256, blank=False)
     created = models.DateTimeField(auto_now_add=True)
     start = models.DateTimeField(blank=True, db_index=True, null=True, default=timezone.now)
-    end = models.DateTimeField(blank=False)
+    end = models.DateTimeField(blank=False, db_index=True)
     isActive = models.BooleanField(blank=False, default=True)
+    # number of counter shards per candidate on the ledger, 0 means a single counter
+    vote_shards = models.PositiveSmallIntegerField(blank=False, default=0)
+    # poll is hosted by the shared multi-poll chaincode instead of its own
+    shared_chaincode = models.BooleanField(blank=False, default=False)
+    # whether the poll's chaincode is bound and holds its candidates
+    provisioning_status = models.CharField(
+        max_length=16,
+        choices=PROVISIONING_STATUS_CHOICES,
+        default=READY
+    )
 
     class Meta:
         constraints = [
@@ -31,6 +51,9 @@ class Poll(models.Model):
                 name="core_poll_start_end_date_check"
             )
         ]
+        indexes = [
+            models.Index(fields=("isActive", "end"), name="core_poll_active_end_idx")
+        ]
 
     def can_edit(self):
         """
@@ -99,24 +122,24 @@ def update_voter(sender, instance, **kwargs):
 
 
 class Trail(models.Model):
-    """ Used to retrieve an associated vote """
+    """ Audit record of an issued vvpat, vvpats themselves carry their vote """
     id = models.BigAutoField(primary_key=True)
-    trail_token = models.CharField(blank=False, max_length=512)
+    trail_token = models.CharField(blank=False, max_length=512, db_index=True)
 
     @staticmethod
     def generate_token(txid):
-        """ generates a token for a given vote """
-        entity = Trail.objects.create(trail_token=txid)
-        return Signer().sign(entity.trail_token)
+        """
+        generates a token for a given vote,
+        recorded in the background with VVPAT_AUDIT_TRAIL
+        """
+        if VVPAT_AUDIT_TRAIL:
+            background.submit(Trail.objects.create, trail_token=txid)
+        return vvpat.issue(txid)
 
     @staticmethod
     def decrypt(token):
-        """ decrypts a vvpat token and returns its payload """
-        try:
-            payload = Signer().unsign(token)
-        except BadSignature:
-            return ""
-        return payload
+        """ decrypts a vvpat token, legacy ones included, and returns its payload """
+        return vvpat.verify(token)
 
 
 class VoteIdentificationToken(models.Model):
@@ -127,6 +150,16 @@ class VoteIdentificationToken(models.Model):
     assigned = models.BooleanField(blank=False, default=False)
     used = models.BooleanField(blank=False, default=False)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=("token",), name="UQ_VoteIdentificationToken_token")
+        ]
+        # turnout of a poll counts its used and its assigned tokens
+        indexes = [
+            models.Index(fields=("poll", "used"), name="core_vit_poll_used_idx"),
+            models.Index(fields=("poll", "assigned"), name="core_vit_poll_assigned_idx")
+        ]
+
     @staticmethod
     def generate_token(poll):
         """ generates a token for a given poll """
@@ -134,38 +167,238 @@ class VoteIdentificationToken(models.Model):
         entity = VoteIdentificationToken.objects.create(poll=poll, token=token)
         return entity
 
-    def assign(self, email, connection):
-        """ assigns a token to a user and send him an email """
-        user = User.objects.filter(email=email).first()
-        voter = None
-        if user is not None:
-            voter = Voter.objects.filter(user_id=user.id).first()
-        if voter is not None:
-            if self.poll in voter.polls.all():
-                return False
-            self.assigned = True
-            voter.polls.add(self.poll)
-            self.save()
-            voter.save()
-            return self._send_mail(email, connection=connection)
-        return False
-
-    def _send_mail(self, email, connection=None):
-        """ Sends a vote identification token to an authorized user """
-        message = """You have been authorized to take part in a poll titled:
+    def claim(self, poll):
+        """
+        Marks the token as used if it belongs to the poll and is unused,
+        in a single conditional UPDATE, so exactly one of concurrent votes
+        with the same token claims it.
+        Returns whether this call claimed the token.
+        """
+        claimed = VoteIdentificationToken.objects \
+            .filter(id=self.id, poll_id=poll.id, used=False) \
+            .update(used=True)
+        if claimed:
+            self.used = True
+        return claimed == 1
+
+    def release(self):
+        """ Makes a claimed token usable again, when its vote did not make it to the ledger """
+        VoteIdentificationToken.objects.filter(id=self.id).update(used=False)
+        self.used = False
+
+    @staticmethod
+    def assign_tokens(poll, emails):
+        """
+        Assigns a new token of the poll to every voter with one of the emails
+        not yet authorized to vote in it, and queues an email with the token to each.
+        Runs a fixed number of queries per ASSIGN_CHUNK_SIZE emails.
+        Returns the emails tokens were assigned to.
+        """
+        emails = list(dict.fromkeys(emails))
+        assigned = []
+        subject = 'Votechain authentication token'
+        with transaction.atomic():
+            # serializes assignments to the same poll, so no voter gets two tokens
+            Poll.objects.select_for_update().filter(id=poll.id).exists()
+            for offset in range(0, len(emails), ASSIGN_CHUNK_SIZE):
+                chunk = emails[offset:offset + ASSIGN_CHUNK_SIZE]
+                voters = {}
+                rows = Voter.objects \
+                    .filter(user__email__in=chunk) \
+                    .annotate(member=Exists(
+                        Voter.polls.through.objects
+                        .filter(voter_id=OuterRef("id"), poll_id=poll.id)
+                    )) \
+                    .order_by("user_id") \
+                    .values_list("id", "user__email", "member")
+                for voter_id, email, member in rows:
+                    # like User.objects.filter(email=email).first(),
+                    # the oldest user of an email wins, even when it is the one already authorized
+                    voters.setdefault(email, (voter_id, member))
+                voters = {
+                    email: voter_id for email, (voter_id, member) in voters.items() if not member
+                }
+                chunk = [email for email in chunk if email in voters]
+                tokens = [
+                    VoteIdentificationToken(poll=poll, token=uuid.uuid4(), assigned=True)
+                    for _ in chunk
+                ]
+                VoteIdentificationToken.objects.bulk_create(tokens, batch_size=ASSIGN_CHUNK_SIZE)
+                Voter.polls.through.objects.bulk_create(
+                    [
+                        Voter.polls.through(voter_id=voters[email], poll_id=poll.id)
+                        for email in chunk
+                    ],
+                    batch_size=ASSIGN_CHUNK_SIZE
+                )
+                OutboxEmail.objects.bulk_create(
+                    [
+                        OutboxEmail(recipient=email, subject=subject, body=token.mail_message(poll))
+                        for email, token in zip(chunk, tokens)
+                    ],
+                    batch_size=ASSIGN_CHUNK_SIZE
+                )
+                assigned.extend(chunk)
+        return assigned
+
+    def mail_message(self, poll):
+        """ Returns the email sending the token to an authorized user """
+        return """You have been authorized to take part in a poll titled:
 {0}
 Your authorization token is:
-{1}""".format(self.poll.title, self.token)
-        sent = 0
-        sent = send_mail(
-            'Votechain authentication token',
-            message,
-            DEFAULT_FROM_EMAIL,
-            [email],
-            fail_silently=False,
-            connection=connection
-        )
-        return sent > 0
+{1}""".format(poll.title, self.token)
 
     def delete(self, using=None, keep_parents=False):
         pass
+
+
+class ChaincodeInstance(models.Model):
+    """ Instantiated chaincode, either bound to a poll or waiting in the warm pool """
+    PROVISIONING = "provisioning"
+    READY = "ready"
+    FAILED = "failed"
+    STATUS_CHOICES = (
+        (PROVISIONING, "Provisioning"),
+        (READY, "Ready"),
+        (FAILED, "Failed"),
+    )
+
+    id = models.BigAutoField(primary_key=True)
+    name = models.CharField(max_length=256, blank=False, unique=True)
+    poll = models.OneToOneField(
+        Poll,
+        related_name="chaincode",
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True
+    )
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PROVISIONING)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+
+class VoteReceipt(models.Model):
+    """ Tracks a vote accepted for asynchronous commit to the ledger """
+    PENDING = "pending"
+    COMMITTED = "committed"
+    FAILED = "failed"
+    STATUS_CHOICES = (
+        (PENDING, "Pending"),
+        (COMMITTED, "Committed"),
+        (FAILED, "Failed"),
+    )
+
+    id = models.BigAutoField(primary_key=True)
+    receipt = models.UUIDField(blank=False, unique=True, default=uuid.uuid4)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    poll = models.ForeignKey(Poll, on_delete=models.CASCADE)
+    vit = models.OneToOneField(VoteIdentificationToken, on_delete=models.CASCADE)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+
+class LedgerTally(models.Model):
+    """ Number of votes of a candidate, materialized from committed blocks """
+    id = models.BigAutoField(primary_key=True)
+    poll = models.ForeignKey(Poll, on_delete=models.CASCADE)
+    candidate_name = models.CharField(max_length=500, blank=False)
+    votes = models.BigIntegerField(blank=False, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=("poll", "candidate_name"),
+                name="UQ_LedgerTally_poll_candidate_name"
+            )
+        ]
+
+
+class LedgerVote(models.Model):
+    """
+    Maps a vote's receipt (transaction id) to its candidate,
+    materialized from committed blocks
+    """
+    id = models.BigAutoField(primary_key=True)
+    receipt = models.CharField(max_length=128, blank=False, unique=True)
+    poll = models.ForeignKey(Poll, on_delete=models.CASCADE)
+    candidate_name = models.CharField(max_length=500, blank=False)
+
+
+class LedgerCheckpoint(models.Model):
+    """ Tracks how far committed blocks of a channel have been materialized """
+    id = models.BigAutoField(primary_key=True)
+    channel = models.CharField(max_length=256, blank=False, unique=True)
+    block_number = models.BigIntegerField(blank=False, default=-1)
+    block_time = models.DateTimeField(null=True)
+    # last time the index was known to contain every block of the channel
+    synced_at = models.DateTimeField(null=True)
+
+
+class OutboxEmail(models.Model):
+    """ Email written with the change it reports and delivered by the deliver_outbox command """
+    PENDING = "pending"
+    SENT = "sent"
+    FAILED = "failed"
+    STATUS_CHOICES = (
+        (PENDING, "Pending"),
+        (SENT, "Sent"),
+        (FAILED, "Failed"),
+    )
+
+    id = models.BigAutoField(primary_key=True)
+    recipient = models.EmailField(blank=False)
+    subject = models.CharField(max_length=256, blank=False)
+    body = models.TextField(blank=False)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(blank=False, default=0)
+    # not sent before then, also pushed forward while a worker holds the email
+    next_attempt = models.DateTimeField(blank=False, default=timezone.now)
+    last_error = models.TextField(blank=True, default="")
+    created = models.DateTimeField(auto_now_add=True)
+    sent = models.DateTimeField(null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=("status", "next_attempt"), name="core_outbox_due_idx")
+        ]
+
+    @staticmethod
+    def enqueue(recipient, subject, body):
+        """ Queues an email, in the caller's transaction if any """
+        return OutboxEmail.objects.create(recipient=recipient, subject=subject, body=body)
+
+
+class ElectorateUpload(models.Model):
+    """ File of voter emails assigned tokens of a poll in chunks by a background job """
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = (
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    )
+    CSV = "csv"
+    NDJSON = "ndjson"
+    FORMAT_CHOICES = (
+        (CSV, "CSV"),
+        (NDJSON, "NDJSON"),
+    )
+
+    id = models.BigAutoField(primary_key=True)
+    poll = models.ForeignKey(Poll, on_delete=models.CASCADE)
+    path = models.CharField(max_length=1024, blank=False)
+    format = models.CharField(max_length=8, choices=FORMAT_CHOICES, default=CSV)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    size = models.BigIntegerField(blank=False, default=0)
+    # bytes of the file processed by committed chunks, processing resumes from there
+    offset = models.BigIntegerField(blank=False, default=0)
+    lines = models.BigIntegerField(blank=False, default=0)
+    assigned = models.BigIntegerField(blank=False, default=0)
+    rejected = models.BigIntegerField(blank=False, default=0)
+    error = models.TextField(blank=True, default="")
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
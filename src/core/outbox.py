@@ -0,0 +1,98 @@
+""" Module delivering queued emails from the outbox table """
+import random
+from datetime import timedelta
+from django.core import mail
+from django.db import transaction
+from django.utils import timezone
+from core.models.models import OutboxEmail
+from votechain.settings import DEFAULT_FROM_EMAIL, OUTBOX_MAX_ATTEMPTS, OUTBOX_RETRY_BACKOFF, \
+    OUTBOX_RETRY_MAX_BACKOFF
+
+
+def take_due(batch_size, lease):
+    """
+    Takes up to batch_size emails due for delivery, holding them for lease seconds,
+    so concurrent workers never send the same email twice
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        emails = list(
+            OutboxEmail.objects
+            .select_for_update(skip_locked=True)
+            .filter(status=OutboxEmail.PENDING, next_attempt__lte=now)
+            .order_by("next_attempt")[:batch_size]
+        )
+        if emails:
+            OutboxEmail.objects \
+                .filter(id__in=[email.id for email in emails]) \
+                .update(next_attempt=now + timedelta(seconds=lease))
+    return emails
+
+
+def retry_delay(attempts):
+    """ Full jitter backoff after a number of failed attempts, in seconds """
+    backoff = OUTBOX_RETRY_BACKOFF * 2 ** (attempts - 1)
+    return random.uniform(0, min(OUTBOX_RETRY_MAX_BACKOFF, backoff))
+
+
+def settle(email, error=None):
+    """
+    Records the outcome of a delivery, a failed one is retried until it ran out of attempts.
+    The body of a settled email is cleared, it may hold a vit or a vvpat.
+    """
+    now = timezone.now()
+    if error is None:
+        OutboxEmail.objects \
+            .filter(id=email.id) \
+            .update(
+                status=OutboxEmail.SENT,
+                sent=now,
+                attempts=email.attempts + 1,
+                last_error="",
+                body=""
+            )
+        return
+    attempts = email.attempts + 1
+    given_up = attempts >= OUTBOX_MAX_ATTEMPTS
+    OutboxEmail.objects \
+        .filter(id=email.id) \
+        .update(
+            status=OutboxEmail.FAILED if given_up else OutboxEmail.PENDING,
+            attempts=attempts,
+            next_attempt=now + timedelta(seconds=retry_delay(attempts)),
+            last_error=str(error),
+            body="" if given_up else email.body
+        )
+
+
+def purge(retention, chunk_size=1000):
+    """
+    Deletes emails settled more than retention seconds ago, so recipients are not kept forever.
+    The next attempt of a settled email is at most a lease or a backoff after its last one,
+    so the due index finds them. Returns the number of deleted emails.
+    """
+    cutoff = timezone.now() - timedelta(seconds=retention)
+    purged = 0
+    while True:
+        ids = list(
+            OutboxEmail.objects
+            .filter(status__in=(OutboxEmail.SENT, OutboxEmail.FAILED), next_attempt__lt=cutoff)
+            .values_list("id", flat=True)[:chunk_size]
+        )
+        if not ids:
+            return purged
+        purged += OutboxEmail.objects.filter(id__in=ids).delete()[0]
+
+
+def deliver(pool, batch_size, lease):
+    """ Delivers a batch of due emails over a MailPool, returns the number sent and failed """
+    emails = take_due(batch_size, lease)
+    deliveries = pool.send([
+        mail.EmailMessage(email.subject, email.body, DEFAULT_FROM_EMAIL, [email.recipient])
+        for email in emails
+    ])
+    failed = 0
+    for email, (delivery,) in zip(emails, deliveries):
+        settle(email, delivery.error)
+        failed += delivery.error is not None
+    return len(emails) - failed, failed
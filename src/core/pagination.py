@@ -0,0 +1,106 @@
+""" Module paginating poll listings with cursors keyed on (start, id) """
+import base64
+import binascii
+import json
+from django.db.models import F, Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+from votechain.settings import POLL_PAGE_SIZE, POLL_MAX_PAGE_SIZE
+
+
+# to_html is only used with display_page_controls, which stays off
+class PollCursorPagination(BasePagination):  # pylint: disable=abstract-method
+    """
+    Pages polls by start date then id, the cursor holds the key of the last poll of a page,
+    so a page costs one indexed range query however deep it is.
+    Opt-in: listings without a cursor or page_size parameter are not paginated.
+    Polls without a start date come first.
+    """
+    cursor_query_param = "cursor"
+    # keys of the rows of a page of .values() rows
+    keys = ("start", "id")
+    page_size_query_param = "page_size"
+
+    def __init__(self):
+        self.next_key = None
+        self.request = None
+
+    @staticmethod
+    def encode(key):
+        """ Encodes the (start, id) key of a poll into a cursor """
+        start, poll_id = key
+        data = json.dumps([start.isoformat() if start is not None else None, poll_id])
+        return base64.urlsafe_b64encode(data.encode("utf-8")).decode("ascii")
+
+    @staticmethod
+    def decode(cursor):
+        """ Decodes a cursor into a (start, id) key """
+        try:
+            start, poll_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+            if start is not None:
+                start = parse_datetime(start)
+                if start is None:
+                    raise ValueError(cursor)
+            return start, int(poll_id)
+        except (TypeError, ValueError, binascii.Error):
+            raise NotFound("Invalid cursor") from None
+
+    def get_page_size(self, request):
+        """ Returns the requested page size, within POLL_MAX_PAGE_SIZE """
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, POLL_PAGE_SIZE))
+        except ValueError:
+            page_size = POLL_PAGE_SIZE
+        return min(max(page_size, 1), POLL_MAX_PAGE_SIZE)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if self.cursor_query_param not in params and self.page_size_query_param not in params:
+            return None
+        self.request = request
+        page_size = self.get_page_size(request)
+        queryset = queryset.order_by(F("start").asc(nulls_first=True), "id")
+        cursor = params.get(self.cursor_query_param)
+        if cursor:
+            start, poll_id = self.decode(cursor)
+            if start is None:
+                queryset = queryset.filter(
+                    Q(start__isnull=True, id__gt=poll_id) | Q(start__isnull=False)
+                )
+            else:
+                queryset = queryset.filter(Q(start__gt=start) | Q(start=start, id__gt=poll_id))
+        polls = list(queryset[:page_size + 1])
+        self.next_key = None
+        if len(polls) > page_size:
+            polls = polls[:page_size]
+            last = polls[-1]
+            if isinstance(last, dict):
+                self.next_key = (last["start"], last["id"])
+            else:
+                self.next_key = (last.start, last.id)
+        return polls
+
+    def get_next_link(self):
+        """ Returns the url of the next page or None on the last one """
+        if self.next_key is None:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.encode(self.next_key)
+        )
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.get_next_link(), "results": data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "properties": {
+                "next": {"type": "string", "nullable": True},
+                "results": schema,
+            },
+        }
@@ -0,0 +1,194 @@
+""" Module binding chaincodes to polls and keeping a warm pool of instantiated ones """
+import logging
+import uuid
+from datetime import timedelta
+from django.db import transaction
+from django.db.utils import IntegrityError
+from django.utils import timezone
+from core.models.models import Poll, ChaincodeInstance
+from votechain.hyperledger import CHAINCODE_PREFIX, SHARED_CHAINCODE_NAME, get_network_client
+
+logger = logging.getLogger(__name__)
+
+
+class ChaincodeResolver():
+    """
+    Maps polls to their chaincodes for the network client.
+    A poll can only move to another chaincode before it starts,
+    so routes of provisioned polls that started are cached.
+    """
+    def __init__(self):
+        self._names = {}
+        self._poll_ids = {}
+
+    def get_chaincode_name(self, poll_id):
+        """ Returns name of the chaincode serving a poll or None """
+        poll_id = int(poll_id)
+        if poll_id in self._names:
+            return self._names[poll_id]
+        route = Poll.objects \
+            .filter(id=poll_id) \
+            .values_list(
+                "shared_chaincode",
+                "provisioning_status",
+                "start",
+                "chaincode__name",
+                "chaincode__status"
+            ) \
+            .first()
+        if route is None:
+            return None
+        shared, provisioning_status, start, name, status = route
+        if shared:
+            name = SHARED_CHAINCODE_NAME
+        elif status != ChaincodeInstance.READY:
+            name = None
+        if provisioning_status == Poll.READY and start is not None and start <= timezone.now():
+            self._names[poll_id] = name
+        return name
+
+    def get_poll_id(self, chaincode_name):
+        """ Returns id of the poll bound to a chaincode or None """
+        if chaincode_name not in self._poll_ids:
+            poll_id = ChaincodeInstance.objects \
+                .filter(name=chaincode_name, poll__isnull=False) \
+                .values_list("poll_id", flat=True) \
+                .first()
+            if poll_id is None:
+                return None
+            self._poll_ids[chaincode_name] = poll_id
+        return self._poll_ids[chaincode_name]
+
+
+def _deploy(instance):
+    """ Instantiates a chaincode and records the outcome """
+    try:
+        get_network_client().deploy_chaincode(instance.name)
+    except Exception as ex:
+        logger.exception("Chaincode %s could not be instantiated", instance.name)
+        instance.status = ChaincodeInstance.FAILED
+        instance.save(update_fields=["status", "updated"])
+        raise ex
+    instance.status = ChaincodeInstance.READY
+    instance.save(update_fields=["status", "updated"])
+    return instance
+
+
+def _bind_warm_instance(poll_id):
+    """
+    Binds a ready, unbound chaincode from the pool to a poll,
+    returns None when the pool is empty
+    """
+    try:
+        with transaction.atomic():
+            instance = ChaincodeInstance.objects \
+                .select_for_update(skip_locked=True) \
+                .filter(poll=None, status=ChaincodeInstance.READY) \
+                .exclude(name=SHARED_CHAINCODE_NAME) \
+                .order_by("id") \
+                .first()
+            if instance is not None:
+                instance.poll_id = poll_id
+                instance.save(update_fields=["poll", "updated"])
+    except IntegrityError:
+        # another worker bound a chaincode to the poll first
+        return ChaincodeInstance.objects.filter(poll_id=poll_id).first()
+    return instance
+
+
+def _sync_candidates(poll_id):
+    """
+    Adds candidates created while the poll was provisioning to its chaincode and marks it ready.
+    The poll row is only locked to read its candidates and to mark it ready,
+    never across a ledger call; candidates changed in the meantime are found
+    when marking it ready and synced in another round.
+    """
+    synced = set()
+    while True:
+        with transaction.atomic():
+            poll = Poll.objects.select_for_update().filter(id=poll_id).first()
+            if poll is None or poll.provisioning_status == Poll.READY:
+                return
+            names = set(poll.candidates.values_list("name", flat=True))
+            if names == synced:
+                poll.provisioning_status = Poll.READY
+                poll.save(update_fields=["provisioning_status"])
+                return
+        votechain_client = get_network_client()
+        added = sorted(names - synced)
+        if added:
+            votechain_client.add_candidates(poll_id, added)
+        deleted = sorted(synced - names)
+        if deleted:
+            votechain_client.delete_candidates(poll_id, deleted)
+        synced = names
+
+
+def _get_or_create_instance(name, poll_id=None):
+    """ Returns the record of a chaincode to deploy, None while another worker instantiates it """
+    instance, created = ChaincodeInstance.objects.get_or_create(
+        name=name,
+        defaults={"poll_id": poll_id}
+    )
+    if not created and instance.status == ChaincodeInstance.PROVISIONING:
+        return None
+    return instance
+
+
+def provision_poll(poll_id):
+    """
+    Gives a poll its chaincode: the shared chaincode for polls hosted by it,
+    otherwise a warm one from the pool when available or a dedicated one instantiated for the poll.
+    """
+    if Poll.objects.filter(id=poll_id, shared_chaincode=True).exists():
+        instance = _get_or_create_instance(SHARED_CHAINCODE_NAME)
+    else:
+        instance = ChaincodeInstance.objects.filter(poll_id=poll_id).first()
+        if instance is None:
+            instance = _bind_warm_instance(poll_id)
+        if instance is None:
+            instance = _get_or_create_instance(CHAINCODE_PREFIX + str(poll_id), poll_id)
+        elif instance.status == ChaincodeInstance.PROVISIONING:
+            instance = None
+    if instance is None:
+        # being instantiated by another worker
+        return
+    try:
+        if instance.status != ChaincodeInstance.READY:
+            _deploy(instance)
+        _sync_candidates(poll_id)
+    except Exception as ex:
+        Poll.objects \
+            .filter(id=poll_id, provisioning_status=Poll.PROVISIONING) \
+            .update(provisioning_status=Poll.FAILED)
+        raise ex
+
+
+def expire_stale(older_than):
+    """ Fails chaincodes stuck provisioning for more than older_than seconds, e.g. after a crash """
+    return ChaincodeInstance.objects \
+        .filter(
+            status=ChaincodeInstance.PROVISIONING,
+            updated__lt=timezone.now() - timedelta(seconds=older_than)
+        ) \
+        .update(status=ChaincodeInstance.FAILED)
+
+
+def fill_pool(size):
+    """ Instantiates chaincodes until size of them wait unbound, returns the number deployed """
+    available = ChaincodeInstance.objects \
+        .filter(poll=None) \
+        .exclude(status=ChaincodeInstance.FAILED) \
+        .exclude(name=SHARED_CHAINCODE_NAME) \
+        .count()
+    deployed = 0
+    for _ in range(size - available):
+        instance = ChaincodeInstance.objects.create(
+            name=CHAINCODE_PREFIX + "pool-" + uuid.uuid4().hex[:12]
+        )
+        try:
+            _deploy(instance)
+        except Exception:
+            continue
+        deployed += 1
+    return deployed
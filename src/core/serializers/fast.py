@@ -0,0 +1,176 @@
+""" Module serializing read-only responses from .values() rows instead of model instances """
+from collections import defaultdict
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.relations import ManyRelatedField, PrimaryKeyRelatedField, SlugRelatedField
+from rest_framework.settings import api_settings
+from core.serializers.serializers import CandidateNestedSerializer, PollSerializer, VoterSerializer
+
+# fields whose representation of a database value is the value itself
+IDENTITY_FIELDS = (
+    serializers.CharField,
+    serializers.IntegerField,
+    serializers.BooleanField,
+    serializers.ChoiceField,
+)
+PARENT_KEY = "fast_parent"
+
+
+class DateTimeMapper():
+    """
+    Formats datetimes like a DateTimeField, looking the current timezone up
+    once per serialization instead of once per value
+    """
+    def __init__(self, field):
+        self.field = field
+        self.output_format = getattr(field, "format", api_settings.DATETIME_FORMAT)
+
+    @staticmethod
+    def compile(field):
+        """
+        Returns a DateTimeMapper for the field,
+        or its to_representation when it cannot be sped up
+        """
+        output_format = getattr(field, "format", api_settings.DATETIME_FORMAT)
+        if output_format is None or output_format.lower() == ISO_8601 or hasattr(field, "timezone"):
+            return field.to_representation
+        return DateTimeMapper(field)
+
+    def bind(self, zone):
+        """ Returns the mapper of values in zone, the current timezone """
+        to_representation = self.field.to_representation
+        if zone is None:
+            return to_representation
+        output_format = self.output_format
+
+        def represent(value):
+            if value.tzinfo is None:
+                return to_representation(value)
+            return value.astimezone(zone).strftime(output_format)
+        return represent
+
+
+class ValuesSerializer():
+    """
+    Read-only twin of a ModelSerializer giving the same output from .values() rows.
+    Its fields are compiled once into mappers: plain fields are copied as they are or
+    go through their field's to_representation, slug related fields are read through a join,
+    nested serializers and many related primary keys are loaded with one query per relation,
+    like prefetch_related does.
+    """
+    def __init__(self, serializer_class):
+        self.serializer_class = serializer_class
+        self.model = serializer_class.Meta.model
+        self.pk_key = self.model._meta.pk.attname
+        self._entries = None
+
+    def _compile(self):
+        """ Returns (name, key, mapper, loader) of every field, mapper None for identity """
+        entries = []
+        for name, field in self.serializer_class().fields.items():
+            if field.write_only:
+                continue
+            if isinstance(field, serializers.ListSerializer):
+                entries.append((name, None, None, self._nested_loader(field)))
+            elif isinstance(field, ManyRelatedField) \
+                    and isinstance(field.child_relation, PrimaryKeyRelatedField):
+                entries.append((name, None, None, self._primary_keys_loader(field)))
+            elif isinstance(field, SlugRelatedField):
+                lookup = "{0}__{1}".format(field.source, field.slug_field)
+                entries.append((name, lookup, None, None))
+            elif isinstance(field, (serializers.BaseSerializer, serializers.RelatedField,
+                                    ManyRelatedField, serializers.SerializerMethodField)) \
+                    or field.source == "*" or "." in field.source:
+                raise ValueError("{0}.{1} cannot be serialized from values".format(
+                    self.serializer_class.__name__, name
+                ))
+            elif isinstance(field, serializers.DateTimeField):
+                entries.append((name, field.source, DateTimeMapper.compile(field), None))
+            else:
+                mapper = None if type(field) in IDENTITY_FIELDS else field.to_representation
+                entries.append((name, field.source, mapper, None))
+        return entries
+
+    def entries(self, fields=None):
+        """ Returns the compiled fields, limited to fields when given """
+        if self._entries is None:
+            self._entries = self._compile()
+        if fields is None:
+            return self._entries
+        return [entry for entry in self._entries if entry[0] in fields]
+
+    def _nested_loader(self, field):
+        """
+        Returns a loader of the rows of a reverse foreign key,
+        serialized and grouped by parent
+        """
+        child = ValuesSerializer(type(field.child))
+        parent = self.model._meta.get_field(field.source).field.name
+
+        def load(keys):
+            rows = child.values(
+                child.model.objects.filter(**{parent + "__in": keys}).order_by("pk"),
+                **{PARENT_KEY: F(parent)}
+            )
+            rows = list(rows)
+            grouped = defaultdict(list)
+            for row, item in zip(rows, child.serialize(rows)):
+                grouped[row[PARENT_KEY]].append(item)
+            return grouped
+        return load
+
+    def _primary_keys_loader(self, field):
+        """ Returns a loader of the primary keys of a many to many relation, grouped by parent """
+        relation = self.model._meta.get_field(field.source)
+        through = relation.remote_field.through
+        source, target = relation.m2m_column_name(), relation.m2m_reverse_name()
+
+        def load(keys):
+            rows = through.objects \
+                .filter(**{source + "__in": keys}) \
+                .order_by(target) \
+                .values_list(source, target)
+            grouped = defaultdict(list)
+            for parent, primary_key in rows:
+                grouped[parent].append(primary_key)
+            return grouped
+        return load
+
+    def values(self, queryset, fields=None, extra=(), **expressions):
+        """ Returns queryset as the .values() rows serialize needs, plus the extra keys """
+        keys = {self.pk_key, *extra}
+        keys.update(key for _, key, _, _ in self.entries(fields) if key is not None)
+        return queryset.prefetch_related(None).values(*sorted(keys), **expressions)
+
+    def serialize(self, rows, fields=None):
+        """ Serializes rows returned by values, limited to fields when given """
+        rows = list(rows)
+        zone = timezone.get_current_timezone() if settings.USE_TZ else None
+        entries = [
+            (name, key, mapper.bind(zone) if isinstance(mapper, DateTimeMapper) else mapper, loader)
+            for name, key, mapper, loader in self.entries(fields)
+        ]
+        keys = [row[self.pk_key] for row in rows]
+        related = {
+            name: loader(keys) if keys else {}
+            for name, _, _, loader in entries
+            if loader is not None
+        }
+        data = []
+        for row in rows:
+            item = {}
+            for name, key, mapper, loader in entries:
+                if loader is not None:
+                    item[name] = related[name].get(row[self.pk_key], [])
+                    continue
+                value = row[key]
+                item[name] = value if mapper is None or value is None else mapper(value)
+            data.append(item)
+        return data
+
+
+candidate_values = ValuesSerializer(CandidateNestedSerializer)
+poll_values = ValuesSerializer(PollSerializer)
+voter_values = ValuesSerializer(VoterSerializer)
@@ -1,7 +1,7 @@
 """ Module defining serializers for models """
 from django.contrib.auth import get_user_model, password_validation
 from rest_framework import serializers
-from core.models.models import Candidate, Poll, Voter
+from core.models.models import Candidate, Poll, Voter, VoteReceipt, ElectorateUpload
 
 
 User = get_user_model()
@@ -17,13 +17,20 @@ class CandidateNestedSerializer(serializers.ModelSerializer):
 
 
 class PollSerializer(serializers.ModelSerializer):
-    """ Serializer for poll model """
+    """ Serializer for poll model, fields limits the output to some of its fields """
     candidates = CandidateNestedSerializer(many=True, read_only=True)
     class Meta:
         model = Poll
         fields = "__all__"
+        read_only_fields = ("vote_shards", "provisioning_status", "shared_chaincode")
         depth = 1
 
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
     def validate(self, attrs):
         """
         Check that poll starts before it ends.
@@ -139,6 +146,35 @@ class TokenSerializer(serializers.Serializer):
         pass
 
 
+class VoteReceiptSerializer(serializers.ModelSerializer):
+    """ Serializer for the status of an asynchronously committed vote """
+    class Meta:
+        model = VoteReceipt
+        fields = ("receipt", "status")
+        read_only_fields = ("receipt", "status")
+
+
+class ElectorateUploadSerializer(serializers.ModelSerializer):
+    """ Serializer for the progress of an electorate upload """
+    progress = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ElectorateUpload
+        fields = (
+            "id", "poll", "format", "status", "size", "offset", "progress",
+            "lines", "assigned", "rejected", "error", "created", "updated"
+        )
+        read_only_fields = fields
+
+    def get_progress(self, obj):
+        """ Share of the file processed, from 0 to 1 """
+        if obj.status == ElectorateUpload.DONE:
+            return 1.0
+        if not obj.size:
+            return 0.0
+        return min(obj.offset / obj.size, 1.0)
+
+
 class CompleteUserSerializer(serializers.Serializer):
     user = UserSerializer()
     voter = VoterSerializer()
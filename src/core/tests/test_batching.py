@@ -0,0 +1,99 @@
+import asyncio
+import json
+import time
+from django.test import SimpleTestCase
+from votechain.batching import VoteBatcher
+
+
+class FakeLedger():
+    """ Commits batches of votes, records them and can fail them or leave votes out """
+    def __init__(self):
+        self.batches = []
+        self.error = None
+        self.dropped = set()
+
+    async def send_batch(self, key, votes):
+        """ Answers like the SendVotes chaincode function """
+        self.batches.append((key, votes))
+        await asyncio.sleep(0)
+        if self.error is not None:
+            raise self.error
+        return json.dumps({
+            "receipts": [receipt for receipt, _ in votes if receipt not in self.dropped]
+        })
+
+
+class VoteBatcherTests(SimpleTestCase):
+    """ Votes of a key are sent together and every voter gets the outcome of their own vote """
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.ledger = FakeLedger()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def vote(self, batcher, votes):
+        """ Submits (key, candidate, receipt) votes at once, returns their results or errors """
+        async def gather():
+            return await asyncio.wait_for(
+                asyncio.gather(
+                    *[batcher.submit(key, candidate, receipt) for key, candidate, receipt in votes],
+                    return_exceptions=True
+                ),
+                1
+            )
+
+        return self.loop.run_until_complete(gather())
+
+    def test_flush_at_size(self):
+        """ A full batch is sent right away, votes of other keys in batches of their own """
+        batcher = VoteBatcher(self.ledger.send_batch, 2, 60)
+        results = self.vote(batcher, [
+            ("poll1", "a", "r1"),
+            ("poll2", "a", "r2"),
+            ("poll1", "b", "r3"),
+            ("poll2", "b", "r4")
+        ])
+        self.assertEqual(len(results), 4)
+        self.assertEqual(self.ledger.batches, [
+            ("poll1", [("r1", "a"), ("r3", "b")]),
+            ("poll2", [("r2", "a"), ("r4", "b")])
+        ])
+
+    def test_flush_after_window(self):
+        """ A partial batch is sent once the window since its first vote passed """
+        batcher = VoteBatcher(self.ledger.send_batch, 10, 0.05)
+        started = time.monotonic()
+        self.vote(batcher, [("poll1", "a", "r1"), ("poll1", "b", "r2")])
+        self.assertGreaterEqual(time.monotonic() - started, 0.05)
+        self.assertEqual(self.ledger.batches, [("poll1", [("r1", "a"), ("r2", "b")])])
+
+    def test_fan_out(self):
+        """ Each vote is answered with its own receipt, generated when none was given """
+        batcher = VoteBatcher(self.ledger.send_batch, 3, 60)
+        results = self.vote(batcher, [
+            ("poll1", "a", "r1"),
+            ("poll1", "b", None),
+            ("poll1", "a", "r3")
+        ])
+        generated = self.ledger.batches[0][1][1][0]
+        self.assertEqual(
+            [json.loads(result) for result in results],
+            [{"txId": "r1"}, {"txId": generated}, {"txId": "r3"}]
+        )
+
+    def test_failed_batch(self):
+        """ A batch that failed as a whole fails every vote in it """
+        self.ledger.error = ValueError("endorsement failed")
+        batcher = VoteBatcher(self.ledger.send_batch, 2, 60)
+        results = self.vote(batcher, [("poll1", "a", "r1"), ("poll1", "b", "r2")])
+        self.assertEqual(results, [self.ledger.error, self.ledger.error])
+
+    def test_missing_receipt(self):
+        """ A vote missing from the committed batch fails, the others are committed """
+        self.ledger.dropped.add("r2")
+        batcher = VoteBatcher(self.ledger.send_batch, 2, 60)
+        committed, missing = self.vote(batcher, [("poll1", "a", "r1"), ("poll1", "b", "r2")])
+        self.assertEqual(json.loads(committed), {"txId": "r1"})
+        self.assertIsInstance(missing, RuntimeError)
+        self.assertIn("missing", str(missing))
@@ -0,0 +1,206 @@
+import io
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+from core import electorate
+from core.models.models import Poll, Voter, ElectorateUpload, VoteIdentificationToken
+
+# the tests read records with the module's internal helpers
+# pylint: disable=protected-access
+
+
+class ReadRecordTests(SimpleTestCase):
+    """ Records are read whole, but never longer than MAX_LINE """
+    def records(self, data, file_format=ElectorateUpload.CSV):
+        """ Returns the records of data, None for a rejected one """
+        source = io.BytesIO(data)
+        records = []
+        while True:
+            record = electorate._read_record(source, file_format)
+            if record == b"":
+                return records
+            records.append(record)
+
+    def test_lines(self):
+        """ A record ends with its line, the last one without a newline """
+        self.assertEqual(self.records(b"a@b.com\nc@d.com"), [b"a@b.com\n", b"c@d.com"])
+
+    def test_quoted_newline(self):
+        """ A quoted field goes on over the next lines """
+        data = b'"Doe,\nJane",jane@voter.com\n"Doe ""Jr""\r\nJohn",john@voter.com\nnext@voter.com\n'
+        self.assertEqual(self.records(data), [
+            b'"Doe,\nJane",jane@voter.com\n',
+            b'"Doe ""Jr""\r\nJohn",john@voter.com\n',
+            b"next@voter.com\n"
+        ])
+
+    def test_quote_within_field(self):
+        """ A quote within an unquoted field is a character like any other """
+        self.assertEqual(self.records(b'Jane "JD" Doe,a@b.com\nc@d.com\n'), [
+            b'Jane "JD" Doe,a@b.com\n',
+            b"c@d.com\n"
+        ])
+
+    def test_ndjson_quotes(self):
+        """ Quotes do not join NDJSON lines """
+        self.assertEqual(
+            self.records(b'"a@b.com\n{"email": "c@d.com"}\n', ElectorateUpload.NDJSON),
+            [b'"a@b.com\n', b'{"email": "c@d.com"}\n']
+        )
+
+    def test_overlong(self):
+        """ An overlong record is rejected and skipped up to its end """
+        long_line = b"x" * (electorate.MAX_LINE * 3) + b"\n"
+        self.assertEqual(self.records(long_line + b"a@b.com\n"), [None, b"a@b.com\n"])
+        self.assertEqual(
+            self.records(long_line + b"a@b.com\n", ElectorateUpload.NDJSON),
+            [None, b"a@b.com\n"]
+        )
+
+    def test_overlong_quoted(self):
+        """ An overlong quoted field is skipped up to the end of its record """
+        data = b'"' + b"x\n" * electorate.MAX_LINE + b'",a@b.com\nc@d.com\n'
+        self.assertEqual(self.records(data), [None, b"c@d.com\n"])
+
+    def test_unterminated_quote(self):
+        """ A quote open at the end of the file ends the record """
+        self.assertEqual(self.records(b'"a@b.com\nc@d.com\n'), [b'"a@b.com\nc@d.com\n'])
+
+
+class UploadTestCase(TestCase):
+    """ Runs uploads of files written to a temporary directory """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.poll = Poll.objects.create(title="poll", end=timezone.now() + timedelta(hours=1))
+        for index in range(5):
+            get_user_model().objects.create(
+                username="voter{0}".format(index),
+                email="voter{0}@voter.com".format(index)
+            )
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def create_upload(self, data, file_format=ElectorateUpload.CSV):
+        """ Writes data to a file and creates its upload """
+        path = os.path.join(self.directory, "electorate.{0}".format(file_format))
+        with open(path, "wb") as destination:
+            destination.write(data)
+        return ElectorateUpload.objects.create(
+            poll=self.poll,
+            path=path,
+            format=file_format,
+            size=len(data)
+        )
+
+    def assigned(self):
+        """ Returns emails of the voters authorized for the poll """
+        return sorted(Voter.objects.filter(polls=self.poll).values_list("user__email", flat=True))
+
+
+class CsvLayoutTests(UploadTestCase):
+    """ The email column is found by its header, the first one without it """
+    def test_header(self):
+        """ The email column is the first one named like it """
+        header = b'\xef\xbb\xbfName,"E-mail",Email\n'
+        upload = self.create_upload(header + b"Jane,x,voter0@voter.com\n")
+        self.assertEqual(electorate._csv_layout(upload.path), (2, len(header)))
+
+    def test_quoted_header(self):
+        """ A header with a quoted newline is skipped whole """
+        header = b'"Full\nname",email\n'
+        upload = self.create_upload(header + b"Jane,voter0@voter.com\n")
+        self.assertEqual(electorate._csv_layout(upload.path), (1, len(header)))
+
+    def test_no_header(self):
+        """ Without a header the first column holds the emails """
+        upload = self.create_upload(b"voter0@voter.com,Jane\n")
+        self.assertEqual(electorate._csv_layout(upload.path), (0, 0))
+
+    def test_binary(self):
+        """ A header that is not text is read as a record """
+        upload = self.create_upload(b"\xff\xfe\x00\n")
+        self.assertEqual(electorate._csv_layout(upload.path), (0, 0))
+
+
+class RunUploadTests(UploadTestCase):
+    """ Files are processed chunk by chunk and resumed from the last committed one """
+    def test_csv(self):
+        """ Valid emails are assigned, blank lines skipped and others rejected """
+        upload = self.create_upload(
+            b'name,email\n"Doe,\nJane",voter0@voter.com\n\nJohn,not an email\n'
+            b"Max, voter1@voter.com \n" + b"x" * (electorate.MAX_LINE + 1) +
+            b"\nAnn,nobody@voter.com"
+        )
+        upload = electorate.run_upload(upload.id)
+        self.assertEqual(upload.status, ElectorateUpload.DONE)
+        self.assertFalse(os.path.exists(upload.path))
+        upload = ElectorateUpload.objects.get(id=upload.id)
+        self.assertEqual((upload.lines, upload.assigned, upload.rejected), (5, 2, 2))
+        self.assertEqual(upload.offset, upload.size)
+        self.assertEqual(self.assigned(), ["voter0@voter.com", "voter1@voter.com"])
+
+    def test_ndjson(self):
+        """ Emails are read from objects and strings, anything else is rejected """
+        upload = self.create_upload(
+            b'{"email": "voter0@voter.com"}\n"voter1@voter.com"\n{"name": "x"}\nnot json\n[1]\n',
+            ElectorateUpload.NDJSON
+        )
+        electorate.run_upload(upload.id)
+        upload = ElectorateUpload.objects.get(id=upload.id)
+        self.assertEqual(upload.status, ElectorateUpload.DONE)
+        self.assertEqual((upload.lines, upload.assigned, upload.rejected), (5, 2, 3))
+        self.assertEqual(self.assigned(), ["voter0@voter.com", "voter1@voter.com"])
+
+    @mock.patch("core.electorate.ELECTORATE_CHUNK_SIZE", 2)
+    def test_resume(self):
+        """ Chunks before the committed offset are not read again """
+        first = b"email\nvoter0@voter.com\nvoter1@voter.com\n"
+        upload = self.create_upload(
+            first + b"voter2@voter.com\nvoter3@voter.com\nvoter4@voter.com\n"
+        )
+        ElectorateUpload.objects.filter(id=upload.id).update(
+            offset=len(first),
+            lines=2,
+            status=ElectorateUpload.RUNNING
+        )
+        electorate.run_upload(upload.id)
+        upload = ElectorateUpload.objects.get(id=upload.id)
+        self.assertEqual(upload.status, ElectorateUpload.DONE)
+        self.assertEqual((upload.lines, upload.assigned, upload.rejected), (5, 3, 0))
+        self.assertEqual(
+            self.assigned(),
+            ["voter2@voter.com", "voter3@voter.com", "voter4@voter.com"]
+        )
+
+    def test_done(self):
+        """ A finished upload is not run again """
+        upload = self.create_upload(b"voter0@voter.com\n")
+        ElectorateUpload.objects.filter(id=upload.id).update(status=ElectorateUpload.DONE)
+        electorate.run_upload(upload.id)
+        self.assertEqual(self.assigned(), [])
+
+    @mock.patch("core.electorate.ELECTORATE_CHUNK_SIZE", 1)
+    def test_superseded(self):
+        """ A worker whose chunk another one committed first stops and leaves no tokens behind """
+        upload = self.create_upload(b"voter0@voter.com\nvoter1@voter.com\n")
+        assign_tokens = VoteIdentificationToken.assign_tokens
+
+        def race(poll, emails):
+            assigned = assign_tokens(poll, emails)
+            # another worker committed this chunk meanwhile
+            ElectorateUpload.objects.filter(id=upload.id).update(offset=len(b"voter0@voter.com\n"))
+            return assigned
+
+        with mock.patch("core.electorate.VoteIdentificationToken.assign_tokens", race):
+            electorate.run_upload(upload.id)
+        upload = ElectorateUpload.objects.get(id=upload.id)
+        self.assertEqual(upload.status, ElectorateUpload.RUNNING)
+        self.assertEqual(upload.lines, 0)
+        self.assertEqual(self.assigned(), [])
+        self.assertTrue(os.path.exists(upload.path))
@@ -0,0 +1,139 @@
+import asyncio
+from types import SimpleNamespace
+from unittest import mock
+from django.test import SimpleTestCase
+from votechain.fabric_ledger import FabricLedger
+from votechain.peer_pool import PeerPool
+
+PAYLOAD = {"extension": {"response": {"payload": b'{"txId": "tx1"}'}}}
+
+# the fake hub mirrors hfc's API and the ledger's internals are replaced,
+# mocks patched onto a test class are passed to each of its tests, used or not
+# pylint: disable=invalid-name,protected-access,unused-argument
+
+
+class FakeHub():
+    """
+    Commit event stream delivering the newest block after a delay,
+    then the commit event on demand
+    """
+    def __init__(self, peer, channel, requestor, delay=0.01, fails=False):
+        self.delay = delay
+        self.fails = fails
+        self.disconnected = False
+        self.started = False
+        self.on_block = None
+        self.on_tx = None
+        self.ended = asyncio.get_event_loop().create_future()
+
+    def registerBlockEvent(self, unregister, onEvent):
+        """ Keeps the callback of the newest block """
+        self.on_block = onEvent
+
+    def registerTxEvent(self, tx_id, unregister, disconnect, onEvent):
+        """ Keeps a trigger of the commit event, which ends the stream """
+        def on_tx(status):
+            onEvent(tx_id, status, 6)
+            self.disconnect()
+        self.on_tx = on_tx
+
+    async def _stream(self):
+        """ Delivers the newest block after the delay, then waits for the end """
+        await asyncio.sleep(self.delay)
+        if self.fails:
+            raise ConnectionError("refused")
+        self.started = True
+        self.on_block({"number": 5})
+        await self.ended
+
+    def connect(self):
+        """ Returns the stream's coroutine like hfc's connect """
+        return self._stream()
+
+    def disconnect(self):
+        """ Ends the stream """
+        self.disconnected = True
+        if not self.ended.done():
+            self.ended.set_result(None)
+
+
+@mock.patch("votechain.fabric_ledger.decode_proposal_response_payload", return_value=PAYLOAD)
+@mock.patch("votechain.fabric_ledger.utils")
+@mock.patch("votechain.fabric_ledger.create_tx_prop_req")
+@mock.patch("votechain.fabric_ledger.create_tx_context", return_value=SimpleNamespace(tx_id="tx1"))
+class SendTransactionTests(SimpleTestCase):
+    """ Transactions are broadcast once their commit event stream is up """
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.ledger = FabricLedger.__new__(FabricLedger)
+        self.ledger.cli = mock.Mock()
+        self.ledger.user_org1 = mock.Mock()
+        self.ledger._peer_pool = PeerPool({"org1": ["peer0.org1"]})
+        endorsement = SimpleNamespace(response=SimpleNamespace(status=200, message=""), payload=b"")
+
+        async def endorse(tx_context, peers):
+            return [endorsement], None, None
+
+        self.ledger._endorse = endorse
+        self.hubs = []
+        self.broadcasts = []
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def hub(self, **kwargs):
+        """ Patches the ledger's hubs with fake ones """
+        def create(*args):
+            hub = FakeHub(*args, **kwargs)
+            self.hubs.append(hub)
+            return hub
+        return mock.patch("votechain.fabric_ledger.ChannelEventHub", side_effect=create)
+
+    def orderer(self, utils, status="VALID"):
+        """ Patches the orderer, committing broadcast transactions with status """
+        async def send_transaction(orderers, tran_req, tx_context):
+            hub = self.hubs[-1]
+            self.broadcasts.append(hub.started)
+            if status is not None:
+                self.loop.call_soon(hub.on_tx, status)
+            yield SimpleNamespace(status=200)
+
+        utils.send_transaction = send_transaction
+
+    def send(self):
+        """ Sends a vote transaction """
+        return self.loop.run_until_complete(
+            self.ledger.send_transaction("Votechain-1", ["SendVote", "a"])
+        )
+
+    def test_broadcast_after_stream_started(self, create_tx_context, create_tx_prop_req, utils,
+                                            decode):
+        """ The transaction is only broadcast once the stream is up """
+        self.orderer(utils)
+        with self.hub(delay=0.05):
+            self.assertEqual(self.send(), '{"txId": "tx1"}')
+        self.assertEqual(self.broadcasts, [True])
+        self.assertTrue(self.hubs[0].ended.done())
+
+    def test_stream_failed(self, create_tx_context, create_tx_prop_req, utils, decode):
+        """ A stream that cannot connect fails the transaction before it is broadcast """
+        self.orderer(utils)
+        with self.hub(fails=True), self.assertRaisesMessage(ConnectionError, "peer0.org1"):
+            self.send()
+        self.assertEqual(self.broadcasts, [])
+
+    def test_invalid(self, create_tx_context, create_tx_prop_req, utils, decode):
+        """ An invalid transaction raises its validation code """
+        self.orderer(utils, "MVCC_READ_CONFLICT")
+        with self.hub(), self.assertRaisesMessage(Exception, "MVCC_READ_CONFLICT"):
+            self.send()
+
+    @mock.patch("votechain.fabric_ledger.COMMIT_EVENT_TIMEOUT", 0.05)
+    def test_commit_timeout(self, create_tx_context, create_tx_prop_req, utils, decode):
+        """ A commit event not arriving in time raises and ends the stream """
+        self.orderer(utils, None)
+        with self.hub(), self.assertRaisesMessage(TimeoutError, "waitForEvent timed out."):
+            self.send()
+        self.assertTrue(self.hubs[0].disconnected)
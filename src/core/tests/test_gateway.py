@@ -0,0 +1,196 @@
+import asyncio
+import json
+import time
+from unittest import mock
+from django.test import RequestFactory, SimpleTestCase
+from core.middleware import LedgerDeadlineMiddleware
+from votechain.gateway import Gateway, CircuitBreaker, GatewayBusyError, DeadlineExceededError, \
+    get_deadline, set_deadline
+from votechain.hyperledger import VotechainNetworkClient
+from votechain.settings import REQUEST_DEADLINE
+
+# the tests look at the gateway's, the client's and the middleware's internals
+# pylint: disable=protected-access
+
+
+class GatewayTestCase(SimpleTestCase):
+    """ Runs gateway calls on a loop of its own """
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.release = self.loop.create_future()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def run_on_loop(self, coroutine):
+        """ Runs a coroutine on the test's loop """
+        return self.loop.run_until_complete(coroutine)
+
+    async def blocked(self):
+        """ Request holding its slot until released """
+        await self.release
+        return "done"
+
+    @staticmethod
+    def deadline(seconds):
+        """ Returns the deadline seconds from now """
+        return time.monotonic() + seconds
+
+
+class GatewayTests(GatewayTestCase):
+    """ Calls of a poll beyond its limit queue, up to the queue size and their deadline """
+    def setUp(self):
+        super().setUp()
+        self.gateway = Gateway(1, 1, 2.5, CircuitBreaker(0, 1))
+
+    def test_queue_full(self):
+        """ Calls past the limit and the queue are refused with a retry delay """
+        async def calls():
+            first = asyncio.ensure_future(self.gateway.call(1, self.blocked, self.deadline(5)))
+            await asyncio.sleep(0)
+            queued = asyncio.ensure_future(self.gateway.call(1, self.blocked, self.deadline(5)))
+            await asyncio.sleep(0)
+            with self.assertRaises(GatewayBusyError) as refused:
+                await self.gateway.call(1, self.blocked, self.deadline(5))
+            self.assertEqual(refused.exception.retry_after, 2.5)
+            # other polls and background jobs without a deadline are not refused
+            background = asyncio.ensure_future(self.gateway.call(1, self.blocked))
+            other = asyncio.ensure_future(self.gateway.call(2, self.blocked, self.deadline(5)))
+            self.release.set_result(None)
+            return await asyncio.gather(first, queued, background, other)
+
+        self.assertEqual(self.run_on_loop(calls()), ["done"] * 4)
+        self.assertEqual(self.gateway.waiting, 0)
+        self.assertEqual(self.gateway._slots, {})
+
+    def test_deadline_while_queued(self):
+        """ A queued call is refused once its deadline passed """
+        async def calls():
+            first = asyncio.ensure_future(self.gateway.call(1, self.blocked))
+            await asyncio.sleep(0)
+            with self.assertRaisesMessage(GatewayBusyError, "Deadline passed"):
+                await self.gateway.call(1, self.blocked, self.deadline(0.01))
+            self.release.set_result(None)
+            return await first
+
+        self.assertEqual(self.run_on_loop(calls()), "done")
+
+
+class CircuitBreakerTests(GatewayTestCase):
+    """ The breaker opens on network failures and closes after a successful probe """
+    def setUp(self):
+        super().setUp()
+        self.breaker = CircuitBreaker(2, 0.05)
+        self.gateway = Gateway(0, 0, 1, self.breaker)
+
+    def fail_with(self, error):
+        """ Makes a call raising error """
+        async def request():
+            raise error
+        with self.assertRaises(type(error)):
+            self.run_on_loop(self.gateway.call(1, request))
+
+    def succeed(self):
+        """ Makes a call returning done """
+        async def request():
+            return "done"
+        return self.run_on_loop(self.gateway.call(1, request))
+
+    def test_opens(self):
+        """ Consecutive network failures open the breaker, chaincode errors do not count """
+        self.fail_with(ConnectionError())
+        self.fail_with(ValueError("Candidate doesn't exist"))
+        self.fail_with(ConnectionError())
+        self.assertIsNone(self.breaker.opened_at)
+        self.fail_with(ConnectionError())
+        with self.assertRaises(GatewayBusyError) as refused:
+            self.succeed()
+        self.assertGreater(refused.exception.retry_after, 0)
+
+    def test_half_open(self):
+        """ A single successful probe closes the breaker """
+        self.fail_with(ConnectionError())
+        self.fail_with(ConnectionError())
+        self.run_on_loop(asyncio.sleep(0.06))
+
+        async def probe():
+            await self.release
+            return "probed"
+
+        async def calls():
+            first = asyncio.ensure_future(self.gateway.call(1, probe))
+            await asyncio.sleep(0)
+            # a single probe at a time
+            with self.assertRaises(GatewayBusyError):
+                await self.gateway.call(1, probe)
+            self.release.set_result(None)
+            return await first
+
+        self.assertEqual(self.run_on_loop(calls()), "probed")
+        self.assertIsNone(self.breaker.opened_at)
+        self.assertEqual(self.succeed(), "done")
+
+    def test_failed_probe(self):
+        """ A failed probe opens the breaker again """
+        self.fail_with(ConnectionError())
+        self.fail_with(ConnectionError())
+        self.run_on_loop(asyncio.sleep(0.06))
+        self.fail_with(TimeoutError())
+        with self.assertRaises(GatewayBusyError):
+            self.succeed()
+
+
+class DeadlineTests(SimpleTestCase):
+    """ Requests get a deadline for the ledger and errors of the gateway get their status """
+    def tearDown(self):
+        set_deadline(None)
+
+    def middleware(self, get_response=lambda request: None):
+        """ Returns the middleware in front of get_response """
+        return LedgerDeadlineMiddleware(get_response)
+
+    def test_deadline_header(self):
+        """ The deadline of a request is set while it is handled """
+        deadlines = []
+        request = RequestFactory().get("/", HTTP_X_REQUEST_TIMEOUT="0.5")
+        self.middleware(lambda request: deadlines.append(get_deadline()))(request)
+        self.assertIsNotNone(deadlines[0])
+        self.assertIsNone(get_deadline())
+
+    def test_invalid_deadline_header(self):
+        """ Timeouts that are not a positive number of seconds fall back to REQUEST_DEADLINE """
+        middleware = self.middleware()
+        for timeout in ("nan", "inf", "-inf", "0", "-1", "soon"):
+            request = RequestFactory().get("/", HTTP_X_REQUEST_TIMEOUT=timeout)
+            self.assertEqual(middleware._timeout(request), REQUEST_DEADLINE, timeout)
+        request = RequestFactory().get("/", HTTP_X_REQUEST_TIMEOUT="1e9")
+        self.assertEqual(middleware._timeout(request), REQUEST_DEADLINE)
+        request = RequestFactory().get("/", HTTP_X_REQUEST_TIMEOUT="0.5")
+        self.assertEqual(middleware._timeout(request), 0.5)
+
+    def test_busy(self):
+        """ A saturated gateway answers 503 with Retry-After """
+        response = self.middleware().process_exception(None, GatewayBusyError("Busy", 2.5))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "3")
+        self.assertEqual(json.loads(response.content), {"detail": "Busy"})
+
+    def test_deadline_exceeded(self):
+        """ A ledger call past its deadline answers 504 """
+        response = self.middleware().process_exception(None, DeadlineExceededError())
+        self.assertEqual(response.status_code, 504)
+        self.assertIsNone(self.middleware().process_exception(None, ValueError()))
+
+    def test_call_after_deadline(self):
+        """ Calls are not made after the deadline and get what is left of it """
+        client = VotechainNetworkClient.__new__(VotechainNetworkClient)
+        client._gateway = mock.Mock()
+        client.run = mock.Mock()
+        set_deadline(0)
+        with self.assertRaises(DeadlineExceededError):
+            client._call(1, mock.Mock())
+        client.run.assert_not_called()
+        client._gateway.call.assert_not_called()
+        set_deadline(5)
+        client._call(1, mock.Mock())
+        self.assertLessEqual(client.run.call_args[0][1], 5)
@@ -1,13 +1,39 @@
+import concurrent.futures
+import uuid
 from datetime import timedelta
+from unittest import mock
+from unittest import skipUnless
 from rest_framework.test import APITestCase, APIRequestFactory, URLPatternsTestCase, \
     force_authenticate
 from rest_framework import status
+from rest_framework.renderers import JSONRenderer
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.signing import Signer
+from django.db import connection
+from django.test import SimpleTestCase
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from django.urls import include, path, reverse
 from votechain import settings
-from core.models.models import Poll
-from core.views.admin_poll_view import AdminListOrCreatePoll
+from votechain.hyperledger import LedgerTimeoutError, VoteRejectedError
+from core.models.models import Poll, Candidate, Voter, VoteIdentificationToken, VoteReceipt, \
+    Trail, OutboxEmail
+from core import vvpat
+from core.outbox import take_due, purge
+from core.serializers.fast import poll_values, voter_values
+from core.serializers.serializers import PollSerializer, VoterSerializer
+from core.views.admin_poll_view import AdminListOrCreatePoll, AdminListOrAddCandidate, \
+    AdminGetDeleteCandidate
+from core.views.voter_view import VoterCastVote, VoterListPoll, VoterGetVoteStatus, commit_vote
+
+# mocks patched onto a test class are passed to each of its tests, used or not
+# pylint: disable=unused-argument
+
+# tables that stay small, every other one may grow to millions of rows
+SMALL_TABLES = ("core_chaincodeinstance", "core_ledgercheckpoint")
+# rows of other polls and voters in each large table of query plan tests
+SEED_ROWS = 2000
 
 
 def datetime_to_string(datetime):
@@ -127,3 +153,537 @@ class PollTests(APITestCase, URLPatternsTestCase):
         self.assertEqual(Poll.objects.count(), count)
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertEqual(len(response.data), 1)
+
+
+@mock.patch("core.views.admin_poll_view.get_network_client")
+class CandidateTests(APITestCase):
+    """ Candidates reach the ledger of provisioned polls, provisioning ones are synced later """
+    fixtures = [ "test_data.json" ]
+
+    def setUp(self):
+        cache.clear()
+        self.admin_user = get_user_model().objects.get(username="admin")
+        datenow = timezone.now()
+        self.poll = Poll.objects.create(
+            title="poll",
+            start=datenow + timedelta(days=1),
+            end=datenow + timedelta(days=2)
+        )
+
+    def add_candidate(self, name):
+        """ Adds a candidate to the poll as the admin """
+        request = APIRequestFactory().post(
+            reverse("admin_list_candidates", kwargs={"poll_id": self.poll.id}),
+            {"name": name},
+            format="json"
+        )
+        force_authenticate(request, user=self.admin_user)
+        return AdminListOrAddCandidate.as_view()(request, poll_id=self.poll.id)
+
+    def delete_candidate(self, candidate):
+        """ Deletes a candidate of the poll as the admin """
+        kwargs = {"poll_id": self.poll.id, "id": candidate.id}
+        request = APIRequestFactory().delete(reverse("admin_get_delete_candidate", kwargs=kwargs))
+        force_authenticate(request, user=self.admin_user)
+        return AdminGetDeleteCandidate.as_view()(request, **kwargs)
+
+    def test_add_to_provisioned(self, get_network_client):
+        """ A candidate of a provisioned poll is added to its chaincode """
+        response = self.add_candidate("candidate")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        get_network_client.return_value.add_candidates \
+            .assert_called_once_with(self.poll.id, ["candidate"])
+        self.assertTrue(Candidate.objects.filter(poll=self.poll, name="candidate").exists())
+
+    def test_add_to_provisioning(self, get_network_client):
+        """ A candidate of a provisioning poll is only stored """
+        Poll.objects.filter(id=self.poll.id).update(provisioning_status=Poll.PROVISIONING)
+        response = self.add_candidate("candidate")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        get_network_client.return_value.add_candidates.assert_not_called()
+        self.assertTrue(Candidate.objects.filter(poll=self.poll, name="candidate").exists())
+
+    def test_add_twice(self, get_network_client):
+        """ A candidate name is only added once to a poll """
+        self.add_candidate("candidate")
+        response = self.add_candidate("candidate")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Candidate.objects.filter(poll=self.poll).count(), 1)
+
+    def test_delete_from_provisioned(self, get_network_client):
+        """ A candidate of a provisioned poll is deleted from its chaincode """
+        candidate = Candidate.objects.create(name="candidate", poll=self.poll)
+        response = self.delete_candidate(candidate)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        get_network_client.return_value.delete_candidates \
+            .assert_called_once_with(self.poll.id, ["candidate"])
+        self.assertFalse(Candidate.objects.filter(id=candidate.id).exists())
+
+    def test_delete_from_provisioning(self, get_network_client):
+        """ A candidate of a provisioning poll is only deleted from the database """
+        Poll.objects.filter(id=self.poll.id).update(provisioning_status=Poll.PROVISIONING)
+        candidate = Candidate.objects.create(name="candidate", poll=self.poll)
+        response = self.delete_candidate(candidate)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        get_network_client.return_value.delete_candidates.assert_not_called()
+        self.assertFalse(Candidate.objects.filter(id=candidate.id).exists())
+
+
+@mock.patch("core.views.voter_view.send_vvpat")
+@mock.patch("core.views.voter_view.get_network_client")
+class VoteQueryTests(APITestCase):
+    """ Pins the number of queries of the vote path """
+    def setUp(self):
+        datenow = timezone.now()
+        self.poll = Poll.objects.create(
+            title="poll",
+            start=datenow - timedelta(hours=1),
+            end=datenow + timedelta(hours=1)
+        )
+        self.candidate = Candidate.objects.create(name="candidate", poll=self.poll)
+        for index in range(20):
+            Candidate.objects.create(name="other{0}".format(index), poll=self.poll)
+        self.user = get_user_model().objects.create(username="voter", email="voter@voter.com")
+        Voter.objects.get(user=self.user).polls.add(self.poll)
+        self.vit = VoteIdentificationToken.generate_token(self.poll)
+
+    def cast_vote(self, token, candidate_id=None, user=None):
+        """ Casts a vote as the voter, or as another user """
+        request = APIRequestFactory().post("/", {"token": str(token)}, format="json")
+        force_authenticate(request, user=user or self.user)
+        # throttling would refuse votes of back to back tests
+        return VoterCastVote.as_view(throttle_classes=[])(
+            request,
+            poll_id=self.poll.id,
+            candidate_id=candidate_id or self.candidate.id
+        )
+
+    def test_vote_queries(self, get_network_client, send_vvpat):
+        """ Ballot lookup and vit claim, the vvpat needs no write """
+        get_network_client.return_value.cast_vote.return_value = '{"txId": "tx"}'
+        with self.assertNumQueries(2):
+            response = self.cast_vote(self.vit.token)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(VoteIdentificationToken.objects.get(id=self.vit.id).used)
+        get_network_client.return_value.cast_vote.assert_called_once_with(
+            self.poll.id, self.candidate.name, self.poll.vote_shards
+        )
+
+    def test_async_vote_queries(self, get_network_client, send_vvpat):
+        """ Ballot lookup, vit claim and receipt insert, the ledger is left to the background """
+        with mock.patch("core.views.voter_view.VOTE_ASYNC", True), self.assertNumQueries(3):
+            response = self.cast_vote(self.vit.token)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(VoteReceipt.objects.filter(vit_id=self.vit.id).count(), 1)
+        get_network_client.return_value.cast_vote.assert_not_called()
+
+    def test_used_vit_queries(self, get_network_client, send_vvpat):
+        """ A used vit is refused by the ballot lookup alone """
+        VoteIdentificationToken.objects.filter(id=self.vit.id).update(used=True)
+        with self.assertNumQueries(1):
+            response = self.cast_vote(self.vit.token)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        get_network_client.return_value.cast_vote.assert_not_called()
+
+    def test_timed_out_vote(self, get_network_client, send_vvpat):
+        """ A vote that may still commit keeps its vit and is reported pending """
+        get_network_client.return_value.cast_vote.side_effect = TimeoutError("timed out")
+        response = self.cast_vote(self.vit.token)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data["status"], VoteReceipt.PENDING)
+        self.assertTrue(VoteIdentificationToken.objects.get(id=self.vit.id).used)
+        send_vvpat.assert_not_called()
+
+    def test_superuser_vote(self, get_network_client, send_vvpat):
+        """ A superuser votes in polls not assigned to them, as long as they are a voter """
+        get_network_client.return_value.cast_vote.return_value = '{"txId": "tx"}'
+        admin_user = get_user_model().objects.create_superuser("admin", "admin@admin.com", "admin")
+        with self.assertNumQueries(2):
+            response = self.cast_vote(self.vit.token, user=admin_user)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(VoteIdentificationToken.objects.get(id=self.vit.id).used)
+
+    def test_superuser_without_voter(self, get_network_client, send_vvpat):
+        """ A superuser who is not a voter cannot vote """
+        admin_user = get_user_model().objects.create_superuser("admin", "admin@admin.com", "admin")
+        Voter.objects.filter(user=admin_user).delete()
+        response = self.cast_vote(self.vit.token, user=admin_user)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(VoteIdentificationToken.objects.get(id=self.vit.id).used)
+        get_network_client.return_value.cast_vote.assert_not_called()
+
+    def test_foreign_candidate(self, get_network_client, send_vvpat):
+        """ A candidate of another poll is not found """
+        other_poll = Poll.objects.create(title="other", end=timezone.now() + timedelta(hours=1))
+        other_candidate = Candidate.objects.create(name="candidate", poll=other_poll)
+        with self.assertNumQueries(1):
+            response = self.cast_vote(self.vit.token, other_candidate.id)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(VoteIdentificationToken.objects.get(id=self.vit.id).used)
+
+
+@mock.patch("core.views.voter_view.get_network_client")
+class AsyncVoteTests(APITestCase):
+    """ Votes accepted with 202 and committed in the background """
+    def setUp(self):
+        # requests of other tests within the same second would be throttled
+        cache.clear()
+        datenow = timezone.now()
+        self.poll = Poll.objects.create(
+            title="poll",
+            start=datenow - timedelta(hours=1),
+            end=datenow + timedelta(hours=1)
+        )
+        self.candidate = Candidate.objects.create(name="candidate", poll=self.poll)
+        self.user = get_user_model().objects.create(username="voter", email="voter@voter.com")
+        Voter.objects.get(user=self.user).polls.add(self.poll)
+        self.vit = VoteIdentificationToken.generate_token(self.poll)
+
+    def accept(self):
+        """ Casts a vote in async mode, returns the response and the scheduled job """
+        request = APIRequestFactory().post("/", {"token": str(self.vit.token)}, format="json")
+        force_authenticate(request, user=self.user)
+        with mock.patch("core.views.voter_view.VOTE_ASYNC", True), \
+                mock.patch(
+                    "core.views.voter_view.transaction.on_commit",
+                    lambda callback: callback()
+                ), \
+                mock.patch("core.views.voter_view.background.submit") as submit:
+            response = VoterCastVote.as_view(throttle_classes=[])(
+                request,
+                poll_id=self.poll.id,
+                candidate_id=self.candidate.id
+            )
+        return response, submit
+
+    def get_status(self, receipt, user=None):
+        """ Asks for the status of a vote """
+        request = APIRequestFactory().get("/")
+        force_authenticate(request, user=user or self.user)
+        return VoterGetVoteStatus.as_view()(request, poll_id=self.poll.id, receipt=receipt)
+
+    def test_accepted(self, get_network_client):
+        """ The receipt is pending and only the job knows the candidate """
+        response, submit = self.accept()
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data["status"], VoteReceipt.PENDING)
+        receipt = VoteReceipt.objects.get(receipt=response.data["receipt"])
+        self.assertNotIn("candidate", [field.name for field in VoteReceipt._meta.get_fields()])
+        submit.assert_called_once_with(commit_vote, receipt.id, self.candidate.name)
+        get_network_client.return_value.cast_vote.assert_not_called()
+        self.assertTrue(VoteIdentificationToken.objects.get(id=self.vit.id).used)
+
+    def test_committed(self, get_network_client):
+        """ A committed vote is reported and its vvpat queued """
+        get_network_client.return_value.cast_vote.return_value = '{"txId": "tx"}'
+        response, _ = self.accept()
+        receipt = VoteReceipt.objects.get(receipt=response.data["receipt"])
+        commit_vote(receipt.id, self.candidate.name)
+        get_network_client.return_value.cast_vote.assert_called_once_with(
+            self.poll.id, self.candidate.name, self.poll.vote_shards
+        )
+        response = self.get_status(receipt.receipt)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["status"], VoteReceipt.COMMITTED)
+        self.assertEqual(OutboxEmail.objects.filter(recipient=self.user.email).count(), 1)
+
+    def test_failed(self, get_network_client):
+        """ A vote the ledger refused fails and gives its vit back """
+        get_network_client.return_value.cast_vote.side_effect = \
+            VoteRejectedError("Candidate doesn't exist")
+        response, _ = self.accept()
+        receipt = VoteReceipt.objects.get(receipt=response.data["receipt"])
+        commit_vote(receipt.id, self.candidate.name)
+        self.assertEqual(self.get_status(receipt.receipt).data["status"], VoteReceipt.FAILED)
+        self.assertFalse(VoteIdentificationToken.objects.get(id=self.vit.id).used)
+
+    def test_timed_out(self, get_network_client):
+        """ A vote that may still commit stays pending and keeps its vit """
+        get_network_client.return_value.cast_vote.side_effect = TimeoutError("timed out")
+        response, _ = self.accept()
+        receipt = VoteReceipt.objects.get(receipt=response.data["receipt"])
+        commit_vote(receipt.id, self.candidate.name)
+        self.assertEqual(self.get_status(receipt.receipt).data["status"], VoteReceipt.PENDING)
+        self.assertTrue(VoteIdentificationToken.objects.get(id=self.vit.id).used)
+
+    def test_timed_out_then_settled(self, get_network_client):
+        """ A vote that timed out is settled once its ledger call finishes """
+        for result, expected_status, used in (
+                ('{"txId": "tx"}', VoteReceipt.COMMITTED, True),
+                (VoteRejectedError("Candidate doesn't exist"), VoteReceipt.FAILED, False)):
+            VoteReceipt.objects.all().delete()
+            VoteIdentificationToken.objects.filter(id=self.vit.id).update(used=False)
+            future = concurrent.futures.Future()
+            get_network_client.return_value.cast_vote.side_effect = \
+                LedgerTimeoutError("timed out", future)
+            response, _ = self.accept()
+            receipt = VoteReceipt.objects.get(receipt=response.data["receipt"])
+            with mock.patch(
+                    "core.views.voter_view.background.submit",
+                    lambda function, *args: function(*args)):
+                commit_vote(receipt.id, self.candidate.name)
+                self.assertEqual(VoteReceipt.objects.get(id=receipt.id).status, VoteReceipt.PENDING)
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+            self.assertEqual(VoteReceipt.objects.get(id=receipt.id).status, expected_status)
+            self.assertEqual(VoteIdentificationToken.objects.get(id=self.vit.id).used, used)
+
+    def test_status_of_another_voter(self, get_network_client):
+        """ A receipt is only reported to its voter """
+        response, _ = self.accept()
+        other = get_user_model().objects.create(username="other", email="other@voter.com")
+        self.assertEqual(
+            self.get_status(response.data["receipt"], other).status_code,
+            status.HTTP_404_NOT_FOUND
+        )
+        self.assertEqual(self.get_status(uuid.uuid4()).status_code, status.HTTP_404_NOT_FOUND)
+
+
+class FastSerializerTests(APITestCase):
+    """ Serializers of .values() rows give the same output as DRF serializers """
+    def setUp(self):
+        datenow = timezone.now()
+        self.user = get_user_model().objects.create(username="voter", email="voter@voter.com")
+        voter = Voter.objects.get(user=self.user)
+        for index in range(6):
+            poll = Poll.objects.create(
+                title="poll{0}".format(index),
+                start=None if index == 0 else datenow + timedelta(hours=index),
+                end=datenow + timedelta(days=1),
+                isActive=index % 2 == 0
+            )
+            for candidate in range(index % 3):
+                Candidate.objects.create(name="candidate{0}".format(candidate), poll=poll)
+            if index % 2:
+                voter.polls.add(poll)
+        get_user_model().objects.create(username="other", email="other@voter.com")
+
+    def assertSameOutput(self, expected, actual):  # pylint: disable=invalid-name
+        """ Compares rendered JSON, so field order counts as well """
+        self.assertEqual(JSONRenderer().render(expected), JSONRenderer().render(actual))
+
+    def test_polls(self):
+        """ Polls with nested candidates, and limited to some fields """
+        polls = Poll.objects.all()
+        self.assertSameOutput(
+            PollSerializer(polls, many=True).data,
+            poll_values.serialize(poll_values.values(polls))
+        )
+        fields = ["id", "title", "end"]
+        self.assertSameOutput(
+            PollSerializer(polls, many=True, fields=fields).data,
+            poll_values.serialize(poll_values.values(polls, fields), fields)
+        )
+
+    def test_voters(self):
+        """ Voters with their user's email and polls """
+        voters = Voter.objects.all()
+        self.assertSameOutput(
+            VoterSerializer(voters, many=True).data,
+            voter_values.serialize(voter_values.values(voters))
+        )
+
+    def test_poll_list(self):
+        """ Poll listing responses, paginated or not, do not change with FAST_SERIALIZERS """
+        admin_user = get_user_model().objects.create_superuser("admin", "admin@admin.com", "admin")
+        view = AdminListOrCreatePoll.as_view(throttle_classes=[])
+        for params in ({}, {"page_size": 4}, {"fields": "id,start"}):
+            responses = {}
+            for fast in (False, True):
+                request = APIRequestFactory().get("/", params)
+                force_authenticate(request, user=admin_user)
+                with mock.patch("core.views.admin_poll_view.FAST_SERIALIZERS", fast):
+                    responses[fast] = view(request).data
+            self.assertSameOutput(responses[False], responses[True])
+
+
+class VvpatTests(SimpleTestCase):
+    """ Vvpats carry their vote, signed or encrypted """
+    def test_signed(self):
+        """ A signed vvpat verifies and a tampered one does not """
+        token = Trail.generate_token("tx")
+        self.assertEqual(Trail.decrypt(token), "tx")
+        self.assertEqual(Trail.decrypt(token.replace("tx", "ty")), "")
+
+    def test_encrypted(self):
+        """ An encrypted vvpat hides its vote and verifies """
+        cipher = vvpat.AESGCM(vvpat.AESGCM.generate_key(bit_length=128))
+        with mock.patch("core.vvpat._cipher", cipher):
+            token = Trail.generate_token("tx")
+            self.assertTrue(token.startswith(vvpat.ENCRYPTED))
+            self.assertEqual(Trail.decrypt(token), "tx")
+            self.assertEqual(Trail.decrypt(token[:-2]), "")
+        self.assertEqual(Trail.decrypt(token), "")
+
+    def test_legacy(self):
+        """ Vvpats issued before versioned tokens still verify """
+        self.assertEqual(Trail.decrypt(Signer().sign("tx")), "tx")
+        self.assertEqual(Trail.decrypt("tx"), "")
+
+
+def full_scans(queries):
+    """
+    Explains queries and returns the plan rows reading a whole large table.
+    Tables are seeded with rows the queries do not look for, so MySQL only scans a table
+    when no index it has serves the query.
+    """
+    scans = []
+    with connection.cursor() as cursor:
+        for query in queries:
+            sql = query["sql"]
+            if not sql.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")):
+                continue
+            cursor.execute("EXPLAIN " + sql)
+            columns = [column[0] for column in cursor.description]
+            for row in cursor.fetchall():
+                plan = dict(zip(columns, row))
+                table = plan.get("table") or ""
+                if table.startswith("<") or table in SMALL_TABLES:
+                    continue
+                if plan.get("type") == "ALL":
+                    scans.append((sql, plan))
+    return scans
+
+
+@skipUnless(connection.vendor == "mysql", "query plans are checked against MySQL only")
+@mock.patch("core.views.voter_view.send_vvpat")
+@mock.patch("core.views.voter_view.get_network_client")
+class QueryPlanTests(APITestCase):
+    """ Fails when a query of a hot path would scan a large table """
+    @classmethod
+    def setUpTestData(cls):
+        # polls not started yet and inactive, none of them is listed by the tests
+        datenow = timezone.now()
+        Poll.objects.bulk_create([
+            Poll(
+                title="seed",
+                start=datenow + timedelta(days=1),
+                end=datenow + timedelta(days=2),
+                isActive=False
+            )
+            for _ in range(SEED_ROWS)
+        ])
+        polls = list(Poll.objects.filter(title="seed"))
+        Candidate.objects.bulk_create([Candidate(name="seed", poll=poll) for poll in polls])
+        get_user_model().objects.bulk_create([
+            get_user_model()(
+                username="seed{0}".format(index),
+                email="seed{0}@voter.com".format(index)
+            )
+            for index in range(SEED_ROWS)
+        ])
+        users = list(get_user_model().objects.filter(username__startswith="seed"))
+        Voter.objects.bulk_create([Voter(user=user) for user in users])
+        Voter.polls.through.objects.bulk_create([
+            Voter.polls.through(voter_id=voter_id, poll_id=polls[0].id)
+            for voter_id in Voter.objects.filter(user__in=users).values_list("id", flat=True)
+        ])
+        VoteIdentificationToken.objects.bulk_create([
+            VoteIdentificationToken(poll=polls[0], token=uuid.uuid4(), used=True, assigned=True)
+            for _ in range(SEED_ROWS)
+        ])
+        VoteReceipt.objects.bulk_create([
+            VoteReceipt(user=user, poll=polls[0], vit_id=vit_id, status=VoteReceipt.COMMITTED)
+            for user, vit_id in zip(
+                users,
+                VoteIdentificationToken.objects.filter(poll=polls[0]).values_list("id", flat=True)
+            )
+        ])
+        OutboxEmail.objects.bulk_create([
+            OutboxEmail(
+                recipient=user.email,
+                subject="seed",
+                body="",
+                status=OutboxEmail.SENT,
+                next_attempt=datenow
+            )
+            for user in users
+        ])
+
+    def setUp(self):
+        datenow = timezone.now()
+        self.poll = Poll.objects.create(
+            title="poll",
+            start=datenow - timedelta(hours=1),
+            end=datenow + timedelta(hours=1)
+        )
+        self.candidate = Candidate.objects.create(name="candidate", poll=self.poll)
+        self.user = get_user_model().objects.create(username="voter", email="voter@voter.com")
+        Voter.objects.get(user=self.user).polls.add(self.poll)
+        self.admin_user = get_user_model().objects.create_superuser(
+            "admin",
+            "admin@admin.com",
+            "admin"
+        )
+        self.vit = VoteIdentificationToken.generate_token(self.poll)
+
+    def assertNoFullScan(self, run):  # pylint: disable=invalid-name
+        """ Runs a hot path and checks the plans of its queries """
+        with CaptureQueriesContext(connection) as context:
+            run()
+        self.assertEqual(full_scans(context.captured_queries), [])
+
+    def get(self, view, user, params=None, **kwargs):
+        """ Calls a view with a GET request """
+        request = APIRequestFactory().get("/", params or {})
+        force_authenticate(request, user=user)
+        return view(request, **kwargs)
+
+    def test_vote_plans(self, get_network_client, send_vvpat):
+        """ Ballot lookup and vit claim """
+        get_network_client.return_value.cast_vote.return_value = '{"txId": "tx"}'
+        request = APIRequestFactory().post("/", {"token": str(self.vit.token)}, format="json")
+        force_authenticate(request, user=self.user)
+        self.assertNoFullScan(lambda: VoterCastVote.as_view(throttle_classes=[])(
+            request,
+            poll_id=self.poll.id,
+            candidate_id=self.candidate.id
+        ))
+
+    def test_poll_list_plans(self, get_network_client, send_vvpat):
+        """ Poll listings filtered by dates and activity """
+        admin_params = (
+            {"ongoing": "true"},
+            {"ended": "true"},
+            {"future": "true", "active": "true"}
+        )
+        for params in admin_params:
+            self.assertNoFullScan(lambda params=params: self.get(
+                AdminListOrCreatePoll.as_view(),
+                self.admin_user,
+                params
+            ))
+        for params in ({"ongoing": "true"}, {"ended": "true"}):
+            self.assertNoFullScan(
+                lambda params=params: self.get(VoterListPoll.as_view(), self.user, params)
+            )
+
+    def test_vote_status_plans(self, get_network_client, send_vvpat):
+        """ Status of an asynchronous vote """
+        receipt = VoteReceipt.objects.create(user=self.user, poll=self.poll, vit=self.vit)
+        self.assertNoFullScan(lambda: self.get(
+            VoterGetVoteStatus.as_view(),
+            self.user,
+            poll_id=self.poll.id,
+            receipt=receipt.receipt
+        ))
+
+    def test_token_assignment_plans(self, get_network_client, send_vvpat):
+        """ Bulk token assignment, outbox polling and turnout counts """
+        self.assertNoFullScan(
+            lambda: VoteIdentificationToken.assign_tokens(
+                self.poll,
+                ["voter@voter.com", "nobody@voter.com"]
+            )
+        )
+        self.assertNoFullScan(lambda: take_due(100, 60))
+        self.assertNoFullScan(lambda: purge(60))
+        self.assertNoFullScan(
+            lambda: list(get_user_model().objects.filter(email="voter@voter.com"))
+        )
+        self.assertNoFullScan(lambda: (
+            VoteIdentificationToken.objects.filter(poll=self.poll, used=True).count(),
+            VoteIdentificationToken.objects.filter(poll=self.poll, assigned=True).count()
+        ))
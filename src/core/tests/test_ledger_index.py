@@ -0,0 +1,156 @@
+from datetime import timedelta
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+from hfc.protos.peer.chaincode_pb2 import ChaincodeInvocationSpec
+from core import ledger_index
+from core.models.models import Poll, LedgerCheckpoint, LedgerTally, LedgerVote
+from votechain.block_events import decode_block, DecodedBlock, LedgerChange, \
+    VOTE, ADD_CANDIDATE, DELETE_CANDIDATE
+
+VALID = 0
+MVCC_READ_CONFLICT = 11
+
+
+def envelope(chaincode_name, tx_id, args, tx_type=3, timestamp="2026-10-18 10:00:00"):
+    """ Builds a transaction of a full block as hfc decodes it """
+    invocation = ChaincodeInvocationSpec()
+    spec = invocation.chaincode_spec  # pylint: disable=no-member
+    spec.chaincode_id.name = chaincode_name
+    spec.input.args.extend([arg.encode("utf-8") for arg in args])
+    return {
+        "payload": {
+            "header": {
+                "channel_header": {"type": tx_type, "tx_id": tx_id, "timestamp": timestamp}
+            },
+            "data": {
+                "actions": [{
+                    "payload": {
+                        "chaincode_proposal_payload": {"input": invocation.SerializeToString()}
+                    }
+                }]
+            }
+        }
+    }
+
+
+def block(number, envelopes, status_codes):
+    """ Builds a full block as hfc decodes it """
+    return {
+        "header": {"number": number},
+        "data": {"data": envelopes},
+        "metadata": {"metadata": [b"", b"", status_codes, b""]}
+    }
+
+
+class DecodeBlockTests(SimpleTestCase):
+    """ Valid transactions of a block are translated into poll changes """
+    def test_changes(self):
+        """ Votes and candidate changes are read, other calls are skipped """
+        decoded = decode_block(block(7, [
+            envelope("Votechain-1", "tx1", ["invoke", "SendVote", "alice"]),
+            envelope("Votechain-1", "tx2", ["invoke", "SendVotes", "r1", "alice", "r2", "bob"]),
+            envelope(
+                "Votechain-shared", "tx3",
+                ["invoke", "Poll", "2", "SendShardedVotes", "0", "r3", "carol"]
+            ),
+            envelope("Votechain-1", "tx4", ["invoke", "AddCandidates", "dave", "erin"]),
+            envelope("Votechain-1", "tx5", ["invoke", "DeleteCandidates", "bob"]),
+            envelope("Votechain-1", "tx6", ["invoke", "GetResults"]),
+        ], [VALID] * 6))
+        self.assertEqual(decoded.number, 7)
+        self.assertEqual(decoded.time.hour, 10)
+        self.assertEqual(decoded.changes, [
+            LedgerChange("Votechain-1", None, VOTE, "alice", "tx1"),
+            LedgerChange("Votechain-1", None, VOTE, "alice", "r1"),
+            LedgerChange("Votechain-1", None, VOTE, "bob", "r2"),
+            LedgerChange("Votechain-shared", "2", VOTE, "carol", "r3"),
+            LedgerChange("Votechain-1", None, ADD_CANDIDATE, "dave", "tx4"),
+            LedgerChange("Votechain-1", None, ADD_CANDIDATE, "erin", "tx4"),
+            LedgerChange("Votechain-1", None, DELETE_CANDIDATE, "bob", "tx5"),
+        ])
+
+    def test_skipped(self):
+        """ Invalid transactions and configuration blocks change nothing """
+        decoded = decode_block(block(8, [
+            envelope("Votechain-1", "tx1", ["invoke", "SendVote", "alice"]),
+            envelope("", "config", [], tx_type=1),
+        ], [MVCC_READ_CONFLICT, VALID]))
+        self.assertEqual(decoded.changes, [])
+
+
+class ApplyBlockTests(TestCase):
+    """ Blocks are indexed exactly once and the index follows the chaincode's counters """
+    def setUp(self):
+        datenow = timezone.now()
+        self.poll = Poll.objects.create(title="poll", end=datenow + timedelta(hours=1))
+        self.sharded = Poll.objects.create(
+            title="sharded",
+            end=datenow + timedelta(hours=1),
+            vote_shards=4
+        )
+        ledger_index.get_checkpoint()
+        self.polls = {"Votechain-poll": self.poll.id, "Votechain-sharded": self.sharded.id}
+
+    def apply(self, number, changes):
+        """ Applies a block of (kind, candidate, receipt) changes of both polls """
+        return ledger_index.apply_block(
+            DecodedBlock(number, None, [LedgerChange(*change) for change in changes]),
+            lambda chaincode_name, namespace: self.polls.get(chaincode_name)
+        )
+
+    def tally(self, poll):
+        """ Returns the indexed votes of a poll's candidates """
+        return dict(LedgerTally.objects.filter(poll=poll).values_list("candidate_name", "votes"))
+
+    def test_votes(self):
+        """ A replayed receipt is counted once, also within one block """
+        self.apply(0, [
+            ("Votechain-poll", None, ADD_CANDIDATE, "alice", "tx0"),
+            ("Votechain-poll", None, ADD_CANDIDATE, "bob", "tx0"),
+        ])
+        self.apply(1, [
+            ("Votechain-poll", None, VOTE, "alice", "r1"),
+            ("Votechain-poll", None, VOTE, "alice", "r1"),
+            ("Votechain-poll", None, VOTE, "bob", "r2"),
+            ("Votechain-foreign", None, VOTE, "bob", "r3"),
+        ])
+        self.apply(2, [("Votechain-poll", None, VOTE, "alice", "r1")])
+        self.assertEqual(self.tally(self.poll), {"alice": 1, "bob": 1})
+        self.assertEqual(LedgerVote.objects.count(), 2)
+        self.assertEqual(LedgerCheckpoint.objects.get().block_number, 2)
+
+    def test_applied_once(self):
+        """ A block at or below the checkpoint is skipped """
+        self.apply(0, [("Votechain-poll", None, ADD_CANDIDATE, "alice", "tx0")])
+        self.apply(1, [("Votechain-poll", None, VOTE, "alice", "r1")])
+        self.apply(1, [("Votechain-poll", None, VOTE, "alice", "r2")])
+        self.assertEqual(self.tally(self.poll), {"alice": 1})
+
+    def test_candidate_added_again(self):
+        """
+        Like AddCandidates, adding a candidate again resets its counter,
+        except for sharded polls
+        """
+        self.apply(0, [
+            ("Votechain-poll", None, ADD_CANDIDATE, "alice", "tx0"),
+            ("Votechain-sharded", None, ADD_CANDIDATE, "alice", "tx0"),
+        ])
+        self.apply(1, [
+            ("Votechain-poll", None, VOTE, "alice", "r1"),
+            ("Votechain-sharded", None, VOTE, "alice", "r2"),
+        ])
+        self.apply(2, [
+            ("Votechain-poll", None, ADD_CANDIDATE, "alice", "tx2"),
+            ("Votechain-sharded", None, ADD_CANDIDATE, "alice", "tx2"),
+            ("Votechain-poll", None, VOTE, "alice", "r3"),
+        ])
+        self.assertEqual(self.tally(self.poll), {"alice": 1})
+        self.assertEqual(self.tally(self.sharded), {"alice": 1})
+
+    def test_candidate_deleted(self):
+        """ A deleted candidate leaves the tally, its votes stay verifiable """
+        self.apply(0, [("Votechain-poll", None, ADD_CANDIDATE, "alice", "tx0")])
+        self.apply(1, [("Votechain-poll", None, VOTE, "alice", "r1")])
+        self.apply(2, [("Votechain-poll", None, DELETE_CANDIDATE, "alice", "tx2")])
+        self.assertEqual(self.tally(self.poll), {})
+        self.assertEqual(LedgerVote.objects.get(receipt="r1").candidate_name, "alice")
@@ -0,0 +1,275 @@
+import smtplib
+import socketserver
+import threading
+from unittest import mock
+from django.core import mail
+from django.core.mail.backends import smtp
+from django.test import SimpleTestCase
+from core.mailer import MailPool, RateLimiter
+
+
+class FakeConnection():
+    """ Email backend recording messages, failing with the errors it was given """
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.sent = []
+        self.opened = self.closed = False
+
+    def open(self):
+        """ Opens the connection """
+        self.opened = True
+
+    def close(self):
+        """ Closes the connection """
+        self.closed = True
+
+    def send_messages(self, messages):
+        """ Raises the next error, or records the messages """
+        if self.errors:
+            raise self.errors.pop(0)
+        self.sent.extend(messages)
+        return len(messages)
+
+
+def message(*recipients):
+    """ Returns an email to the recipients """
+    return mail.EmailMessage("subject", "body", "votechain@voter.com", list(recipients))
+
+
+class RateLimiterTests(SimpleTestCase):
+    """ Calls are spaced evenly """
+    @mock.patch("core.mailer.time.sleep")
+    @mock.patch("core.mailer.time.monotonic", return_value=100.0)
+    def test_spacing(self, _monotonic, sleep):
+        """ Calls wait for the interval after the previous one """
+        limiter = RateLimiter(10)
+        for _ in range(3):
+            limiter.wait()
+        self.assertEqual([round(call[0][0], 6) for call in sleep.call_args_list], [0.1, 0.2])
+
+    @mock.patch("core.mailer.time.sleep")
+    def test_unlimited(self, sleep):
+        """ A rate of 0 never waits """
+        limiter = RateLimiter(0)
+        for _ in range(3):
+            limiter.wait()
+        sleep.assert_not_called()
+
+
+class MailPoolTests(SimpleTestCase):
+    """ Emails are sent over reused connections, opened again when needed """
+    def create_pool(self, connections, max_per_connection=0, rate=0):
+        """ Returns a pool of a thread opening the given connections, and its factory """
+        factory = mock.Mock(side_effect=connections)
+        pool = MailPool(1, rate, max_per_connection, connection_factory=factory)
+        self.addCleanup(pool.close)
+        return pool, factory
+
+    def test_reuse(self):
+        """ Emails share a connection and each recipient gets a delivery """
+        connection = FakeConnection()
+        pool, factory = self.create_pool([connection])
+        deliveries = pool.send([message("a@voter.com"), message("b@voter.com", "c@voter.com")])
+        self.assertEqual(
+            [[(delivery.recipient, delivery.error) for delivery in sent] for sent in deliveries],
+            [[("a@voter.com", None)], [("b@voter.com", None), ("c@voter.com", None)]]
+        )
+        self.assertEqual(factory.call_count, 1)
+        self.assertEqual(len(connection.sent), 2)
+
+    def test_recycle(self):
+        """ A connection is opened again after max_per_connection emails """
+        connections = [FakeConnection() for _ in range(3)]
+        pool, factory = self.create_pool(connections, max_per_connection=2)
+        pool.send([message("voter{0}@voter.com".format(index)) for index in range(5)])
+        self.assertEqual(factory.call_count, 3)
+        self.assertEqual([len(connection.sent) for connection in connections], [2, 2, 1])
+        self.assertTrue(connections[0].closed and connections[1].closed)
+
+    def test_rate_limit(self):
+        """ Each email waits for the rate limiter """
+        pool, _ = self.create_pool([FakeConnection()], rate=50)
+        with mock.patch.object(pool.limiter, "wait") as wait:
+            pool.send([message("a@voter.com"), message("b@voter.com")])
+        self.assertEqual(wait.call_count, 2)
+
+    def test_resend_after_disconnect(self):
+        """ An email is sent once more on a fresh connection when the connection dropped """
+        dropped = FakeConnection([smtplib.SMTPServerDisconnected("dropped")])
+        fresh = FakeConnection()
+        pool, factory = self.create_pool([dropped, fresh])
+        (delivery,), = pool.send([message("a@voter.com")])
+        self.assertIsNone(delivery.error)
+        self.assertEqual(factory.call_count, 2)
+        self.assertTrue(dropped.closed)
+        self.assertEqual(len(fresh.sent), 1)
+
+    def test_resent_once(self):
+        """ An email is sent at most twice, the second drop is its error """
+        error = smtplib.SMTPServerDisconnected("dropped again")
+        pool, factory = self.create_pool([
+            FakeConnection([smtplib.SMTPServerDisconnected("dropped")]),
+            FakeConnection([error]),
+            FakeConnection()
+        ])
+        (delivery,), = pool.send([message("a@voter.com")])
+        self.assertIs(delivery.error, error)
+        self.assertEqual(factory.call_count, 2)
+
+    def test_other_error(self):
+        """ Other errors are not retried, but the session is not reused """
+        error = smtplib.SMTPDataError(554, b"rejected")
+        failing = FakeConnection([error])
+        pool, factory = self.create_pool([failing, FakeConnection()])
+        deliveries = pool.send([message("a@voter.com"), message("b@voter.com")])
+        self.assertIs(deliveries[0][0].error, error)
+        self.assertIsNone(deliveries[1][0].error)
+        self.assertTrue(failing.closed)
+        self.assertEqual(factory.call_count, 2)
+
+    def test_refused_recipients(self):
+        """ Each recipient gets its own status """
+        refusal = (550, b"no such user")
+        error = smtplib.SMTPRecipientsRefused({"b@voter.com": refusal})
+        pool, _ = self.create_pool([FakeConnection([error]), FakeConnection()])
+        (first, second), = pool.send([message("a@voter.com", "b@voter.com")])
+        self.assertEqual((first.recipient, first.error), ("a@voter.com", None))
+        self.assertEqual((second.recipient, second.error), ("b@voter.com", refusal))
+
+
+class StubRelayHandler(socketserver.StreamRequestHandler):
+    """ Speaks just enough SMTP for smtplib, see StubRelay """
+    def reply(self, line):
+        """ Sends a reply line """
+        self.wfile.write(line + b"\r\n")
+
+    def handle(self):
+        """ Answers the commands of one SMTP session """
+        relay = self.server
+        with relay.lock:
+            relay.connections += 1
+        self.reply(b"220 stub relay")
+        recipients = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line[:4].upper()
+            if command in (b"EHLO", b"HELO"):
+                self.reply(b"250 stub relay")
+            elif command == b"MAIL":
+                if relay.take_drop("mail"):
+                    return
+                recipients = []
+                self.reply(b"250 OK")
+            elif command == b"RCPT":
+                address = line.split(b":", 1)[1].strip().strip(b"<>").decode()
+                if address in relay.refused:
+                    self.reply(b"550 no such user")
+                else:
+                    recipients.append(address)
+                    self.reply(b"250 OK")
+            elif command == b"DATA":
+                self.reply(b"354 go ahead")
+                while self.rfile.readline() not in (b".\r\n", b""):
+                    pass
+                with relay.lock:
+                    relay.delivered.extend(recipients)
+                if relay.take_drop("data"):
+                    return
+                self.reply(b"250 OK")
+            elif command == b"QUIT":
+                self.reply(b"221 bye")
+                return
+            else:
+                self.reply(b"250 OK")
+
+
+class StubRelay(socketserver.ThreadingTCPServer):
+    """
+    SMTP relay on localhost recording the recipients of the messages it took.
+    It refuses the refused addresses and drops the connection once at each phase in drops.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StubRelayHandler)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.delivered = []
+        self.refused = set()
+        self.drops = set()
+
+    def take_drop(self, phase):
+        """ Checks whether the connection is dropped at phase, only once """
+        with self.lock:
+            if phase in self.drops:
+                self.drops.discard(phase)
+                return True
+        return False
+
+
+class StubRelayTests(SimpleTestCase):
+    """ The pool against a relay speaking SMTP over sockets """
+    def setUp(self):
+        self.relay = StubRelay()
+        threading.Thread(target=self.relay.serve_forever, args=(0.05,), daemon=True).start()
+        self.addCleanup(self.relay.server_close)
+        self.addCleanup(self.relay.shutdown)
+        # the hostname sent with EHLO, the fqdn lookup may be slow without DNS
+        patcher = mock.patch.object(smtp.DNS_NAME, "get_fqdn", return_value="localhost")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def create_pool(self, size, max_per_connection=0):
+        """ Returns a pool of size threads sending to the relay """
+        pool = MailPool(size, 0, max_per_connection, connection_factory=lambda: mail.get_connection(
+            "django.core.mail.backends.smtp.EmailBackend",
+            host="127.0.0.1",
+            port=self.relay.server_address[1],
+            username="",
+            password="",
+            use_tls=False,
+            use_ssl=False,
+            timeout=5,
+            fail_silently=False
+        ))
+        self.addCleanup(pool.close)
+        return pool
+
+    def test_pool(self):
+        """ Every email is delivered over recycled connections """
+        recipients = ["voter{0}@voter.com".format(index) for index in range(20)]
+        pool = self.create_pool(4, max_per_connection=3)
+        deliveries = pool.send([message(recipient) for recipient in recipients])
+        self.assertTrue(all(delivery.error is None for sent in deliveries for delivery in sent))
+        self.assertEqual(sorted(self.relay.delivered), sorted(recipients))
+        # at most 3 emails per connection
+        self.assertGreaterEqual(self.relay.connections, 7)
+
+    def test_refused(self):
+        """ A refused recipient gets the relay's answer, others are delivered """
+        self.relay.refused.add("nobody@voter.com")
+        pool = self.create_pool(1)
+        (refused,), (accepted,) = pool.send([message("nobody@voter.com"), message("a@voter.com")])
+        self.assertEqual(refused.error[0], 550)
+        self.assertIsNone(accepted.error)
+        self.assertEqual(self.relay.delivered, ["a@voter.com"])
+
+    def test_drop_before_data(self):
+        """ A connection dropped before the message was sent delivers it once """
+        self.relay.drops.add("mail")
+        pool = self.create_pool(1)
+        (delivery,), = pool.send([message("a@voter.com")])
+        self.assertIsNone(delivery.error)
+        self.assertEqual(self.relay.delivered, ["a@voter.com"])
+        self.assertEqual(self.relay.connections, 2)
+
+    def test_drop_after_data(self):
+        """ A connection dropped after the relay took the message delivers it twice """
+        self.relay.drops.add("data")
+        pool = self.create_pool(1)
+        (delivery,), = pool.send([message("a@voter.com")])
+        self.assertIsNone(delivery.error)
+        self.assertEqual(self.relay.delivered, ["a@voter.com", "a@voter.com"])
@@ -0,0 +1,314 @@
+import asyncio
+import json
+import time
+from unittest import mock
+from django.test import SimpleTestCase
+from votechain.block_events import DecodedBlock, LedgerChange, decode_block, VOTE, ADD_CANDIDATE
+from votechain.hyperledger import VotechainNetworkClient, LedgerTimeoutError, VoteRejectedError, \
+    is_rejected
+from votechain.memory_ledger import Latency, MemoryLedger, MVCC_READ_CONFLICT
+from votechain.scheduler import InvalidTransactionError
+
+NO_DELAY = Latency("fixed:0")
+
+
+class MemoryLedgerTestCase(SimpleTestCase):
+    """ Runs against an in-memory ledger of its own, without simulated latencies """
+    batch_size = 1
+    retained_blocks = 1000
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.ledger = self.run_on_loop(self.create_ledger())
+        self.run_on_loop(self.ledger.deploy_chaincode("Votechain-1"))
+
+    def tearDown(self):
+        self.run_on_loop(self.ledger.close())
+        self.loop.close()
+
+    async def create_ledger(self):
+        """ Creates the ledger on the test's loop """
+        return MemoryLedger(
+            NO_DELAY, NO_DELAY, NO_DELAY, self.batch_size, 0.01, self.retained_blocks
+        )
+
+    def run_on_loop(self, coroutine):
+        """ Runs a coroutine on the test's loop """
+        return self.loop.run_until_complete(coroutine)
+
+    def invoke(self, *args, chaincode_name="Votechain-1"):
+        """ Sends a transaction, returns the chaincode's answer """
+        return self.run_on_loop(self.ledger.send_transaction(chaincode_name, list(args)))
+
+    def query(self, method_name, *args, chaincode_name="Votechain-1"):
+        """ Evaluates a chaincode function """
+        return self.run_on_loop(self.ledger.evaluate(chaincode_name, method_name, list(args)))
+
+
+class ChaincodeTests(MemoryLedgerTestCase):
+    """ The Python mirror answers like hyperledger/chaincode/votechain.js """
+    def test_votes(self):
+        """ Votes are counted per candidate """
+        self.invoke("AddCandidates", "a", "b")
+        self.invoke("SendVote", "a")
+        self.invoke("SendVote", "a")
+        self.assertEqual(json.loads(self.query("GetResults")), {"a": "2", "b": "0"})
+        self.assertEqual(self.query("GetResult", "a"), '{result: "2"}')
+
+    def test_vote_on_missing_candidate(self):
+        """ An unreceipted vote on a missing candidate counts NaN, as in JavaScript """
+        # parseInt("") + 1 is NaN in the chaincode
+        self.invoke("SendVote", "a")
+        self.assertEqual(json.loads(self.query("GetResults")), {"a": "NaN"})
+
+    def test_receipted_votes(self):
+        """ A receipt is only counted once, also across transactions """
+        self.invoke("AddCandidates", "a", "b")
+        response = json.loads(self.invoke("SendVotes", "r1", "a", "r2", "b", "r1", "a"))
+        self.assertEqual(response["receipts"], ["r1", "r2", "r1"])
+        self.invoke("SendVotes", "r2", "b")
+        self.assertEqual(json.loads(self.query("GetResults")), {"a": "1", "b": "1"})
+        self.assertEqual(json.loads(self.query("VerifyVote", "r2")), {"candidate": "b"})
+
+    def test_receipted_vote_on_missing_candidate(self):
+        """ A receipted vote on a missing candidate is refused """
+        self.assertEqual(self.invoke("SendVotes", "r1", "a"), 'Candidate "a" doesn\'t exist')
+
+    def test_sharded_votes(self):
+        """ Sharded votes are counted per shard """
+        self.invoke("AddCandidates", "a")
+        self.invoke("SendShardedVotes", "0", "r1", "a", "r2", "a")
+        self.invoke("SendShardedVotes", "1", "r3", "a")
+        self.assertEqual(json.loads(self.query("GetShardedResults")), {"a": [0, 2, 1]})
+
+    def test_verify_unreceipted_vote(self):
+        """ An unreceipted vote is verified by its transaction id """
+        self.invoke("AddCandidates", "a")
+        tx_id = json.loads(self.invoke("SendVote", "a"))["txId"]
+        self.assertEqual(json.loads(self.query("VerifyVote", tx_id)), {"candidate": "a"})
+        with self.assertRaisesMessage(Exception, "Could not find the transaction"):
+            self.query("VerifyVote", "unknown")
+
+    def test_delete_candidates(self):
+        """ Deleted candidates leave the results """
+        self.invoke("AddCandidates", "a", "b")
+        self.invoke("DeleteCandidates", "a")
+        self.assertEqual(json.loads(self.query("GetResults")), {"b": "0"})
+
+    def test_shared_chaincode(self):
+        """ Polls of a shared chaincode have candidates of their own """
+        self.run_on_loop(self.ledger.deploy_chaincode("Votechain-shared"))
+        self.invoke("Poll", "1", "AddCandidates", "a", chaincode_name="Votechain-shared")
+        self.invoke("Poll", "2", "AddCandidates", "b", chaincode_name="Votechain-shared")
+        self.assertEqual(
+            json.loads(self.query("Poll", "1", "GetResults", chaincode_name="Votechain-shared")),
+            {"a": "0"}
+        )
+
+    def test_errors(self):
+        """ Unknown methods and chaincodes are refused like by Fabric """
+        self.assertEqual(self.invoke("Unknown"), 'Method "Unknown" doesn\'t exist')
+        self.assertIn(
+            "successfully instantiated",
+            self.invoke("SendVote", "a", chaincode_name="Votechain-2")
+        )
+        with self.assertRaisesMessage(Exception, "already exists"):
+            self.run_on_loop(self.ledger.deploy_chaincode("Votechain-1"))
+
+
+class ConflictTests(MemoryLedgerTestCase):
+    """ Transactions of a block are validated against the state their reads saw """
+    batch_size = 2
+
+    def test_read_conflict(self):
+        """ A vote read before a vote on the same counter committed is invalid """
+        self.ledger.batch_size = 1
+        self.invoke("AddCandidates", "a", "b")
+        self.ledger.batch_size = 2
+
+        async def votes(*candidates):
+            return await asyncio.gather(*[
+                self.ledger.send_transaction("Votechain-1", ["SendVote", candidate])
+                for candidate in candidates
+            ], return_exceptions=True)
+
+        first, second = self.run_on_loop(votes("a", "a"))
+        self.assertIn("txId", first)
+        self.assertIsInstance(second, InvalidTransactionError)
+        self.assertEqual(str(second), str([MVCC_READ_CONFLICT]))
+        # votes on different counters do not conflict
+        self.assertTrue(all("txId" in response for response in self.run_on_loop(votes("a", "b"))))
+        self.assertEqual(json.loads(self.query("GetResults")), {"a": "2", "b": "1"})
+
+    def test_batch_timeout(self):
+        """ A partial block is cut after the batch timeout """
+        self.invoke("AddCandidates", "a")
+        self.assertEqual(self.ledger.height, 2)
+
+
+class BlockListenerTests(MemoryLedgerTestCase):
+    """ Committed blocks reach listeners decoded, from any block on """
+    def listen(self, start, on_block):
+        """ Streams blocks from start on to on_block """
+        return self.loop.create_task(self.ledger.listen_blocks(start, on_block))
+
+    def test_listen(self):
+        """ Only endorsed transactions reach the listener """
+        self.invoke("AddCandidates", "a")
+        blocks = []
+        stream = self.listen(1, blocks.append)
+        self.invoke("SendVotes", "r1", "a")
+        # rejected by the endorser, so never ordered
+        self.invoke("SendVotes", "r2", "b")
+        self.run_on_loop(self.ledger.close())
+        self.run_on_loop(stream)
+        self.assertEqual([block.number for block in blocks], [1, 2])
+        self.assertTrue(all(isinstance(block, DecodedBlock) for block in blocks))
+        self.assertEqual(blocks[0].changes[0].kind, ADD_CANDIDATE)
+        self.assertEqual(
+            blocks[1].changes,
+            [LedgerChange("Votechain-1", None, VOTE, "a", "r1")]
+        )
+        self.assertIs(decode_block(blocks[1]), blocks[1])
+
+    def test_failing_listener(self):
+        """ An error of the listener ends its stream """
+        def on_block(_):
+            raise ValueError("full")
+
+        stream = self.listen(5, on_block)
+        self.invoke("AddCandidates", "a")
+        with self.assertRaisesMessage(ValueError, "full"):
+            self.run_on_loop(stream)
+
+
+class BlockRetentionTests(BlockListenerTests):
+    """ Only the last retained blocks are kept for listeners """
+    retained_blocks = 2
+
+    def test_dropped_blocks(self):
+        """ Blocks dropped from the ledger cannot be listened to """
+        for candidate in ("a", "b", "c"):
+            self.invoke("AddCandidates", candidate)
+        with self.assertRaisesMessage(ValueError, "blocks before 2 are no longer retained"):
+            self.run_on_loop(self.listen(1, print))
+        blocks = []
+        stream = self.listen(2, blocks.append)
+        self.run_on_loop(self.ledger.close())
+        self.run_on_loop(stream)
+        self.assertEqual([block.number for block in blocks], [2, 3])
+
+
+@mock.patch("votechain.hyperledger._chaincode_resolver", None)
+@mock.patch("votechain.hyperledger.MEMORY_LEDGER_ENDORSE_LATENCY", "fixed:0")
+@mock.patch("votechain.hyperledger.MEMORY_LEDGER_ORDER_LATENCY", "fixed:0")
+@mock.patch("votechain.hyperledger.MEMORY_LEDGER_COMMIT_LATENCY", "fixed:0")
+@mock.patch("votechain.hyperledger.MEMORY_LEDGER_BATCH_SIZE", 1)
+@mock.patch("votechain.hyperledger.LEDGER_BACKEND", "memory")
+class MemoryClientTests(SimpleTestCase):
+    """ Without blockchain integration the network client runs on the in-memory ledger """
+    def test_poll(self):
+        """ A poll is created, voted on and verified """
+        client = VotechainNetworkClient()
+        try:
+            client.add_poll(7)
+            client.add_candidates(7, ["a", "b"])
+            response = json.loads(client.cast_vote(7, "a"))
+            self.assertIn("txId", response)
+            self.assertEqual(
+                json.loads(client.verify_vote(7, response["txId"])),
+                {"candidate": "a"}
+            )
+            self.assertEqual(json.loads(client.get_results(7)), {"a": "1", "b": "0"})
+            self.assertEqual(client.get_channel_height(), 3)
+        finally:
+            client.close()
+
+    def test_run(self):
+        """ Results and errors of a coroutine run on the loop thread reach the calling thread """
+        async def fail():
+            raise ValueError("broken")
+
+        client = VotechainNetworkClient()
+        try:
+            self.assertEqual(client.run(asyncio.sleep(0, "done")), "done")
+            with self.assertRaisesMessage(ValueError, "broken"):
+                client.run(fail())
+        finally:
+            client.close()
+        coroutine = asyncio.sleep(0)
+        with self.assertRaisesMessage(RuntimeError, "closed"):
+            client.submit(coroutine)
+        coroutine.close()
+
+    @mock.patch("votechain.hyperledger.random.randrange", side_effect=[0, 1, 3, 1])
+    def test_sharded_results(self, randrange):
+        """ Votes of a sharded poll spread over shards, results sum them per candidate """
+        client = VotechainNetworkClient()
+        try:
+            client.add_poll(7)
+            client.add_candidates(7, ["a", "b"])
+            for candidate in ("a", "a", "b", "a"):
+                client.cast_vote(7, candidate, shards=4)
+            self.assertEqual(json.loads(client.get_results(7, shards=4)), {"a": "3", "b": "1"})
+            self.assertEqual(randrange.call_args_list, [mock.call(4)] * 4)
+        finally:
+            client.close()
+
+    def test_sharded_results_cache(self):
+        """ Merged results are served from the cache until RESULTS_CACHE_TTL passed """
+        client = VotechainNetworkClient()
+        try:
+            client.add_poll(7)
+            client.add_candidates(7, ["a"])
+            with mock.patch("votechain.hyperledger.RESULTS_CACHE_TTL", 0.5):
+                self.assertEqual(json.loads(client.get_results(7, shards=4)), {"a": "0"})
+            client.cast_vote(7, "a", shards=4)
+            self.assertEqual(json.loads(client.get_results(7, shards=4)), {"a": "0"})
+            time.sleep(0.5)
+            self.assertEqual(json.loads(client.get_results(7, shards=4)), {"a": "1"})
+        finally:
+            client.close()
+
+    def test_unsharded(self):
+        """ Polls without shards vote and count through the unsharded functions """
+        client = VotechainNetworkClient()
+        try:
+            client.add_poll(7)
+            client.add_candidates(7, ["a"])
+            ledger = client.ledger
+            with mock.patch.object(ledger, "send_transaction", wraps=ledger.send_transaction) \
+                    as send_transaction, \
+                    mock.patch.object(ledger, "evaluate", wraps=ledger.evaluate) as evaluate:
+                client.cast_vote(7, "a", shards=0)
+                self.assertEqual(json.loads(client.get_results(7, shards=0)), {"a": "1"})
+            send_transaction.assert_called_once_with("Votechain-7", ["SendVote", "a"])
+            evaluate.assert_called_once_with("Votechain-7", "GetResults", [])
+        finally:
+            client.close()
+
+    def test_rejected_vote(self):
+        """ A vote the chaincode refused can never be counted """
+        client = VotechainNetworkClient()
+        try:
+            client.add_poll(7)
+            with self.assertRaises(VoteRejectedError) as raised:
+                client.cast_vote(7, "missing", receipt="r1")
+            self.assertIn("doesn't exist", str(raised.exception))
+            self.assertTrue(is_rejected(raised.exception))
+        finally:
+            client.close()
+
+    def test_timeout(self):
+        """ A call that timed out keeps running, its outcome is unknown """
+        client = VotechainNetworkClient()
+        try:
+            async def slow():
+                await asyncio.sleep(0.1)
+                return "done"
+            with self.assertRaises(LedgerTimeoutError) as raised:
+                client.run(slow(), timeout=0.01)
+            self.assertFalse(is_rejected(raised.exception))
+            self.assertEqual(raised.exception.future.result(1), "done")
+        finally:
+            client.close()
@@ -0,0 +1,108 @@
+from django.test import SimpleTestCase
+from votechain import metrics, tracing
+
+
+class HistogramTests(SimpleTestCase):
+    """ Quantiles are interpolated within the bucket they fall into """
+    def setUp(self):
+        self.histogram = metrics.Histogram("test", buckets=(1, 2, 4))
+
+    def test_empty(self):
+        """ An empty histogram has no quantiles """
+        self.assertIsNone(self.histogram.quantile(0.5))
+        self.assertEqual(self.histogram.export()["count"], 0)
+
+    def test_quantiles(self):
+        """ Quantiles are interpolated within their bucket """
+        for value in (0.5, 1.5, 1.5, 3):
+            self.histogram.observe(value)
+        self.assertEqual(self.histogram.quantile(0.5), 1.5)
+        self.assertEqual(self.histogram.quantile(0.25), 1)
+        self.assertEqual(self.histogram.quantile(1), 4)
+
+    def test_bounds(self):
+        """ Values on and past the bounds land in the right buckets """
+        # a value equal to a bound falls into its bucket,
+        # values past the last one are reported as it
+        self.histogram.observe(1)
+        self.histogram.observe(10)
+        self.assertEqual(self.histogram.export()["buckets"], [[1, 1], [2, 1], [4, 1], ["+Inf", 2]])
+        self.assertEqual(self.histogram.quantile(0.99), 4)
+
+    def test_export(self):
+        """ Exported buckets are cumulative """
+        for value in (0.5, 3):
+            self.histogram.observe(value)
+        exported = self.histogram.export()
+        self.assertEqual(exported["count"], 2)
+        self.assertEqual(exported["sum"], 3.5)
+        self.assertEqual(exported["buckets"], [[1, 1], [2, 1], [4, 2], ["+Inf", 2]])
+        self.assertEqual(exported["p50"], 1)
+
+
+class RegistryTests(SimpleTestCase):
+    """ Metrics are registered once per name and labels """
+    def test_labelled(self):
+        """ Labels are part of the name, in any order """
+        histogram = metrics.histogram("test_registry_seconds", method="SendVote", org="org1")
+        self.assertEqual(histogram.name, 'test_registry_seconds{method="SendVote",org="org1"}')
+        self.assertIs(
+            metrics.histogram("test_registry_seconds", org="org1", method="SendVote"),
+            histogram
+        )
+        self.assertIn(histogram.name, metrics.snapshot())
+
+    def test_counter_and_gauge(self):
+        """ Counters and gauges are shared by name """
+        counter = metrics.counter("test_registry_total")
+        value = counter.value
+        counter.inc()
+        counter.inc(2)
+        self.assertEqual(metrics.counter("test_registry_total").value, value + 3)
+        gauge = metrics.gauge("test_registry_gauge")
+        gauge.set(5)
+        gauge.dec(2)
+        self.assertEqual(metrics.snapshot()["test_registry_gauge"], 3)
+
+
+class TracingTests(SimpleTestCase):
+    """ Chaincode calls are recorded under the method they run """
+    def test_method_of(self):
+        """ The method is found in plain and shared chaincode calls """
+        self.assertEqual(tracing.method_of(["SendVote", "a"]), "SendVote")
+        self.assertEqual(tracing.method_of(["Poll", "7", "SendVote", "a"]), "SendVote")
+        self.assertEqual(tracing.method_of(["a"], "GetResult"), "GetResult")
+        self.assertEqual(tracing.method_of(["7", "GetResults"], "Poll"), "GetResults")
+        self.assertEqual(tracing.method_of([]), "invoke")
+
+    def test_phase(self):
+        """ Phases are timed whether they succeed or fail """
+        histogram = metrics.histogram("chaincode_commit_seconds", method="TestPhase")
+        count = histogram.count
+        with tracing.phase("commit", "TestPhase"):
+            pass
+        with self.assertRaises(ValueError), tracing.phase("commit", "TestPhase"):
+            raise ValueError()
+        self.assertEqual(histogram.count, count + 2)
+
+    def test_payload(self):
+        """ Payloads are measured in encoded bytes """
+        histogram = metrics.histogram(
+            "chaincode_request_bytes",
+            buckets=metrics.SIZE_BUCKETS,
+            method="TestPayload"
+        )
+        tracing.payload("request", "TestPayload", ["ab", "ć"])
+        tracing.payload("request", "TestPayload", b"abcd")
+        self.assertEqual(histogram.count, 2)
+        self.assertEqual(histogram.export()["sum"], 8)
+
+    def test_retries(self):
+        """ Retries are counted per call """
+        tracing.retries("TestRetries", 3)
+        histogram = metrics.histogram(
+            "chaincode_retries",
+            buckets=metrics.COUNT_BUCKETS,
+            method="TestRetries"
+        )
+        self.assertEqual(histogram.export()["buckets"][3], [3, 1])
@@ -0,0 +1,94 @@
+from datetime import timedelta
+from unittest import mock
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.utils import timezone
+from core.models.models import Poll, Voter, VoteIdentificationToken, OutboxEmail
+
+
+class AssignTokensTests(TestCase):
+    """ Tokens are assigned once per voter of a poll, to the oldest user of an email """
+    def setUp(self):
+        self.poll = Poll.objects.create(title="poll", end=timezone.now() + timedelta(hours=1))
+
+    def create_voter(self, username, email):
+        """ Creates a user, which gets its voter """
+        user = get_user_model().objects.create(username=username, email=email)
+        return Voter.objects.get(user=user)
+
+    def assigned_polls(self, voter):
+        """ Returns ids of the polls a voter is authorized for """
+        return list(Voter.objects.get(id=voter.id).polls.values_list("id", flat=True))
+
+    def test_assign(self):
+        """ Every voter gets a token and an email with it """
+        first = self.create_voter("first", "first@voter.com")
+        second = self.create_voter("second", "second@voter.com")
+        assigned = VoteIdentificationToken.assign_tokens(
+            self.poll,
+            ["first@voter.com", "second@voter.com"]
+        )
+        self.assertEqual(assigned, ["first@voter.com", "second@voter.com"])
+        self.assertEqual(self.assigned_polls(first), [self.poll.id])
+        self.assertEqual(self.assigned_polls(second), [self.poll.id])
+        self.assertEqual(
+            VoteIdentificationToken.objects.filter(poll=self.poll, assigned=True).count(),
+            2
+        )
+        tokens = {
+            str(token) for token in VoteIdentificationToken.objects.values_list("token", flat=True)
+        }
+        bodies = OutboxEmail.objects.order_by("recipient").values_list("recipient", "body")
+        self.assertEqual([recipient for recipient, _ in bodies], assigned)
+        for _, body in bodies:
+            self.assertIn(body.rsplit("\n", 1)[-1], tokens)
+
+    def test_duplicate_emails(self):
+        """ An email listed twice gets one token """
+        self.create_voter("voter", "voter@voter.com")
+        assigned = VoteIdentificationToken.assign_tokens(
+            self.poll,
+            ["voter@voter.com", "voter@voter.com"]
+        )
+        self.assertEqual(assigned, ["voter@voter.com"])
+        self.assertEqual(VoteIdentificationToken.objects.filter(poll=self.poll).count(), 1)
+        self.assertEqual(OutboxEmail.objects.count(), 1)
+
+    def test_unknown_email(self):
+        """ Emails of no user are skipped """
+        self.assertEqual(VoteIdentificationToken.assign_tokens(self.poll, ["nobody@voter.com"]), [])
+        self.assertEqual(VoteIdentificationToken.objects.filter(poll=self.poll).count(), 0)
+        self.assertEqual(OutboxEmail.objects.count(), 0)
+
+    def test_existing_member(self):
+        """ A voter already authorized gets no second token """
+        voter = self.create_voter("voter", "voter@voter.com")
+        voter.polls.add(self.poll)
+        self.assertEqual(VoteIdentificationToken.assign_tokens(self.poll, ["voter@voter.com"]), [])
+        self.assertEqual(OutboxEmail.objects.count(), 0)
+
+    def test_users_sharing_an_email(self):
+        """ The oldest user of an email is the voter, also when already authorized """
+        oldest = self.create_voter("oldest", "shared@voter.com")
+        newest = self.create_voter("newest", "shared@voter.com")
+        self.assertEqual(
+            VoteIdentificationToken.assign_tokens(self.poll, ["shared@voter.com"]),
+            ["shared@voter.com"]
+        )
+        self.assertEqual(self.assigned_polls(oldest), [self.poll.id])
+        self.assertEqual(self.assigned_polls(newest), [])
+        self.assertEqual(VoteIdentificationToken.assign_tokens(self.poll, ["shared@voter.com"]), [])
+        self.assertEqual(self.assigned_polls(newest), [])
+        self.assertEqual(VoteIdentificationToken.objects.filter(poll=self.poll).count(), 1)
+
+    @mock.patch("core.models.models.ASSIGN_CHUNK_SIZE", 2)
+    def test_chunks(self):
+        """ Emails are assigned chunk by chunk """
+        emails = ["voter{0}@voter.com".format(index) for index in range(5)]
+        for index, email in enumerate(emails):
+            self.create_voter("voter{0}".format(index), email)
+        self.assertEqual(
+            VoteIdentificationToken.assign_tokens(self.poll, emails + ["nobody@voter.com"]),
+            emails
+        )
+        self.assertEqual(Voter.objects.filter(polls=self.poll).count(), 5)
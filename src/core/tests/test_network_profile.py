@@ -0,0 +1,155 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+from unittest import mock
+from django.test import SimpleTestCase
+from votechain import hyperledger
+from votechain.network_profile import NetworkProfile, NetworkProfileError, load_profile
+
+# the client globals are reset between tests,
+# mocks patched onto a test class are passed to each of its tests, used or not
+# pylint: disable=protected-access,unused-argument
+
+
+def node(url):
+    """ Returns a peer or orderer entry of a network profile """
+    return {
+        "url": url,
+        "grpcOptions": {"grpc.ssl_target_name_override": url.split(":")[0]},
+        "tlsCACerts": {"path": "ca.pem"}
+    }
+
+
+PROFILE = {
+    "organizations": {
+        "org1.example.com": {"mspid": "Org1MSP", "peers": ["peer0.org1.example.com"]}
+    },
+    "peers": {"peer0.org1.example.com": node("peer0.org1.example.com:7051")},
+    "orderers": {"orderer.example.com": node("orderer.example.com:7050")}
+}
+
+
+class NetworkProfileTests(SimpleTestCase):
+    """ The profile is parsed once and reloaded when it changes on disk """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "network.json")
+        self.write(PROFILE)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, info):
+        """ Writes the network profile """
+        with open(self.path, "w", encoding="utf-8") as profile:
+            json.dump(info, profile)
+
+    def test_stale(self):
+        """ A changed or removed profile makes it stale """
+        profile = NetworkProfile(self.path)
+        self.assertFalse(profile.is_stale())
+        self.write(dict(PROFILE, client={"organization": "org1.example.com"}))
+        self.assertTrue(profile.is_stale())
+        os.remove(self.path)
+        self.assertTrue(profile.is_stale())
+
+    def test_load_profile(self):
+        """ A profile is parsed once until it changes """
+        profile = load_profile(self.path)
+        self.assertIs(load_profile(self.path), profile)
+        self.write(dict(PROFILE, client={"organization": "org1.example.com"}))
+        reloaded = load_profile(self.path)
+        self.assertIsNot(reloaded, profile)
+        self.assertEqual(reloaded.info["client"], {"organization": "org1.example.com"})
+
+    def test_invalid(self):
+        """ A broken profile is refused with what is missing """
+        peers = {"peer0.org1.example.com": {"url": "peer0.org1.example.com:7051"}}
+        self.write(dict(PROFILE, peers=peers))
+        with self.assertRaisesMessage(NetworkProfileError, "grpc.ssl_target_name_override"):
+            NetworkProfile(self.path)
+        organizations = {
+            "org1.example.com": {"mspid": "Org1MSP", "peers": ["peer1.org1.example.com"]}
+        }
+        self.write(dict(PROFILE, organizations=organizations))
+        with self.assertRaisesMessage(NetworkProfileError, 'unknown peer "peer1.org1.example.com"'):
+            NetworkProfile(self.path)
+
+
+@mock.patch("votechain.hyperledger._retire")
+@mock.patch("votechain.hyperledger.NETWORK_PROFILE_CHECK_INTERVAL", 0)
+@mock.patch("votechain.hyperledger.VotechainNetworkClient")
+class NetworkClientTests(SimpleTestCase):
+    """ A client built from an outdated network profile is replaced on use """
+    def setUp(self):
+        hyperledger._reset_after_fork()
+
+    def tearDown(self):
+        hyperledger._reset_after_fork()
+
+    def test_reused(self, client_class, retire):
+        """ A current client is reused """
+        client = hyperledger.get_network_client()
+        client.is_stale.return_value = False
+        self.assertIs(hyperledger.get_network_client(), client)
+        self.assertEqual(client_class.call_count, 1)
+
+    def test_rebuilt_when_stale(self, client_class, retire):
+        """ A stale client is replaced and retired """
+        stale, fresh = mock.Mock(), mock.Mock()
+        client_class.side_effect = [stale, fresh]
+        self.assertIs(hyperledger.get_network_client(), stale)
+        stale.is_stale.return_value = True
+        fresh.is_stale.return_value = False
+        self.assertIs(hyperledger.get_network_client(), fresh)
+        self.assertIs(hyperledger.get_network_client(), fresh)
+        retire.assert_called_once_with(stale)
+
+    def test_kept_when_rebuild_fails(self, client_class, retire):
+        """ A stale client stays in use while a new one cannot be built """
+        stale = mock.Mock()
+        client_class.side_effect = [stale, NetworkProfileError("broken")]
+        hyperledger.get_network_client()
+        stale.is_stale.return_value = True
+        self.assertIs(hyperledger.get_network_client(), stale)
+        retire.assert_not_called()
+
+    def test_checked_at_intervals(self, client_class, retire):
+        """ The files are only checked once per interval """
+        client = client_class.return_value
+        client.is_stale.return_value = False
+        hyperledger.get_network_client()
+        with mock.patch("votechain.hyperledger.NETWORK_PROFILE_CHECK_INTERVAL", 60):
+            for _ in range(3):
+                hyperledger.get_network_client()
+        self.assertEqual(client.is_stale.call_count, 1)
+
+    def test_one_per_process(self, client_class, retire):
+        """ Each process gets a client of its own, the same one on every call """
+        client_class.side_effect = lambda: mock.Mock(**{"is_stale.return_value": False})
+        with mock.patch("votechain.hyperledger.os.getpid", return_value=1):
+            parent = hyperledger.get_network_client()
+            self.assertIs(hyperledger.get_network_client(), parent)
+        with mock.patch("votechain.hyperledger.os.getpid", return_value=2):
+            child = hyperledger.get_network_client()
+            self.assertIs(hyperledger.get_network_client(), child)
+        self.assertIsNot(child, parent)
+        self.assertEqual(client_class.call_count, 2)
+        # the parent's loop thread does not exist in the child, there is nothing to close
+        retire.assert_not_called()
+
+
+class RetireTests(SimpleTestCase):
+    """ A replaced client is closed once the requests still using it had time to finish """
+    @mock.patch("votechain.hyperledger.LEDGER_TIMEOUT", 0.2)
+    def test_closed_after_timeout(self):
+        """ The client is closed by a timer, not right away """
+        closed = threading.Event()
+        client = mock.Mock()
+        client.close.side_effect = closed.set
+        hyperledger._retire(client)
+        client.close.assert_not_called()
+        self.assertTrue(closed.wait(2))
+        client.close.assert_called_once_with()
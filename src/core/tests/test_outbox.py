@@ -0,0 +1,165 @@
+import threading
+from datetime import timedelta
+from unittest import mock, skipUnless
+from django.db import connection, connections, transaction
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+from core.mailer import Delivery
+from core.models.models import OutboxEmail
+from core.outbox import take_due, settle, deliver, purge
+
+
+def enqueue(count, due=None):
+    """ Queues count emails due at the given time, now by default """
+    emails = [
+        OutboxEmail.enqueue("voter{0}@voter.com".format(index), "subject", "vit {0}".format(index))
+        for index in range(count)
+    ]
+    if due is not None:
+        OutboxEmail.objects.filter(id__in=[email.id for email in emails]).update(next_attempt=due)
+    return emails
+
+
+class TakeDueTests(TestCase):
+    """ Due emails are leased to one worker at a time """
+    def test_lease(self):
+        """ Taken emails are held for the lease, oldest due first """
+        now = timezone.now()
+        first = enqueue(1, now - timedelta(minutes=2))[0]
+        second = enqueue(1, now - timedelta(minutes=1))[0]
+        enqueue(1, now + timedelta(minutes=1))
+        taken = take_due(1, 60)
+        self.assertEqual([email.id for email in taken], [first.id])
+        self.assertGreater(
+            OutboxEmail.objects.get(id=first.id).next_attempt,
+            now + timedelta(seconds=50)
+        )
+        # leased emails are not due anymore, emails due later never were
+        self.assertEqual([email.id for email in take_due(10, 60)], [second.id])
+        self.assertEqual(take_due(10, 60), [])
+
+    def test_settled(self):
+        """ Sent and failed emails are not taken again """
+        sent, failed = enqueue(2)
+        OutboxEmail.objects.filter(id=sent.id).update(status=OutboxEmail.SENT)
+        OutboxEmail.objects.filter(id=failed.id).update(status=OutboxEmail.FAILED)
+        self.assertEqual(take_due(10, 60), [])
+
+
+@skipUnless(connection.features.has_select_for_update_skip_locked, "needs SELECT ... SKIP LOCKED")
+class SkipLockedTests(TransactionTestCase):
+    """ Concurrent workers take disjoint batches """
+    def test_skip_locked(self):
+        """ Rows locked by another worker are skipped, not waited for """
+        locked, free = enqueue(2)
+        held = threading.Event()
+        done = threading.Event()
+
+        def hold():
+            try:
+                with transaction.atomic():
+                    list(OutboxEmail.objects.select_for_update().filter(id=locked.id))
+                    held.set()
+                    done.wait(10)
+            finally:
+                connections.close_all()
+
+        worker = threading.Thread(target=hold)
+        worker.start()
+        try:
+            self.assertTrue(held.wait(10))
+            self.assertEqual([email.id for email in take_due(10, 60)], [free.id])
+        finally:
+            done.set()
+            worker.join()
+
+
+@mock.patch("core.outbox.OUTBOX_MAX_ATTEMPTS", 3)
+@mock.patch("core.outbox.OUTBOX_RETRY_MAX_BACKOFF", 100)
+@mock.patch("core.outbox.OUTBOX_RETRY_BACKOFF", 10)
+class SettleTests(TestCase):
+    """ Failed deliveries are retried with backoff, then given up """
+    def test_sent(self):
+        """ A sent email keeps no body """
+        email = enqueue(1)[0]
+        settle(email)
+        email = OutboxEmail.objects.get(id=email.id)
+        self.assertEqual(email.status, OutboxEmail.SENT)
+        self.assertEqual(email.attempts, 1)
+        self.assertIsNotNone(email.sent)
+        self.assertEqual(email.body, "")
+
+    def test_backoff(self):
+        """ The delay before the next attempt doubles up to the maximum """
+        email = enqueue(1)[0]
+        with mock.patch("core.outbox.random.uniform", lambda low, high: high):
+            for attempts, delay in ((1, 10), (2, 20)):
+                before = timezone.now()
+                settle(email, Exception("refused"))
+                email = OutboxEmail.objects.get(id=email.id)
+                self.assertEqual(email.status, OutboxEmail.PENDING)
+                self.assertEqual(email.attempts, attempts)
+                self.assertEqual(email.last_error, "refused")
+                self.assertEqual(email.body, "vit 0")
+                self.assertGreaterEqual(email.next_attempt, before + timedelta(seconds=delay))
+                self.assertLessEqual(email.next_attempt, timezone.now() + timedelta(seconds=delay))
+
+    def test_given_up(self):
+        """ An email out of attempts fails and keeps no body """
+        email = enqueue(1)[0]
+        OutboxEmail.objects.filter(id=email.id).update(attempts=2)
+        settle(OutboxEmail.objects.get(id=email.id), Exception("refused"))
+        email = OutboxEmail.objects.get(id=email.id)
+        self.assertEqual(email.status, OutboxEmail.FAILED)
+        self.assertEqual(email.attempts, 3)
+        self.assertEqual(email.body, "")
+        self.assertEqual(take_due(10, 0), [])
+
+
+class DeliverTests(TestCase):
+    """ Due emails are handed to the mail pool and settled with its deliveries """
+    def test_deliver(self):
+        """ Sent emails are settled, refused ones wait for a retry """
+        sent, refused = enqueue(2)
+        pool = mock.Mock()
+        pool.send.side_effect = lambda messages: [
+            [Delivery(
+                message.to[0],
+                None if message.to[0] == sent.recipient else Exception("refused")
+            )]
+            for message in messages
+        ]
+        self.assertEqual(deliver(pool, 10, 60), (1, 1))
+        messages = pool.send.call_args[0][0]
+        self.assertEqual(
+            sorted((message.to, message.body) for message in messages),
+            [([sent.recipient], sent.body), ([refused.recipient], refused.body)]
+        )
+        self.assertEqual(OutboxEmail.objects.get(id=sent.id).status, OutboxEmail.SENT)
+        refused = OutboxEmail.objects.get(id=refused.id)
+        self.assertEqual(refused.status, OutboxEmail.PENDING)
+        self.assertEqual(refused.last_error, "refused")
+
+    def test_nothing_due(self):
+        """ Nothing is sent without due emails """
+        pool = mock.Mock()
+        pool.send.return_value = []
+        self.assertEqual(deliver(pool, 10, 60), (0, 0))
+
+
+class PurgeTests(TestCase):
+    """ Settled emails are deleted after the retention period """
+    def test_purge(self):
+        """ Only settled emails past the retention are deleted, in chunks """
+        now = timezone.now()
+        old_sent, old_failed, old_pending = enqueue(3, now - timedelta(days=2))
+        recent_sent = enqueue(1, now - timedelta(hours=1))[0]
+        OutboxEmail.objects \
+            .filter(id__in=[old_sent.id, recent_sent.id]) \
+            .update(status=OutboxEmail.SENT)
+        OutboxEmail.objects.filter(id=old_failed.id).update(status=OutboxEmail.FAILED)
+        self.assertEqual(purge(86400, chunk_size=1), 2)
+        self.assertEqual(
+            set(OutboxEmail.objects.values_list("id", flat=True)),
+            {old_pending.id, recent_sent.id}
+        )
@@ -0,0 +1,129 @@
+import base64
+from datetime import timedelta
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import SimpleTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import NotFound
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, APITestCase, force_authenticate
+from core.models.models import Poll, Candidate
+from core.pagination import PollCursorPagination
+from core.views.admin_poll_view import AdminListOrCreatePoll
+
+
+class CursorTests(SimpleTestCase):
+    """ Cursors hold the (start, id) key of the last poll of a page """
+    def test_round_trip(self):
+        """ A decoded cursor is the key it was encoded from """
+        start = timezone.now()
+        for key in ((start, 7), (None, 3)):
+            self.assertEqual(PollCursorPagination.decode(PollCursorPagination.encode(key)), key)
+
+    def test_invalid(self):
+        """ A malformed cursor is not found """
+        for cursor in (
+                "not base64!",
+                base64.urlsafe_b64encode(b"not json").decode("ascii"),
+                base64.urlsafe_b64encode(b'["yesterday", 1]').decode("ascii"),
+                base64.urlsafe_b64encode(b'[null, "one"]').decode("ascii"),
+                base64.urlsafe_b64encode(b"[null]").decode("ascii")):
+            with self.assertRaises(NotFound):
+                PollCursorPagination.decode(cursor)
+
+    @mock.patch("core.pagination.POLL_MAX_PAGE_SIZE", 100)
+    @mock.patch("core.pagination.POLL_PAGE_SIZE", 10)
+    def test_page_size(self):
+        """ Page sizes are kept within 1 and POLL_MAX_PAGE_SIZE """
+        pagination = PollCursorPagination()
+        for params, expected in (({}, 10), ({"page_size": "5"}, 5), ({"page_size": "0"}, 1),
+                                 ({"page_size": "1000"}, 100), ({"page_size": "five"}, 10)):
+            request = Request(APIRequestFactory().get("/", params))
+            self.assertEqual(pagination.get_page_size(request), expected)
+
+
+class PollPaginationTests(APITestCase):
+    """ Paging through listings returns every poll exactly once """
+    def setUp(self):
+        self.admin_user = get_user_model().objects.create(
+            username="admin",
+            email="admin@admin.com",
+            is_staff=True,
+            is_superuser=True
+        )
+        datenow = timezone.now()
+        end = datenow + timedelta(days=1)
+        shared_start = datenow - timedelta(hours=1)
+        self.polls = [Poll.objects.create(title="no start", start=None, end=end) for _ in range(3)]
+        self.polls += [
+            Poll.objects.create(title="shared", start=shared_start, end=end) for _ in range(5)
+        ]
+        self.polls += [
+            Poll.objects.create(
+                title="later",
+                start=shared_start + timedelta(minutes=minutes),
+                end=end
+            )
+            for minutes in range(1, 4)
+        ]
+        for poll in self.polls:
+            Candidate.objects.create(name="candidate", poll=poll)
+
+    def get(self, params):
+        """ Lists polls as the admin """
+        request = APIRequestFactory().get("/", params)
+        force_authenticate(request, user=self.admin_user)
+        return AdminListOrCreatePoll.as_view(throttle_classes=[])(request)
+
+    def page_through(self, page_size):
+        """ Follows next links, returns the ids of every page """
+        pages = []
+        params = {"page_size": page_size}
+        while True:
+            response = self.get(params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            pages.append([poll["id"] for poll in response.data["results"]])
+            if response.data["next"] is None:
+                return pages
+            query = parse_qs(urlparse(response.data["next"]).query)
+            params = {key: values[0] for key, values in query.items()}
+
+    def test_pages(self):
+        """ Polls without a start come first, then by start and id """
+        expected = [poll.id for poll in self.polls]
+        for fast in (True, False):
+            with mock.patch("core.views.admin_poll_view.FAST_SERIALIZERS", fast):
+                for page_size in (1, 2, 4, len(expected)):
+                    pages = self.page_through(page_size)
+                    self.assertTrue(all(len(page) == page_size for page in pages[:-1]))
+                    self.assertEqual(sum(pages, []), expected)
+
+    def test_unpaginated(self):
+        """ Listings without pagination parameters return every poll """
+        self.assertEqual(len(self.get({}).data), len(self.polls))
+
+    def test_invalid_cursor(self):
+        """ A malformed cursor answers 404 """
+        self.assertEqual(self.get({"cursor": "garbage"}).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_fields(self):
+        """ Polls listed without candidates do not load them """
+        for fast in (True, False):
+            with mock.patch("core.views.admin_poll_view.FAST_SERIALIZERS", fast):
+                with CaptureQueriesContext(connection) as context:
+                    response = self.get({"page_size": 4, "fields": "id,title"})
+                self.assertEqual(set(response.data["results"][0]), {"id", "title"})
+                self.assertFalse(
+                    any("core_candidate" in query["sql"] for query in context.captured_queries)
+                )
+                with CaptureQueriesContext(connection) as context:
+                    response = self.get({"page_size": 4})
+                self.assertEqual(len(response.data["results"][0]["candidates"]), 1)
+                candidate_queries = [
+                    query for query in context.captured_queries if "core_candidate" in query["sql"]
+                ]
+                self.assertEqual(len(candidate_queries), 1)
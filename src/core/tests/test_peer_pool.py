@@ -0,0 +1,98 @@
+import asyncio
+from types import SimpleNamespace
+from django.test import SimpleTestCase
+from votechain.peer_pool import PeerPool, is_not_installed
+
+NOT_INSTALLED = "cannot retrieve package for chaincode Votechain-1/v0, " \
+    "error open: no such file or directory"
+
+
+def run(coroutine):
+    """ Runs a coroutine on a loop of its own """
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class PeerPoolTests(SimpleTestCase):
+    """ Peers missing a chaincode are left out of that chaincode's requests """
+    def setUp(self):
+        self.pool = PeerPool({
+            "org1": ["peer0.org1", "peer1.org1"],
+            "org2": ["peer0.org2", "peer1.org2"]
+        }, hedge_delay=0)
+        # org2 answers fastest, as if chaincodes were installed there
+        for name, latency in (("peer0.org2", 0.01), ("peer1.org2", 0.02),
+                              ("peer0.org1", 0.03), ("peer1.org1", 0.04)):
+            self.pool.record_success(name, latency)
+
+    def test_is_not_installed(self):
+        """ Peer errors about a missing chaincode are told apart from chaincode errors """
+        self.assertTrue(is_not_installed(Exception(NOT_INSTALLED)))
+        self.assertFalse(is_not_installed(Exception("Candidate doesn't exist")))
+
+    def test_endorsers(self):
+        """ Endorsers come from organizations the chaincode is not missing from """
+        self.assertEqual(self.pool.endorsers("Votechain-1"), ["peer0.org2"])
+        for name in self.pool.peers_of("org2"):
+            self.pool.mark_missing("Votechain-1", name)
+        self.assertEqual(self.pool.endorsers("Votechain-1"), ["peer0.org1"])
+        self.assertEqual(self.pool.endorsers("Votechain-2"), ["peer0.org2"])
+
+    def test_missing_everywhere(self):
+        """ A chaincode missing from every peer leaves all of them in """
+        for name in self.pool.peers:
+            self.pool.mark_missing("Votechain-1", name)
+        self.assertEqual(self.pool.fastest(4, "Votechain-1"), self.pool.fastest(4))
+
+    def test_missing_expires(self):
+        """ A peer is asked again once its missing cooldown is over """
+        self.pool.missing_cooldown = 0
+        self.pool.mark_missing("Votechain-1", "peer0.org2")
+        self.assertEqual(self.pool.fastest(1, "Votechain-1"), ["peer0.org2"])
+
+    def test_hedged_falls_back(self):
+        """ A query moves on to peers having the chaincode and remembers the others """
+        asked = []
+
+        async def request(peer):
+            asked.append(peer)
+            if peer.endswith("org2"):
+                raise Exception([SimpleNamespace(response=SimpleNamespace(message=NOT_INSTALLED))])
+            return peer
+
+        self.assertEqual(run(self.pool.hedged(request, "Votechain-1")), "peer0.org1")
+        self.assertEqual(asked, ["peer0.org2", "peer1.org2", "peer0.org1"])
+        del asked[:]
+        self.assertEqual(run(self.pool.hedged(request, "Votechain-1")), "peer0.org1")
+        self.assertEqual(asked, ["peer0.org1"])
+
+    def test_hedged_raises_chaincode_error(self):
+        """ An error of the chaincode itself is raised right away """
+        asked = []
+
+        async def request(peer):
+            asked.append(peer)
+            raise Exception("Candidate doesn't exist")
+
+        with self.assertRaisesMessage(Exception, "Candidate doesn't exist"):
+            run(self.pool.hedged(request, "Votechain-1"))
+        self.assertEqual(asked, ["peer0.org2"])
+
+    def test_hedged_not_installed_anywhere(self):
+        """ The error reaches the caller when no peer has the chaincode """
+        async def request(peer):
+            raise Exception(NOT_INSTALLED)
+
+        with self.assertRaisesMessage(Exception, "cannot retrieve package"):
+            run(self.pool.hedged(request, "Votechain-1"))
+
+    def test_hedged_without_peers(self):
+        """ A pool without peers to ask says so """
+        async def request(peer):
+            return peer
+
+        with self.assertRaisesMessage(ValueError, "no peer has chaincode Votechain-1"):
+            run(PeerPool({}).hedged(request, "Votechain-1"))
@@ -0,0 +1,133 @@
+from datetime import timedelta
+from unittest import mock
+from django.test import TestCase
+from django.utils import timezone
+from core import provisioning
+from core.models.models import Poll, Candidate, ChaincodeInstance
+from votechain.hyperledger import CHAINCODE_PREFIX, SHARED_CHAINCODE_NAME
+
+# mocks patched onto a test class are passed to each of its tests, used or not
+# pylint: disable=unused-argument
+
+
+@mock.patch("core.provisioning.get_network_client")
+class ProvisioningTests(TestCase):
+    """ Binding chaincodes to polls from the warm pool or instantiating dedicated ones """
+    def create_poll(self, **kwargs):
+        """ Creates a poll waiting for its chaincode """
+        datenow = timezone.now()
+        return Poll.objects.create(
+            title="poll",
+            start=datenow + timedelta(days=1),
+            end=datenow + timedelta(days=2),
+            provisioning_status=Poll.PROVISIONING,
+            **kwargs
+        )
+
+    def status_of(self, poll):
+        """ Reads the provisioning status of a poll """
+        return Poll.objects.get(id=poll.id).provisioning_status
+
+    def test_warm_instance(self, get_network_client):
+        """ A poll gets the oldest ready chaincode of the warm pool """
+        ChaincodeInstance.objects.create(name="Votechain-pool-a", status=ChaincodeInstance.FAILED)
+        warm = ChaincodeInstance.objects.create(
+            name="Votechain-pool-b",
+            status=ChaincodeInstance.READY
+        )
+        ChaincodeInstance.objects.create(name="Votechain-pool-c", status=ChaincodeInstance.READY)
+        poll = self.create_poll()
+        provisioning.provision_poll(poll.id)
+        self.assertEqual(ChaincodeInstance.objects.get(poll=poll).id, warm.id)
+        self.assertEqual(self.status_of(poll), Poll.READY)
+        get_network_client.return_value.deploy_chaincode.assert_not_called()
+
+    def test_dedicated_instance(self, get_network_client):
+        """ A chaincode is instantiated for a poll when the pool is empty """
+        poll = self.create_poll()
+        provisioning.provision_poll(poll.id)
+        instance = ChaincodeInstance.objects.get(poll=poll)
+        self.assertEqual(instance.name, CHAINCODE_PREFIX + str(poll.id))
+        self.assertEqual(instance.status, ChaincodeInstance.READY)
+        get_network_client.return_value.deploy_chaincode.assert_called_once_with(instance.name)
+        self.assertEqual(self.status_of(poll), Poll.READY)
+
+    def test_shared_instance(self, get_network_client):
+        """ Polls sharing a chaincode instantiate it once """
+        first = self.create_poll(shared_chaincode=True)
+        second = self.create_poll(shared_chaincode=True)
+        provisioning.provision_poll(first.id)
+        provisioning.provision_poll(second.id)
+        get_network_client.return_value.deploy_chaincode \
+            .assert_called_once_with(SHARED_CHAINCODE_NAME)
+        self.assertEqual(ChaincodeInstance.objects.get(name=SHARED_CHAINCODE_NAME).poll, None)
+        self.assertEqual(self.status_of(second), Poll.READY)
+
+    def test_failed_deploy(self, get_network_client):
+        """ A failed instantiation fails the chaincode and the poll """
+        get_network_client.return_value.deploy_chaincode.side_effect = ConnectionError("down")
+        poll = self.create_poll()
+        with self.assertRaises(ConnectionError):
+            provisioning.provision_poll(poll.id)
+        self.assertEqual(ChaincodeInstance.objects.get(poll=poll).status, ChaincodeInstance.FAILED)
+        self.assertEqual(self.status_of(poll), Poll.FAILED)
+
+    def test_being_instantiated(self, get_network_client):
+        """ A chaincode already being instantiated is not instantiated again """
+        poll = self.create_poll()
+        ChaincodeInstance.objects.create(name=CHAINCODE_PREFIX + str(poll.id), poll=poll)
+        provisioning.provision_poll(poll.id)
+        get_network_client.return_value.deploy_chaincode.assert_not_called()
+        self.assertEqual(self.status_of(poll), Poll.PROVISIONING)
+
+    def test_sync_candidates(self, get_network_client):
+        """ Candidates changed during a ledger call are synced in another round """
+        poll = self.create_poll()
+        Candidate.objects.create(name="a", poll=poll)
+        Candidate.objects.create(name="b", poll=poll)
+
+        def add_candidates(poll_id, names):
+            # candidates changed by an administrator while the ledger is called
+            if names == ["a", "b"]:
+                Candidate.objects.filter(poll=poll, name="b").delete()
+                Candidate.objects.create(name="c", poll=poll)
+
+        votechain_client = get_network_client.return_value
+        votechain_client.add_candidates.side_effect = add_candidates
+        provisioning.provision_poll(poll.id)
+        self.assertEqual(
+            votechain_client.add_candidates.call_args_list,
+            [mock.call(poll.id, ["a", "b"]), mock.call(poll.id, ["c"])]
+        )
+        votechain_client.delete_candidates.assert_called_once_with(poll.id, ["b"])
+        self.assertEqual(self.status_of(poll), Poll.READY)
+
+    def test_fill_pool(self, get_network_client):
+        """ The warm pool is filled up to its size, failed instances do not count """
+        ChaincodeInstance.objects.create(name="Votechain-pool-a", status=ChaincodeInstance.READY)
+        ChaincodeInstance.objects.create(name="Votechain-pool-b", status=ChaincodeInstance.FAILED)
+        deploy_chaincode = get_network_client.return_value.deploy_chaincode
+        deploy_chaincode.side_effect = [None, ConnectionError("down")]
+        self.assertEqual(provisioning.fill_pool(3), 1)
+        self.assertEqual(deploy_chaincode.call_count, 2)
+        self.assertEqual(
+            ChaincodeInstance.objects.filter(poll=None, status=ChaincodeInstance.READY).count(),
+            2
+        )
+
+    def test_expire_stale(self, get_network_client):
+        """ Instances provisioning for too long are marked failed """
+        stale = ChaincodeInstance.objects.create(name="Votechain-pool-a")
+        ChaincodeInstance.objects \
+            .filter(id=stale.id) \
+            .update(updated=timezone.now() - timedelta(hours=1))
+        fresh = ChaincodeInstance.objects.create(name="Votechain-pool-b")
+        self.assertEqual(provisioning.expire_stale(600), 1)
+        self.assertEqual(
+            ChaincodeInstance.objects.get(id=stale.id).status,
+            ChaincodeInstance.FAILED
+        )
+        self.assertEqual(
+            ChaincodeInstance.objects.get(id=fresh.id).status,
+            ChaincodeInstance.PROVISIONING
+        )
@@ -0,0 +1,98 @@
+import asyncio
+from unittest import mock
+from django.test import SimpleTestCase
+from votechain import scheduler
+from votechain.scheduler import VoteScheduler, VoteConflictError, InvalidTransactionError
+
+CONFLICT = InvalidTransactionError("['MVCC_READ_CONFLICT']")
+
+
+class FakeClient():
+    """ Answers transactions with scripted outcomes, the last one repeated, and logs them """
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes) or ["ok"]
+        self.log = []
+        self.calls = 0
+
+    def sender(self, name):
+        """ Returns a send coroutine function for a transaction named name """
+        async def send():
+            self.log.append(("start", name))
+            await asyncio.sleep(0.01)
+            self.log.append(("end", name))
+            outcome = self.outcomes[min(self.calls, len(self.outcomes) - 1)]
+            self.calls += 1
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        return send
+
+
+class VoteSchedulerTests(SimpleTestCase):
+    """ Votes on the same counters are serialized and read conflicts are resent """
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.scheduler = VoteScheduler(2, 0.1, 0.3)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def run_on_loop(self, *coroutines):
+        """ Runs coroutines concurrently on the test's loop, returns their results or errors """
+        async def gather():
+            return await asyncio.gather(*coroutines, return_exceptions=True)
+
+        return self.loop.run_until_complete(gather())
+
+    def counts(self):
+        """ Returns the current conflicts, retries and failures counts """
+        return scheduler.conflicts.value, scheduler.retries.value, scheduler.failures.value
+
+    def test_serialized(self):
+        """ Votes sharing a counter run one after the other, others run alongside """
+        client = FakeClient()
+        self.run_on_loop(
+            self.scheduler.run([("poll", "a")], client.sender("first")),
+            self.scheduler.run([("poll", "b"), ("poll", "a")], client.sender("second")),
+            self.scheduler.run([("poll", "c")], client.sender("third"))
+        )
+        log = client.log
+        self.assertLess(log.index(("end", "first")), log.index(("start", "second")))
+        self.assertLess(log.index(("start", "third")), log.index(("end", "first")))
+        # locks are forgotten once no vote waits for them
+        self.assertEqual(self.scheduler._locks, {})  # pylint: disable=protected-access
+
+    @mock.patch("votechain.scheduler.random.uniform", return_value=0)
+    def test_conflict_retried(self, uniform):
+        """ A read conflict is resent after a jittered, growing and capped backoff """
+        client = FakeClient(CONFLICT, CONFLICT, "ok")
+        before = self.counts()
+        results = self.run_on_loop(self.scheduler.run(["key"], client.sender("vote")))
+        self.assertEqual(results, ["ok"])
+        self.assertEqual(client.calls, 3)
+        self.assertEqual(uniform.call_args_list, [mock.call(0, 0.2), mock.call(0, 0.3)])
+        self.assertEqual(self.counts(), (before[0] + 2, before[1] + 2, before[2]))
+
+    @mock.patch("votechain.scheduler.random.uniform", return_value=0)
+    def test_retries_exhausted(self, uniform):
+        """ A vote still conflicting after all retries fails with VoteConflictError """
+        client = FakeClient(CONFLICT)
+        before = self.counts()
+        error, = self.run_on_loop(self.scheduler.run(["key"], client.sender("vote")))
+        self.assertIsInstance(error, VoteConflictError)
+        self.assertEqual(str(error), "Vote conflicted 3 times")
+        self.assertIs(error.__cause__, CONFLICT)
+        self.assertEqual(client.calls, 3)
+        self.assertEqual(uniform.call_count, 2)
+        self.assertEqual(self.counts(), (before[0] + 3, before[1] + 2, before[2] + 1))
+
+    def test_invalid_not_retried(self):
+        """ A transaction invalidated for another reason than a read conflict is not resent """
+        invalid = InvalidTransactionError("['ENDORSEMENT_POLICY_FAILURE']")
+        client = FakeClient(invalid)
+        before = self.counts()
+        results = self.run_on_loop(self.scheduler.run(["key"], client.sender("vote")))
+        self.assertEqual(results, [invalid])
+        self.assertEqual(client.calls, 1)
+        self.assertEqual(self.counts(), before)
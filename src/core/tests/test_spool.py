@@ -0,0 +1,171 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import uuid
+from datetime import timedelta
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+from core.management.commands.drain_vote_spool import settle_receipts
+from core.models.models import Poll, VoteIdentificationToken, VoteReceipt, OutboxEmail, Trail
+from votechain.spool import VoteSpool, receipt_for, PENDING
+
+
+class SpoolTestCase(SimpleTestCase):
+    """ Runs against a spool of its own in a temporary directory """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "votes.sqlite3")
+        self.spool = VoteSpool(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def rows(self):
+        """ Returns every row of the spool as stored """
+        connection = sqlite3.connect(self.path)
+        try:
+            return connection.execute("SELECT * FROM ballots ORDER BY receipt").fetchall()
+        finally:
+            connection.close()
+
+
+class VoteSpoolTests(SpoolTestCase):
+    """ Votes are spooled under their receipt and replayed until the ledger took them """
+    def test_append(self):
+        """ The vit is not stored and appending a vote again keeps the first one """
+        vit = uuid.uuid4()
+        vote = self.spool.append(vit, 1, "candidate", 0)
+        self.assertEqual(vote.receipt, receipt_for(vit))
+        again = self.spool.append(vit, 1, "other", 0)
+        self.assertEqual(again.candidate, "candidate")
+        rows = self.rows()
+        self.assertEqual(len(rows), 1)
+        self.assertNotIn(str(vit), [str(value) for value in rows[0]])
+
+    def test_pending(self):
+        """ Pending votes are streamed in chunks, drained ones are left out """
+        receipts = sorted(
+            self.spool.append(uuid.uuid4(), 1, "candidate", 0).receipt for _ in range(5)
+        )
+        self.spool.mark_drained(receipts[2])
+        pending = [vote.receipt for vote in self.spool.pending(chunk_size=2)]
+        self.assertEqual(pending, receipts[:2] + receipts[3:])
+
+    def test_drain(self):
+        """ A failed replay stays pending and is counted, a successful one is drained once """
+        failing = self.spool.append(uuid.uuid4(), 1, "failing", 0).receipt
+        passing = self.spool.append(uuid.uuid4(), 1, "passing", 0).receipt
+        replayed = []
+        down = ["failing"]
+
+        def replay(vote):
+            replayed.append(vote.receipt)
+            if vote.candidate in down:
+                raise ConnectionError("ledger is down")
+
+        self.assertEqual(self.spool.drain(replay, chunk_size=1), (1, 1))
+        self.assertEqual(self.spool.drained_receipts([failing, passing]), {passing})
+        self.assertEqual([vote.receipt for vote in self.spool.pending()], [failing])
+        attempts = {row[0]: row[5] for row in self.rows()}
+        self.assertEqual(attempts[failing], 1)
+        down.clear()
+        self.assertEqual(self.spool.drain(replay), (1, 0))
+        self.assertEqual(sorted(replayed), sorted([failing, passing, failing]))
+        self.assertEqual(self.spool.drain(replay), (0, 0))
+
+    def test_prune(self):
+        """ Drained votes are removed after the retention period """
+        receipt = self.spool.append(uuid.uuid4(), 1, "candidate", 0).receipt
+        self.spool.prune(0)
+        self.assertEqual(len(self.rows()), 1)
+        self.spool.mark_drained(receipt)
+        self.spool.prune(-1)
+        self.assertEqual(self.rows(), [])
+
+
+class LegacySpoolTests(SimpleTestCase):
+    """ A spool keyed by vit is moved over to receipts """
+    def test_drop_vits(self):
+        """ Pending votes of the old votes table are kept and the table is dropped """
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "votes.sqlite3")
+            vit = str(uuid.uuid4())
+            connection = sqlite3.connect(path)
+            connection.execute(
+                "CREATE TABLE votes (vit TEXT PRIMARY KEY, receipt TEXT NOT NULL, "
+                "poll_id INTEGER NOT NULL, candidate TEXT NOT NULL, shards INTEGER NOT NULL, "
+                "state TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, created REAL NOT NULL, "
+                "drained REAL)"
+            )
+            connection.execute(
+                "INSERT INTO votes VALUES (?, ?, 1, 'candidate', 0, ?, 2, 0, NULL)",
+                (vit, receipt_for(vit), PENDING)
+            )
+            connection.commit()
+            connection.close()
+            spool = VoteSpool(path)
+            votes = list(spool.pending())
+            self.assertEqual([vote.receipt for vote in votes], [receipt_for(vit)])
+            tables = sqlite3.connect(path).execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table'"
+            ).fetchall()
+            self.assertEqual(tables, [("ballots",)])
+        finally:
+            shutil.rmtree(directory)
+
+
+class SettleReceiptsTests(TestCase):
+    """ Asynchronous votes are marked committed once the spool drained them """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.spool = VoteSpool(os.path.join(self.directory, "votes.sqlite3"))
+        datenow = timezone.now()
+        self.poll = Poll.objects.create(title="poll", end=datenow + timedelta(hours=1))
+        self.user = get_user_model().objects.create(username="voter", email="voter@voter.com")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def accept(self, count):
+        """ Spools votes accepted for an asynchronous commit, returns their receipts """
+        receipts = []
+        for _ in range(count):
+            vit = VoteIdentificationToken.generate_token(self.poll)
+            receipts.append(VoteReceipt.objects.create(user=self.user, poll=self.poll, vit=vit))
+            self.spool.append(vit.token, self.poll.id, "candidate", 0)
+        return receipts
+
+    def test_settle(self):
+        """ Only receipts of drained votes are marked committed, chunk by chunk """
+        receipts = self.accept(3)
+        self.spool.mark_drained(receipt_for(receipts[0].vit.token))
+        self.spool.mark_drained(receipt_for(receipts[2].vit.token))
+        self.assertEqual(settle_receipts(self.spool, chunk_size=2), 2)
+        statuses = [VoteReceipt.objects.get(id=receipt.id).status for receipt in receipts]
+        self.assertEqual(
+            statuses,
+            [VoteReceipt.COMMITTED, VoteReceipt.PENDING, VoteReceipt.COMMITTED]
+        )
+
+    def test_vvpat(self):
+        """ A settled vote's vvpat is queued once and carries its ledger receipt """
+        receipt = self.accept(1)[0]
+        ledger_receipt = receipt_for(receipt.vit.token)
+        self.spool.mark_drained(ledger_receipt)
+        settle_receipts(self.spool, chunk_size=2)
+        self.assertEqual(settle_receipts(self.spool, chunk_size=2), 0)
+        emails = OutboxEmail.objects.filter(recipient=self.user.email)
+        self.assertEqual(emails.count(), 1)
+        vvpat = emails.get().body.splitlines()[3]
+        self.assertEqual(Trail.decrypt(vvpat), ledger_receipt)
+
+    def test_already_committed(self):
+        """ A vote its background job already committed is not sent another vvpat """
+        receipt = self.accept(1)[0]
+        self.spool.mark_drained(receipt_for(receipt.vit.token))
+        VoteReceipt.objects.filter(id=receipt.id).update(status=VoteReceipt.COMMITTED)
+        self.assertEqual(settle_receipts(self.spool, chunk_size=2), 0)
+        self.assertFalse(OutboxEmail.objects.exists())
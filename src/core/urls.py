@@ -40,6 +40,7 @@ schema_view = get_schema_view(
 # Additionally, we include login URLs for the browsable API.
 urlpatterns = [
     path('', miscellanous.index, name='main page'),
+    path('metrics', miscellanous.MetricsView.as_view(), name='metrics'),
     path('admin/doc', include('django.contrib.admindocs.urls')),
     path('admin/login', page_not_found, kwargs={'exception': Exception('Page not Found')}),
     path('admin/', admin.site.urls),
@@ -53,6 +54,16 @@ urlpatterns = [
         admin_poll_view.GenerateVitView.as_view(),
         name='generate_vits'
     ),
+    path(
+        'poll/<int:id>/electorate',
+        admin_poll_view.UploadElectorateView.as_view(),
+        name='upload_electorate'
+    ),
+    path(
+        'poll/<int:id>/electorate/<int:upload_id>',
+        admin_poll_view.GetElectorateUploadView.as_view(),
+        name='get_electorate_upload'
+    ),
     path('poll', admin_poll_view.AdminListOrCreatePoll.as_view(), name='admin_list_poll'),
     path(
         'poll/<int:poll_id>/candidate',
@@ -77,6 +88,11 @@ urlpatterns = [
         voter_view.VoterCastVote.as_view(),
         name='voter_cast_vote'
     ),
+    path(
+        'voter/poll/<int:poll_id>/vote/<uuid:receipt>',
+        voter_view.VoterGetVoteStatus.as_view(),
+        name='voter_get_vote_status'
+    ),
     path(
         'voter/poll/<int:poll_id>/verify',
         voter_view.VoterGetVote.as_view(),
@@ -1,17 +1,24 @@
 """ Module containing views for administration panel """
 
-from django.core import mail
 from django.utils import timezone
+from django.db import transaction
 from django.db.utils import IntegrityError
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
 from rest_framework import status, generics, permissions
 from rest_framework.serializers import Serializer
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
-from core.models.models import Poll, Candidate, VoteIdentificationToken
+from core.models.models import Poll, Candidate, VoteIdentificationToken, ElectorateUpload
 from core.serializers.serializers import PollSerializer, \
-    CandidateSerializer, CandidateNestedSerializer, VitGeneratorSerializer
-from votechain.hyperledger import VotechainNetworkClient
+    CandidateSerializer, CandidateNestedSerializer, VitGeneratorSerializer, \
+    ElectorateUploadSerializer
+from core import background, electorate
+from core.pagination import PollCursorPagination
+from core.serializers.fast import poll_values
+from core.provisioning import provision_poll
+from votechain.hyperledger import get_network_client
+from votechain.settings import VOTE_SHARDS, CHAINCODE_MODE, FAST_SERIALIZERS
 
 future_param = openapi.Parameter(
     'future',
@@ -37,6 +44,69 @@ active_param = openapi.Parameter(
     description="filter based on poll's cancellation status",
     type=openapi.TYPE_BOOLEAN
 )
+cursor_param = openapi.Parameter(
+    'cursor',
+    openapi.IN_QUERY,
+    description="returns the page following the one whose next link holds this cursor",
+    type=openapi.TYPE_STRING
+)
+page_size_param = openapi.Parameter(
+    'page_size',
+    openapi.IN_QUERY,
+    description="number of polls per page, paginates the listing",
+    type=openapi.TYPE_INTEGER
+)
+fields_param = openapi.Parameter(
+    'fields',
+    openapi.IN_QUERY,
+    description="comma separated fields of polls to return, e.g. id,title,start,end",
+    type=openapi.TYPE_STRING
+)
+listing_params = [cursor_param, page_size_param, fields_param]
+
+
+class PollListMixin():
+    """
+    Poll listing paginated when asked for, limited to the requested fields
+    and with the candidates of all polls loaded in one query.
+    With FAST_SERIALIZERS polls are serialized from .values() rows.
+    """
+    pagination_class = PollCursorPagination
+
+    def get_fields(self):
+        """ Returns the fields asked for with the fields parameter, None for all of them """
+        fields = self.request.query_params.get("fields", None)
+        if not fields:
+            return None
+        return [name.strip() for name in fields.split(",") if name.strip()]
+
+    def get_serializer(self, *args, **kwargs):
+        """ Limits serialized polls to the fields asked for when listing them """
+        if self.request.method == "GET":
+            kwargs.setdefault("fields", self.get_fields())
+        return super().get_serializer(*args, **kwargs)
+
+    def prefetch(self, queryset):
+        """ Prefetches candidates unless they are left out """
+        fields = self.get_fields()
+        if fields is None or "candidates" in fields:
+            return queryset.prefetch_related("candidates")
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        """ Lists polls, serialized from .values() rows with FAST_SERIALIZERS """
+        if not FAST_SERIALIZERS:
+            return super().list(request, *args, **kwargs)
+        fields = self.get_fields()
+        rows = poll_values.values(
+            self.filter_queryset(self.get_queryset()),
+            fields,
+            extra=PollCursorPagination.keys
+        )
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(poll_values.serialize(page, fields))
+        return Response(poll_values.serialize(rows, fields))
 
 
 def update_poll(request, poll, method, *args, **kwargs):
@@ -64,7 +134,24 @@ def update_poll(request, poll, method, *args, **kwargs):
             status=status.HTTP_400_BAD_REQUEST
         )
 
-class AdminListOrCreatePoll(generics.ListCreateAPIView):
+def is_provisioned(poll, otherwise):
+    """
+    Checks whether a poll's chaincode is ready; when it is not, runs otherwise,
+    which changes candidates in the database alone, while the poll is locked,
+    so the provisioner syncs the change before marking the poll ready.
+    A ready poll stays ready, so its ledger is updated without holding the lock.
+    """
+    with transaction.atomic():
+        if Poll.objects \
+                .select_for_update() \
+                .filter(id=poll.id, provisioning_status=Poll.READY) \
+                .exists():
+            return True
+        otherwise()
+    return False
+
+
+class AdminListOrCreatePoll(PollListMixin, generics.ListCreateAPIView):
     """
     Lists or creates polls
     """
@@ -94,10 +181,12 @@ class AdminListOrCreatePoll(generics.ListCreateAPIView):
                 queryset = queryset.filter(isActive=True)
             elif active.lower() == "false":
                 queryset = queryset.filter(isActive=False)
-        return queryset
+        return self.prefetch(queryset)
 
 
-    @swagger_auto_schema(manual_parameters=[ongoing_param, ended_param, future_param, active_param])
+    @swagger_auto_schema(
+        manual_parameters=[ongoing_param, ended_param, future_param, active_param] + listing_params
+    )
     def get(self, request, *args, **kwargs):
         """
         Optional query parameters:
@@ -105,18 +194,30 @@ class AdminListOrCreatePoll(generics.ListCreateAPIView):
         future -- (true/false) returns only future polls
         ended -- (true/false) return only ended polls
         active -- (true/false) filter based on poll's cancellation status
+        page_size -- returns a page of polls ordered by start and id, with a link to the next one
+        cursor -- returns the page after the one whose next link holds it
+        fields -- (comma separated) returns only these fields of polls
 
         The date parameters are evaluated in order: ongoing, future, ended. If you specify both future
         and ended, only future polls will be returned.
         """
         return self.list(request, *args, **kwargs)
 
+    def perform_create(self, serializer):
+        shared_chaincode = CHAINCODE_MODE == "shared"
+        poll = serializer.save(
+            vote_shards=VOTE_SHARDS,
+            shared_chaincode=shared_chaincode,
+            provisioning_status=Poll.PROVISIONING
+        )
+        transaction.on_commit(lambda: background.submit(provision_poll, poll.id))
+
     def post(self, request, *args, **kwargs):
-        """ Creates a new poll """
-        response = self.create(request, *args, **kwargs)
-        votechain_client = VotechainNetworkClient()
-        votechain_client.add_poll(response.data["id"])
-        return response
+        """
+        Creates a new poll, its chaincode is provisioned in the background.
+        The poll accepts votes once its provisioning_status is ready.
+        """
+        return self.create(request, *args, **kwargs)
 
 
 class AdminPoll(generics.RetrieveUpdateAPIView):
@@ -210,9 +311,12 @@ class AdminListOrAddCandidate(generics.ListCreateAPIView):
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         if poll.can_edit():
             try:
-                votechain_client = VotechainNetworkClient()
-                votechain_client.add_candidates(poll.id, [serializer.validated_data["name"]])
-                serializer.save()
+                # candidates of a provisioning poll are synced once its chaincode is bound
+                if is_provisioned(poll, otherwise=serializer.save):
+                    votechain_client = get_network_client()
+                    votechain_client.add_candidates(poll.id, [serializer.validated_data["name"]])
+                    with transaction.atomic():
+                        serializer.save()
             except IntegrityError:
                 return Response(
                     data={"detail": "Candidate already exists in this poll" },
@@ -245,19 +349,21 @@ class AdminGetDeleteCandidate(generics.RetrieveDestroyAPIView):
 
     def delete_candidate(self, request, *args, **kwargs):
         candidate = self.get_queryset().first()
-        votechain_client = VotechainNetworkClient()
-        votechain_client.delete_candidates(
-            self.kwargs.get("poll_id", None),
-            [candidate.name]
-        )
-        return self.destroy(request, *args, **kwargs)
+        if is_provisioned(candidate.poll, otherwise=candidate.delete):
+            votechain_client = get_network_client()
+            votechain_client.delete_candidates(
+                self.kwargs.get("poll_id", None),
+                [candidate.name]
+            )
+            candidate.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
     def delete(self, request, *args, **kwargs):
         if self.get_queryset().count() > 0:
             return update_poll(
                 request,
                 self.get_queryset()[0].poll,
-                lambda x: self.delete_candidate(x, *args, **kwargs),
+                self.delete_candidate,
                 *args,
                 **kwargs
             )
@@ -288,13 +394,62 @@ class GenerateVitView(generics.CreateAPIView):
         sent = []
         mails = VitGeneratorSerializer(data=request.data)
         if mails.is_valid():
-            with mail.get_connection() as connection:
-                for _mail in mails.data["users"]:
-                    vit = VoteIdentificationToken.generate_token(poll)
-                    if vit.assign(_mail, connection):
-                        sent.append(_mail)
+            sent = VoteIdentificationToken.assign_tokens(poll, mails.data["users"])
         response_data = { "users": sent }
         return Response(
             data=response_data,
             status=status.HTTP_201_CREATED
         )
+
+
+class UploadElectorateView(generics.CreateAPIView):
+    """
+    Assigns tokens of a poll to the voters of a CSV or NDJSON file in the background
+    """
+    serializer_class = ElectorateUploadSerializer
+    permission_classes = [permissions.IsAdminUser]
+    parser_classes = [MultiPartParser]
+
+    def post(self, request, *args, **kwargs):
+        """
+        Takes a file field with one email per line, either CSV, in the first column
+        or the one headed "email", or NDJSON, as strings or objects with an "email" key.
+        An optional format field (csv/ndjson) overrides the format guessed from the file name.
+        Returns the upload, its progress is reported by poll/{id}/electorate/{upload_id}
+        """
+        poll = Poll.objects.filter(id=kwargs.get("id", None)).first()
+        if poll is None:
+            return Response(
+                data={ "detail": "Poll not found"},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        upload = request.FILES.get("file")
+        if upload is None:
+            return Response(
+                data={ "detail": "File is missing"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        file_format = request.data.get("format") or electorate.guess_format(upload.name)
+        if file_format not in dict(ElectorateUpload.FORMAT_CHOICES):
+            return Response(
+                data={ "detail": "Format must be csv or ndjson"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        job = electorate.store(poll, upload, file_format)
+        transaction.on_commit(lambda: background.submit(electorate.run_upload, job.id))
+        return Response(
+            data=ElectorateUploadSerializer(job).data,
+            status=status.HTTP_202_ACCEPTED
+        )
+
+
+class GetElectorateUploadView(generics.RetrieveAPIView):
+    """
+    Reports the progress of an electorate upload
+    """
+    serializer_class = ElectorateUploadSerializer
+    permission_classes = [permissions.IsAdminUser]
+    lookup_url_kwarg = "upload_id"
+
+    def get_queryset(self):
+        return ElectorateUpload.objects.filter(poll_id=self.kwargs.get("id", None))
@@ -1,6 +1,24 @@
 from django.shortcuts import redirect
+from rest_framework import generics, permissions
+from rest_framework.response import Response
+from rest_framework.serializers import Serializer
+from votechain import metrics
 
 
 def index(request):
     """ Redirect from main page to swagger """
     return redirect('/swagger')
+
+
+class MetricsView(generics.GenericAPIView):
+    """ View exporting in-process metrics of the ledger client """
+    permission_classes = [permissions.IsAdminUser]
+    serializer_class = Serializer
+
+    def get(self, request, *args, **kwargs):
+        """
+        Returns counters, gauges and histograms of this process,
+        e.g. per-phase latency of chaincode calls.
+        Histogram buckets are cumulative [upper bound, count] pairs.
+        """
+        return Response(data=metrics.snapshot())
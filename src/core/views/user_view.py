@@ -3,6 +3,8 @@ from rest_framework import status, generics, permissions
 from core.models.models import Voter
 from core.serializers.serializers import CompleteUserSerializer, PasswordSerializer, \
     VoterSerializer, UserSerializer
+from core.serializers.fast import voter_values
+from votechain.settings import FAST_SERIALIZERS
 
 
 class BaseVoterView(generics.GenericAPIView):
@@ -22,12 +24,16 @@ class VoterView(BaseVoterView, generics.RetrieveAPIView):
                 status=status.HTTP_404_NOT_FOUND,
                 data={"detail": "Could not retrieve voter's data"}
             )
-        voter = voters.first()
+        voter = voters.select_related("user").first()
         user_serial = UserSerializer(voter.user)
-        voter_serial = VoterSerializer(voter)
-        voter_serial.data.pop("user")
+        if FAST_SERIALIZERS:
+            voter_data = voter_values.serialize(voter_values.values(voters))[0]
+        else:
+            voter_serial = VoterSerializer(voter)
+            voter_serial.data.pop("user")
+            voter_data = voter_serial.data
         return Response(
-            data={ "user": user_serial.data, "voter": voter_serial.data},
+            data={ "user": user_serial.data, "voter": voter_data},
             status=status.HTTP_200_OK
         )
 
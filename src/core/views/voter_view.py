@@ -1,46 +1,174 @@
 """ Module containing views for administration panel """
 
 import json
-from django.core.mail import send_mail
+import logging
+import uuid
+from django.db import transaction
+from django.db.models import Exists, F, FilteredRelation, Q
 from django.utils import timezone
 from rest_framework.response import Response
 from rest_framework.serializers import Serializer
 from rest_framework import status, generics, permissions
 from drf_yasg.utils import swagger_auto_schema
+from core import background, ledger_index
 from core.models.models import Poll, Voter, Candidate, Trail, VoteIdentificationToken, \
-    CandidateResult
-from core.serializers.serializers import PollSerializer, TokenSerializer
-from core.validators import is_vit_valid
-from core.views.admin_poll_view import ongoing_param, ended_param
-from votechain.hyperledger import VotechainNetworkClient
-from votechain.settings import DEFAULT_FROM_EMAIL
+    CandidateResult, VoteReceipt, OutboxEmail
+from core.serializers.serializers import PollSerializer, TokenSerializer, VoteReceiptSerializer
+from core.views.admin_poll_view import ongoing_param, ended_param, listing_params, PollListMixin
+from votechain.hyperledger import get_network_client, is_rejected
+from votechain.settings import VOTE_ASYNC, VOTE_SPOOL
+from votechain.spool import get_vote_spool
 
+logger = logging.getLogger(__name__)
 
-def save_vote(candidate, poll, vit):
-    """ Saves a cast vote """
-    votechain_client = VotechainNetworkClient()
-    response = votechain_client.cast_vote(poll.id, candidate.name)
+
+def replay_vote(vote):
+    """ Sends a spooled vote to the ledger """
+    votechain_client = get_network_client()
+    return votechain_client.cast_vote(vote.poll_id, vote.candidate, vote.shards, vote.receipt)
+
+
+def record_vote(candidate_name, poll, vit):
+    """
+    Records a vote on the ledger and returns its vvpat and whether the ledger committed it.
+    With VOTE_SPOOL the vote is spooled first, a vote the ledger failed to commit
+    stays in the spool and is replayed by the drain_vote_spool command.
+    """
+    if VOTE_SPOOL:
+        spool = get_vote_spool()
+        vote = spool.append(vit.token, poll.id, candidate_name, poll.vote_shards)
+        token = Trail.generate_token(vote.receipt)
+        try:
+            replay_vote(vote)
+        except Exception:
+            logger.exception("Spooled vote %s could not be recorded", vote.receipt)
+            return token, False
+        spool.mark_drained(vote.receipt)
+        return token, True
+    votechain_client = get_network_client()
+    response = votechain_client.cast_vote(poll.id, candidate_name, poll.vote_shards)
+    return vvpat_of(response), True
+
+
+def vvpat_of(response):
+    """ Returns the vvpat of a vote from the ledger's response to it """
     parsed_response = json.loads(response)
-    token = Trail.generate_token(parsed_response["txId"])
-    vit.used = True
-    vit.save()
+    return Trail.generate_token(parsed_response["txId"])
+
+
+def save_vote(candidate, poll, vit):
+    """
+    Saves a vote cast with a claimed vit, a vote the ledger rejected releases it.
+    On any other error the vote may still commit, so the vit stays claimed, see hold_vote.
+    """
+    try:
+        token, _ = record_vote(candidate.name, poll, vit)
+    except Exception as ex:
+        if is_rejected(ex):
+            vit.release()
+        raise ex
     return token
 
 
+def hold_vote(user, poll, vit, error):
+    """
+    Records a vote whose outcome is unknown, e.g. after a timeout, as pending.
+    Its vit stays claimed, the vote is settled once the ledger call still running, if any, finishes.
+    """
+    receipt = VoteReceipt.objects.create(user=user, poll=poll, vit=vit)
+    watch_vote(receipt.id, error)
+    return receipt
+
+
+def watch_vote(receipt_id, error):
+    """ Settles a pending vote in the background once the ledger call that timed out finishes """
+    future = getattr(error, "future", None)
+    if future is not None:
+        future.add_done_callback(lambda done: background.submit(resume_vote, receipt_id, done))
+
+
+def accept_vote(user, candidate, poll, vit):
+    """
+    Schedules a vote cast with a claimed vit for an asynchronous commit.
+    The receipt names the voter, so the candidate is only handed to the background job
+    and to the spool, which keeps the vote should the process stop, see VOTE_ASYNC.
+    """
+    try:
+        receipt = VoteReceipt.objects.create(user=user, poll=poll, vit=vit)
+        if VOTE_SPOOL:
+            get_vote_spool().append(vit.token, poll.id, candidate.name, poll.vote_shards)
+    except Exception as ex:
+        vit.release()
+        raise ex
+    candidate_name = candidate.name
+    transaction.on_commit(lambda: background.submit(commit_vote, receipt.id, candidate_name))
+    return receipt
+
+
+def get_receipt(receipt_id):
+    """ Loads a vote receipt with everything settling it needs """
+    return VoteReceipt.objects \
+        .select_related("user", "poll", "vit") \
+        .get(id=receipt_id)
+
+
+def commit_vote(receipt_id, candidate_name):
+    """
+    Commits an accepted vote and sends its vvpat.
+    A spooled vote stays pending until the spool is drained.
+    """
+    receipt = get_receipt(receipt_id)
+    settle_vote(receipt, lambda: record_vote(candidate_name, receipt.poll, receipt.vit))
+
+
+def resume_vote(receipt_id, future):
+    """
+    Settles a pending vote with the result of its ledger call,
+    which finished after timing out
+    """
+    receipt = get_receipt(receipt_id)
+    if receipt.status != VoteReceipt.PENDING:
+        return
+    settle_vote(receipt, lambda: (vvpat_of(future.result()), True))
+
+
+def settle_vote(receipt, record):
+    """
+    Settles a vote with the outcome of record,
+    returning its vvpat and whether the ledger committed it.
+    A vote the ledger rejected releases its vit, like a rejected synchronous vote does.
+    On any other error the vote stays pending with its vit claimed, see hold_vote.
+    """
+    try:
+        vvpat, committed = record()
+    except Exception as ex:
+        logger.exception("Vote %s could not be settled", receipt.receipt)
+        if not is_rejected(ex):
+            watch_vote(receipt.id, ex)
+            return
+        with transaction.atomic():
+            receipt.vit.release()
+            receipt.status = VoteReceipt.FAILED
+            receipt.save()
+        return
+    if not committed:
+        # the spool still holds the vote, its vvpat is sent once drained, see settle_receipts
+        return
+    receipt.status = VoteReceipt.COMMITTED
+    with transaction.atomic():
+        receipt.save()
+        send_vvpat(receipt.user, receipt.poll, vvpat)
+
+
 def send_vvpat(user, poll, vvpat):
-    """ Sends a vote verification token through email """
+    """ Queues a vote verification token for delivery through email """
     message = """You have participated in a poll titled:
 {0}
 Your Vote Verification Token is:
 {1}
 """.format(poll.title, vvpat)
-    sent = send_mail(
-        "Vote verification token",
-        message,
-        DEFAULT_FROM_EMAIL,
-        [user.email]
-    )
-    return sent > 0
+    OutboxEmail.enqueue(user.email, "Vote verification token", message)
+    return True
 
 
 class VoterView(generics.GenericAPIView):
@@ -54,7 +182,7 @@ class VoterView(generics.GenericAPIView):
         return voter.polls
 
 
-class VoterListPoll(generics.ListAPIView, VoterView):
+class VoterListPoll(PollListMixin, generics.ListAPIView, VoterView):
     """
     Lists polls
     """
@@ -73,14 +201,17 @@ class VoterListPoll(generics.ListAPIView, VoterView):
         elif ended:
             queryset = queryset \
                 .filter(end__lte=datenow)
-        return queryset
+        return self.prefetch(queryset)
 
-    @swagger_auto_schema(manual_parameters=[ongoing_param, ended_param])
+    @swagger_auto_schema(manual_parameters=[ongoing_param, ended_param] + listing_params)
     def get(self, request, *args, **kwargs):
         """
         Optional query parameters:
         ongoing -- (true/false) returns only ongoing polls
         ended -- (true/false) return only ended polls
+        page_size -- returns a page of polls ordered by start and id, with a link to the next one
+        cursor -- returns the page after the one whose next link holds it
+        fields -- (comma separated) returns only these fields of polls
 
         The date parameters are evaluated in order: ongoing, ended. If you specify both ongoing
         and ended, only ongoing polls will be returned.
@@ -94,6 +225,55 @@ class VoterCastVote(generics.CreateAPIView, VoterView):
     serializer_class = TokenSerializer
     permission_classes = [permissions.IsAuthenticated]
 
+    def get_ballot(self, poll_id, candidate_id, token):
+        """
+        Loads the poll, if the voter may vote in it, with the candidate and the vit
+        of the vote joined to it, all in one query.
+        Returns the poll, the candidate and the vit, the latter two None when not found in the poll.
+        """
+        try:
+            token = uuid.UUID(str(token))
+        except ValueError:
+            token = None
+        polls = Poll.objects.filter(id=poll_id)
+        if self.request.user.is_superuser:
+            # like VoterView, a superuser votes in any poll, but only as a voter
+            polls = polls.filter(Exists(Voter.objects.filter(user=self.request.user)))
+        else:
+            polls = polls.filter(voter__user=self.request.user)
+        poll = polls \
+            .annotate(
+                ballot_candidate=FilteredRelation(
+                    "candidates",
+                    condition=Q(candidates__id=candidate_id)
+                ),
+                ballot_vit=FilteredRelation(
+                    "voteidentificationtoken",
+                    condition=Q(voteidentificationtoken__token=token)
+                )
+            ) \
+            .annotate(
+                candidate_id=F("ballot_candidate__id"),
+                candidate_name=F("ballot_candidate__name"),
+                vit_id=F("ballot_vit__id"),
+                vit_used=F("ballot_vit__used")
+            ) \
+            .first()
+        if poll is None:
+            return None, None, None
+        candidate = None
+        if poll.candidate_id is not None:
+            candidate = Candidate(id=poll.candidate_id, name=poll.candidate_name, poll=poll)
+        vit = None
+        if poll.vit_id is not None:
+            vit = VoteIdentificationToken(
+                id=poll.vit_id,
+                poll=poll,
+                token=token,
+                used=poll.vit_used
+            )
+        return poll, candidate, vit
+
     def are_params_valid(self, poll, candidate, vit):
         """ validates endpoint parameters """
         if poll is None:
@@ -101,7 +281,7 @@ class VoterCastVote(generics.CreateAPIView, VoterView):
                 data={ "detail": "Poll doesn't exist" },
                 status=status.HTTP_404_NOT_FOUND
             )
-        if candidate is None or candidate not in poll.candidates.all():
+        if candidate is None:
             return False, Response(
                 data={ "detail": "Candidate doesn't exist" },
                 status=status.HTTP_404_NOT_FOUND
@@ -122,33 +302,77 @@ class VoterCastVote(generics.CreateAPIView, VoterView):
                 data={ "detail": "Voting has already ended" },
                 status=status.HTTP_400_BAD_REQUEST
             )
+        if poll.provisioning_status != Poll.READY:
+            return False, Response(
+                data={ "detail": "Poll is not ready yet" },
+                status=status.HTTP_400_BAD_REQUEST
+            )
         return True, None
 
     def post(self, request, *args, **kwargs):
         """
         Casts a vote
         """
-        poll_id = self.kwargs.get("poll_id", None)
-        poll = self.get_queryset().filter(id=poll_id).first()
-        candidate_id = self.kwargs.get("candidate_id", None)
-        candidate = Candidate.objects.filter(id=candidate_id).first()
-        token = self.request.data.get("token")
-        vit = VoteIdentificationToken.objects.filter(token=token).first()
+        poll, candidate, vit = self.get_ballot(
+            self.kwargs.get("poll_id", None),
+            self.kwargs.get("candidate_id", None),
+            self.request.data.get("token")
+        )
         valid, response = self.are_params_valid(poll, candidate, vit)
         if not valid:
             return response
-        if not is_vit_valid(vit, poll):
+        # claimed before anything is sent, so a token cannot be used by two concurrent votes
+        if vit.used or not vit.claim(poll):
             return Response(
                 data={ "detail": "Token does not exist" },
                 status=status.HTTP_401_UNAUTHORIZED
             )
-        vvpat = save_vote(candidate, poll, vit)
+        if VOTE_ASYNC:
+            receipt = accept_vote(request.user, candidate, poll, vit)
+            return Response(
+                status=status.HTTP_202_ACCEPTED,
+                data=VoteReceiptSerializer(receipt).data
+            )
+        try:
+            vvpat = save_vote(candidate, poll, vit)
+        except Exception as ex:
+            if is_rejected(ex):
+                raise ex
+            receipt = hold_vote(request.user, poll, vit, ex)
+            return Response(
+                status=status.HTTP_202_ACCEPTED,
+                data=VoteReceiptSerializer(receipt).data
+            )
         send_vvpat(request.user, poll, vvpat)
         return Response(
             status=status.HTTP_201_CREATED,
             data={}
         )
 
+class VoterGetVoteStatus(generics.RetrieveAPIView, VoterView):
+    """ Reports the status of a vote accepted for asynchronous commit """
+    serializer_class = VoteReceiptSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        """
+        Returns pending, committed or failed
+        """
+        receipt = VoteReceipt.objects.filter(
+            receipt=self.kwargs.get("receipt", None),
+            poll_id=self.kwargs.get("poll_id", None),
+            user=request.user
+        ).first()
+        if receipt is None:
+            return Response(
+                data={ "detail": "Vote not found" },
+                status=status.HTTP_404_NOT_FOUND
+            )
+        return Response(
+            data=VoteReceiptSerializer(receipt).data,
+            status=status.HTTP_200_OK
+        )
+
 class VoterGetVote(generics.CreateAPIView, VoterView):
     """ Verifies a vote """
     permission_classes = [permissions.IsAuthenticated]
@@ -183,15 +407,17 @@ class VoterGetVote(generics.CreateAPIView, VoterView):
                 data={"detail": "Token does not exist"},
                 status=status.HTTP_401_UNAUTHORIZED
             )
-        votechain_client = VotechainNetworkClient()
-        response = votechain_client.verify_vote(poll_id, token)
-        if response is None:
-            return Response(
-                data={"detail": "Vote not found"},
-                status=status.HTTP_404_NOT_FOUND
-            )
-        parsed_response = json.loads(response)
-        candidate = parsed_response.get("candidate", None)
+        candidate = ledger_index.get_vote(poll, token)
+        if candidate is None:
+            votechain_client = get_network_client()
+            response = votechain_client.verify_vote(poll_id, token)
+            if response is None:
+                return Response(
+                    data={"detail": "Vote not found"},
+                    status=status.HTTP_404_NOT_FOUND
+                )
+            parsed_response = json.loads(response)
+            candidate = parsed_response.get("candidate", None)
         if candidate is None:
             return Response(
                 data={"detail": "Vote not found"},
@@ -220,14 +446,16 @@ class VoterGetResults(generics.RetrieveAPIView, VoterView):
                 data={"detail": "Voting hasn't ended yet"},
                 status=status.HTTP_401_UNAUTHORIZED
             )
-        votechain_client = VotechainNetworkClient()
-        response = votechain_client.get_results(poll_id)
-        if not response:
-            return Response(
-                data={"detail": "Results not found"},
-                status=status.HTTP_404_NOT_FOUND
-            )
-        result = json.loads(response)
+        result = ledger_index.get_results(poll)
+        if result is None:
+            votechain_client = get_network_client()
+            response = votechain_client.get_results(poll_id, poll.vote_shards)
+            if not response:
+                return Response(
+                    data={"detail": "Results not found"},
+                    status=status.HTTP_404_NOT_FOUND
+                )
+            result = json.loads(response)
         response_payload = []
         for key in result.keys():
             response_payload.append(CandidateResult(key, result[key])._asdict())
@@ -0,0 +1,50 @@
+""" Module issuing and verifying self-contained vote verification tokens """
+import base64
+import binascii
+import os
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from django.core.signing import Signer, BadSignature
+from votechain.settings import VVPAT_ENCRYPTION_KEY
+
+SIGNED = "s1:"
+ENCRYPTED = "e1:"
+SALT = "votechain.vvpat"
+NONCE_SIZE = 12
+
+_signer = Signer(salt=SALT)
+# tokens issued before versioned tokens were signed without a salt
+_legacy_signer = Signer()
+_cipher = AESGCM(base64.urlsafe_b64decode(VVPAT_ENCRYPTION_KEY)) if VVPAT_ENCRYPTION_KEY else None
+
+
+def issue(payload):
+    """
+    Returns a token carrying payload, encrypted and authenticated with AES-GCM
+    when VVPAT_ENCRYPTION_KEY is set and signed otherwise
+    """
+    if _cipher is None:
+        return SIGNED + _signer.sign(payload)
+    nonce = os.urandom(NONCE_SIZE)
+    sealed = _cipher.encrypt(nonce, payload.encode("utf-8"), SALT.encode("utf-8"))
+    return ENCRYPTED + base64.urlsafe_b64encode(nonce + sealed).decode("ascii").rstrip("=")
+
+
+def verify(token):
+    """ Returns the payload of a token, or "" when it was tampered with or is not a token """
+    try:
+        if token.startswith(ENCRYPTED):
+            if _cipher is None:
+                return ""
+            data = token[len(ENCRYPTED):]
+            sealed = base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+            return _cipher.decrypt(
+                sealed[:NONCE_SIZE],
+                sealed[NONCE_SIZE:],
+                SALT.encode("utf-8")
+            ).decode("utf-8")
+        if token.startswith(SIGNED):
+            return _signer.unsign(token[len(SIGNED):])
+        return _legacy_signer.unsign(token)
+    except (BadSignature, InvalidTag, ValueError, binascii.Error):
+        return ""
@@ -2,6 +2,135 @@
 const shim = require('fabric-shim');
 const util = require('util');
 
+// composite keys are not returned by range queries over candidates
+const RECEIPT_KEY = "receipt";
+const TALLY_KEY = "tally";
+const POLL_KEY = "poll";
+// createCompositeKey starts every composite key with this character
+const COMPOSITE_KEY_PREFIX = "\u0000";
+
+function tallyKey(stub, candidate, shard) {
+    return stub.createCompositeKey(TALLY_KEY, [candidate, shard]);
+}
+
+/**
+ * Records (receipt, candidate) pairs and increments counters found with counterKey.
+ * A receipt is counted only once, so a replayed batch is harmless.
+ * Returns the receipts of the recorded votes.
+ */
+async function recordVotes(stub, pairs, counterKey) {
+    var increments = {};
+    var receipts = [];
+    // reads do not see writes of the same transaction, so repeats within a batch are tracked here
+    var seen = new Set();
+    for (var i = 0; i < pairs.length; i += 2) {
+        var receipt = pairs[i];
+        var candidate = pairs[i + 1];
+        var receiptKey = stub.createCompositeKey(RECEIPT_KEY, [receipt]);
+        receipts.push(receipt);
+        if (seen.has(receipt)) {
+            continue;
+        }
+        seen.add(receipt);
+        var recorded = await stub.getState(receiptKey);
+        if (recorded && recorded.length > 0) {
+            continue;
+        }
+        await stub.putState(receiptKey, Buffer.from(candidate));
+        increments[candidate] = (increments[candidate] || 0) + 1;
+    }
+    for (const candidate of Object.keys(increments)) {
+        var exists = Buffer.from(await stub.getState(candidate)).toString("utf8");
+        if (exists === "") {
+            throw new Error(`Candidate "${candidate}" doesn't exist`);
+        }
+        var key = counterKey(candidate);
+        var state = key === candidate ? exists : Buffer.from(await stub.getState(key)).toString("utf8");
+        var value = (state === "" ? 0 : parseInt(state)) + increments[candidate];
+        await stub.putState(key, Buffer.from(value.toString()));
+    }
+    return receipts;
+}
+
+/**
+ * Stub confining a poll to its own keys, so a single chaincode can serve every poll.
+ * Candidates become composite keys (poll, pollId, candidate) and every other
+ * composite key gets pollId as its first attribute.
+ */
+class PollStub {
+    constructor(stub, pollId) {
+        this.stub = stub;
+        this.pollId = pollId;
+    }
+
+    key(key) {
+        if (key.startsWith(COMPOSITE_KEY_PREFIX)) {
+            // already namespaced by createCompositeKey
+            return key;
+        }
+        return this.stub.createCompositeKey(POLL_KEY, [this.pollId, key]);
+    }
+
+    getTxID() {
+        return this.stub.getTxID();
+    }
+
+    getState(key) {
+        return this.stub.getState(this.key(key));
+    }
+
+    putState(key, value) {
+        return this.stub.putState(this.key(key), value);
+    }
+
+    delState(key) {
+        return this.stub.delState(this.key(key));
+    }
+
+    getHistoryForKey(key) {
+        return this.stub.getHistoryForKey(this.key(key));
+    }
+
+    createCompositeKey(objectType, attributes) {
+        return this.stub.createCompositeKey(objectType, [this.pollId].concat(attributes));
+    }
+
+    splitCompositeKey(key) {
+        const split = this.stub.splitCompositeKey(key);
+        return { objectType: split.objectType, attributes: split.attributes.slice(1) };
+    }
+
+    getStateByPartialCompositeKey(objectType, attributes) {
+        return this.stub.getStateByPartialCompositeKey(objectType, [this.pollId].concat(attributes));
+    }
+
+    /**
+     * Iterates over the poll's candidates, keys are returned without the namespace.
+     * Only full scans are used by the chaincode, so the range is ignored.
+     */
+    async getStateByRange(startKey, endKey) {
+        const stub = this.stub;
+        const iterator = await stub.getStateByPartialCompositeKey(POLL_KEY, [this.pollId]);
+        return {
+            async next() {
+                const resource = await iterator.next();
+                if (!resource.value || !resource.value.getKey()) {
+                    return resource;
+                }
+                const value = resource.value;
+                const candidate = stub.splitCompositeKey(value.getKey()).attributes[1];
+                return {
+                    value: { getKey: () => candidate, getValue: () => value.getValue() },
+                    done: resource.done
+                };
+            },
+            close() {
+                return iterator.close();
+            }
+        };
+    }
+}
+
 let Votechain = class {
 
     async Init(stub) {
@@ -41,6 +170,21 @@ let Votechain = class {
         }
     }
 
+    /**
+     * Runs a method of a poll hosted by a shared chaincode.
+     * Expects poll id, method name and the method's arguments.
+     */
+    async Poll(stub, args) {
+        if (args.length < 2) {
+            return shim.error("Incorrect number of arguments. Expecting poll id and method");
+        }
+        var methodName = args[1];
+        if (["Init", "Invoke", "Poll"].includes(methodName) || typeof this[methodName] !== "function") {
+            return shim.error(`Method "${methodName}" doesn't exist`);
+        }
+        return await this[methodName](new PollStub(stub, args[0]), args.slice(2));
+    }
+
     async GetResults(stub, args) {
         if (args.length != 0) {
             return shim.error("Incorrect number of arguments. Expected none");
@@ -96,6 +240,88 @@ let Votechain = class {
         }
     }
 
+    async SendVotes(stub, args) {
+        if (args.length == 0 || args.length % 2 != 0) {
+            return shim.error("Incorrect number of arguments. Expecting receipt and candidate pairs");
+        }
+        try {
+            var receipts = await recordVotes(stub, args, candidate => candidate);
+            var payload = Buffer.from(JSON.stringify({ txId: stub.getTxID(), receipts: receipts }));
+            return shim.success(payload);
+        } catch (error) {
+            return shim.error(error.message);
+        }
+    }
+
+    async SendShardedVote(stub, args) {
+        if (args.length != 2) {
+            return shim.error("Incorrect number of arguments. Expecting candidate and shard");
+        }
+        var candidate = args[0];
+        var shard = args[1];
+        try {
+            var txId = stub.getTxID();
+            await recordVotes(stub, [txId, candidate], name => tallyKey(stub, name, shard));
+            var payload = Buffer.from(`{"txId": "${txId}"}`);
+            return shim.success(payload);
+        } catch (error) {
+            return shim.error(error.message);
+        }
+    }
+
+    async SendShardedVotes(stub, args) {
+        if (args.length < 3 || args.length % 2 != 1) {
+            return shim.error("Incorrect number of arguments. Expecting shard, receipt and candidate pairs");
+        }
+        var shard = args[0];
+        try {
+            var receipts = await recordVotes(stub, args.slice(1), name => tallyKey(stub, name, shard));
+            var payload = Buffer.from(JSON.stringify({ txId: stub.getTxID(), receipts: receipts }));
+            return shim.success(payload);
+        } catch (error) {
+            return shim.error(error.message);
+        }
+    }
+
+    async GetShardedResults(stub, args) {
+        if (args.length != 0) {
+            return shim.error("Incorrect number of arguments. Expected none");
+        }
+        try {
+            // partial sums: the candidate's own counter followed by its shard counters
+            var partials = {};
+            var iterator = await stub.getStateByRange("", "");
+            while (true) {
+                const resource = await iterator.next();
+                if (resource.value && resource.value.getKey()) {
+                    partials[resource.value.getKey()] = [parseInt(resource.value.getValue().toString("utf8"))];
+                }
+                if (resource.done) {
+                    await iterator.close();
+                    break;
+                }
+            }
+            var shardIterator = await stub.getStateByPartialCompositeKey(TALLY_KEY, []);
+            while (true) {
+                const resource = await shardIterator.next();
+                if (resource.value && resource.value.getKey()) {
+                    const candidate = stub.splitCompositeKey(resource.value.getKey()).attributes[0];
+                    if (candidate in partials) {
+                        partials[candidate].push(parseInt(resource.value.getValue().toString("utf8")));
+                    }
+                }
+                if (resource.done) {
+                    await shardIterator.close();
+                    break;
+                }
+            }
+            return shim.success(Buffer.from(JSON.stringify(partials)));
+        } catch (error) {
+            console.log(error.stack);
+            return shim.error(error.message);
+        }
+    }
+
     async AddCandidates(stub, args) {
         if (args.length == 0) {
             return shim.error("Incorrect number of arguments. Expecting 1 or more");
@@ -132,6 +358,10 @@ let Votechain = class {
         }
         var txId = args[0];
         try {
+            var receipt = await stub.getState(stub.createCompositeKey(RECEIPT_KEY, [txId]));
+            if (receipt && receipt.length > 0) {
+                return shim.success(Buffer.from(JSON.stringify({ candidate: Buffer.from(receipt).toString("utf8") })));
+            }
             var result = "";
             var keyIterator = await stub.getStateByRange("", "");
             while (true) {
@@ -0,0 +1,65 @@
+""" Module collecting votes into batched chaincode transactions """
+import asyncio
+import json
+import uuid
+
+
+class VoteBatcher():
+    """
+    Groups votes sharing a key (a poll and its vote layout) into one batched transaction.
+    A batch is flushed when it reaches max_size votes or when window seconds passed since
+    its first vote. Every vote gets its own receipt, which is returned as its txId.
+    Must be used from the Fabric client's event loop.
+    """
+    def __init__(self, send_batch, max_size, window):
+        self._send_batch = send_batch
+        self.max_size = max_size
+        self.window = window
+        self._pending = {}
+        self._timers = {}
+
+    async def submit(self, key, candidate, receipt=None):
+        """
+        Adds a vote to the current batch of a key and waits for the batch to be committed.
+        A random receipt is generated unless the caller provides one.
+        """
+        loop = asyncio.get_event_loop()
+        receipt = receipt or uuid.uuid4().hex
+        future = loop.create_future()
+        batch = self._pending.setdefault(key, [])
+        batch.append((receipt, candidate, future))
+        if len(batch) >= self.max_size:
+            self._flush(key)
+        elif key not in self._timers:
+            self._timers[key] = loop.call_later(self.window, self._flush, key)
+        return await future
+
+    def _flush(self, key):
+        """ Detaches the current batch of a key and sends it in the background """
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(key, [])
+        if batch:
+            asyncio.ensure_future(self._send(key, batch))
+
+    async def _send(self, key, batch):
+        """ Sends one batch and fans the outcome out to every waiting vote """
+        try:
+            response = await self._send_batch(
+                key,
+                [(receipt, candidate) for receipt, candidate, _ in batch]
+            )
+            committed = set(json.loads(response)["receipts"])
+        except Exception as ex:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(ex)
+            return
+        for receipt, _, future in batch:
+            if future.done():
+                continue
+            if receipt in committed:
+                future.set_result(json.dumps({"txId": receipt}))
+            else:
+                future.set_exception(RuntimeError("Vote is missing from the committed batch"))
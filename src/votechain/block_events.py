@@ -0,0 +1,101 @@
+""" Module decoding committed blocks into poll changes """
+from collections import namedtuple
+from datetime import datetime, timezone
+
+ENDORSER_TRANSACTION = 3
+POLL_METHOD = "Poll"
+
+VOTE = "vote"
+ADD_CANDIDATE = "add"
+DELETE_CANDIDATE = "delete"
+
+LedgerChange = namedtuple(
+    "LedgerChange",
+    ["chaincode_name", "namespace", "kind", "candidate", "receipt"]
+)
+
+DecodedBlock = namedtuple(
+    "DecodedBlock",
+    ["number", "time", "changes"]
+)
+
+
+def _parse_time(timestamp):
+    """ Parses a channel header timestamp decoded by hfc """
+    if not timestamp:
+        return None
+    return datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
+
+
+def changes_of_call(chaincode_name, tx_id, args):
+    """
+    Translates the arguments of a chaincode call into poll changes.
+    Calls of a poll hosted by the shared chaincode carry the poll's namespace.
+    """
+    if args and args[0] == "invoke":
+        args = args[1:]
+    namespace = None
+    if len(args) > 1 and args[0] == POLL_METHOD:
+        namespace, args = args[1], args[2:]
+    if not args:
+        return []
+    method, params = args[0], args[1:]
+    if method == "SendVote" and len(params) == 1:
+        return [LedgerChange(chaincode_name, namespace, VOTE, params[0], tx_id)]
+    if method == "SendShardedVote" and len(params) == 2:
+        return [LedgerChange(chaincode_name, namespace, VOTE, params[0], tx_id)]
+    if method == "SendShardedVotes":
+        params = params[1:]
+        method = "SendVotes"
+    if method == "SendVotes":
+        return [
+            LedgerChange(chaincode_name, namespace, VOTE, params[i + 1], params[i])
+            for i in range(0, len(params) - 1, 2)
+        ]
+    if method == "AddCandidates":
+        return [
+            LedgerChange(chaincode_name, namespace, ADD_CANDIDATE, name, tx_id) for name in params
+        ]
+    if method == "DeleteCandidates":
+        return [
+            LedgerChange(chaincode_name, namespace, DELETE_CANDIDATE, name, tx_id)
+            for name in params
+        ]
+    return []
+
+
+def decode_block(block):
+    """
+    Extracts poll changes from the valid transactions of a full block decoded by hfc.
+    Votes keep their receipt, a vote whose receipt was seen before is a replay
+    and must not be counted again, as in the chaincode.
+    Blocks of the in-memory ledger come decoded already.
+    """
+    if isinstance(block, DecodedBlock):
+        return block
+    # imported here, so the in-memory ledger works without hfc
+    # pylint: disable=import-outside-toplevel
+    from hfc.protos.common.common_pb2 import BlockMetadataIndex
+    from hfc.protos.peer.chaincode_pb2 import ChaincodeInvocationSpec
+    from hfc.protos.peer.transaction_pb2 import TxValidationCode
+    status_codes = block["metadata"]["metadata"][BlockMetadataIndex.Value("TRANSACTIONS_FILTER")]
+    block_time = None
+    changes = []
+    for index, envelope in enumerate(block["data"]["data"]):
+        channel_header = envelope["payload"]["header"]["channel_header"]
+        timestamp = _parse_time(channel_header.get("timestamp"))
+        if timestamp is not None and (block_time is None or timestamp > block_time):
+            block_time = timestamp
+        if channel_header["type"] != ENDORSER_TRANSACTION:
+            continue
+        if status_codes[index] != TxValidationCode.Value("VALID"):
+            continue
+        for action in envelope["payload"]["data"].get("actions", []):
+            invocation = ChaincodeInvocationSpec()
+            invocation.ParseFromString(
+                action["payload"]["chaincode_proposal_payload"]["input"]
+            )
+            spec = invocation.chaincode_spec  # pylint: disable=no-member
+            args = [arg.decode("utf-8") for arg in spec.input.args]
+            changes += changes_of_call(spec.chaincode_id.name, channel_header["tx_id"], args)
+    return DecodedBlock(block["header"]["number"], block_time, changes)
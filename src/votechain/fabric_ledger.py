@@ -0,0 +1,284 @@
+""" Module sending transactions to the Fabric network of the network profile """
+import asyncio
+import os
+from hfc.fabric.block_decoder import decode_proposal_response_payload
+from hfc.fabric.channel.channel_eventhub import ChannelEventHub
+from hfc.fabric.transaction.tx_context import create_tx_context
+from hfc.fabric.transaction.tx_proposal_request import CC_TYPE_NODE, CC_INVOKE, create_tx_prop_req
+from hfc.util import utils
+from votechain import tracing
+from votechain.hyperledger import CHANNEL
+from votechain.network_profile import CachedClient
+from votechain.peer_pool import PeerPool, is_not_installed
+from votechain.scheduler import InvalidTransactionError
+from votechain.settings import ENDORSING_ORGS, PEER_LATENCY_ALPHA, PEER_HEDGE_DELAY, \
+    PEER_ERROR_COOLDOWN, GATEWAY_MAX_IN_FLIGHT_PER_PEER, COMMIT_EVENT_TIMEOUT
+
+CHAINCODE_PATH = os.environ.get("CHAINCODE_PATH", "hyperledger/chaincode")
+NETWORK_PROFILE = os.environ.get("NETWORK_PROFILE", "hyperledger-network.json")
+
+
+class FabricLedger():
+    """
+    Ledger backend talking to the Fabric network of the network profile.
+    Must be created and used on the network client's event loop.
+    """
+    def __init__(self):
+        # the profile and identities are parsed once per process, see network_profile
+        self.cli = CachedClient(net_profile=NETWORK_PROFILE)
+        self.cli.new_channel(CHANNEL)
+        self.user_org1 = self.cli.get_user(org_name="org1.example.com", name="Admin")
+        self.user_org2 = self.cli.get_user(org_name="org2.example.com", name="Admin")
+        organizations = self.cli.get_net_info("organizations")
+        peers_by_org = {
+            org: info["peers"] for org, info in organizations.items() if info.get("peers")
+        }
+        self._org_admins = {
+            org: self.cli.get_user(org_name=org, name="Admin") for org in peers_by_org
+        }
+        self._msp_ids = [organizations[org]["mspid"] for org in peers_by_org]
+        self._peer_pool = PeerPool(
+            peers_by_org,
+            endorsing_orgs=ENDORSING_ORGS,
+            alpha=PEER_LATENCY_ALPHA,
+            hedge_delay=PEER_HEDGE_DELAY,
+            error_cooldown=PEER_ERROR_COOLDOWN,
+            max_in_flight=GATEWAY_MAX_IN_FLIGHT_PER_PEER
+        )
+        self.chaincode_version = "v0"
+        # hfc keeps the state of awaited instantiation events on the client instance,
+        # so instantiations cannot overlap on a shared client
+        self._deploy_lock = asyncio.Lock()
+
+    async def _endorse(self, tx_context, peers):
+        """
+        Sends a proposal to the endorsing peers, measuring each of them.
+        Returns the endorsements, the proposal and its header.
+        """
+        channel = self.cli.get_channel(CHANNEL)
+        async with self._peer_pool.reserve(peers):
+            responses, proposal, header = channel.send_tx_proposal(
+                tx_context,
+                [self.cli.get_peer(peer) for peer in peers]
+            )
+            endorsements = await asyncio.gather(*[
+                self._peer_pool.measure(peer, lambda _, response=response: response)
+                for peer, response in zip(peers, responses)
+            ], return_exceptions=True)
+        for endorsement in endorsements:
+            if isinstance(endorsement, BaseException):
+                raise endorsement
+        return endorsements, proposal, header
+
+    def _watch_commit(self, tx_id, peer):
+        """
+        Listens to a peer's filtered blocks for a transaction, from the newest block on.
+        Returns the hub, a future set once the stream delivered that first block,
+        after which no later block can be missed, and a future of the transaction's validation code.
+        """
+        loop = asyncio.get_event_loop()
+        connected = loop.create_future()
+        committed = loop.create_future()
+
+        def on_block(_):
+            if not connected.done():
+                connected.set_result(None)
+
+        def on_event(_tx_id, tx_status, _block_number):
+            if not committed.done():
+                committed.set_result(tx_status)
+
+        def on_stream_end(_connection):
+            # the error goes to the future awaited next
+            future = committed if connected.done() else connected
+            if not future.done():
+                future.set_exception(
+                    ConnectionError("Commit event stream of {0} ended".format(peer))
+                )
+
+        # not created through the channel, which would keep every hub
+        hub = ChannelEventHub(self.cli.get_peer(peer), CHANNEL, self.user_org1)
+        hub.registerBlockEvent(unregister=True, onEvent=on_block)
+        hub.registerTxEvent(tx_id, unregister=True, disconnect=True, onEvent=on_event)
+        asyncio.ensure_future(hub.connect()).add_done_callback(on_stream_end)
+        return hub, connected, committed
+
+    @staticmethod
+    async def _await_event(future):
+        """
+        Awaits a future of a commit event stream for COMMIT_EVENT_TIMEOUT seconds,
+        like hfc's waitForEvent.
+        A timeout leaves the future pending, so the stream is still disconnected.
+        """
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), COMMIT_EVENT_TIMEOUT)
+        except asyncio.TimeoutError as ex:
+            raise TimeoutError("waitForEvent timed out.") from ex
+
+    async def send_transaction(self, chaincode_name, args):
+        """
+        Sends a transaction and waits until it is committed, returning the chaincode response.
+        Runs the phases of hfc's chaincode_invoke itself, so each of them is timed,
+        and awaits the commit event on a hub of its own, so transactions do not take turns.
+        Like chaincode_invoke, a rejected proposal returns its message
+        and an invalid transaction raises.
+        """
+        method_name = tracing.method_of(args)
+        tracing.payload("request", method_name, args)
+        tx_context = create_tx_context(
+            self.user_org1,
+            self.user_org1.cryptoSuite,
+            create_tx_prop_req(
+                prop_type=CC_INVOKE,
+                cc_name=chaincode_name,
+                cc_type=CC_TYPE_NODE,
+                fcn="invoke",
+                args=args
+            )
+        )
+        peers = self._peer_pool.endorsers(chaincode_name)
+        # listening while the proposal is endorsed,
+        # the stream is up before the transaction is broadcast
+        hub, connected, committed = self._watch_commit(tx_context.tx_id, peers[0])
+        try:
+            with tracing.phase("endorse", method_name):
+                endorsements, proposal, header = await self._endorse(tx_context, peers)
+                # chaincodes of older polls are only installed on some peers,
+                # the proposal is sent again to peers not known to miss it
+                while True:
+                    missing = [
+                        peer for peer, endorsement in zip(peers, endorsements)
+                        if endorsement.response.status != 200
+                        and is_not_installed(endorsement.response.message)
+                    ]
+                    for peer in missing:
+                        self._peer_pool.mark_missing(chaincode_name, peer)
+                    retry_peers = self._peer_pool.endorsers(chaincode_name)
+                    if not missing or set(retry_peers) & set(missing):
+                        break
+                    peers = retry_peers
+                    endorsements, proposal, header = await self._endorse(tx_context, peers)
+            rejected = {
+                endorsement.response.message for endorsement in endorsements
+                if endorsement.response.status != 200
+            }
+            if rejected:
+                return "; ".join(rejected)
+            # a block cut before the stream started would never reach it
+            with tracing.phase("connect", method_name):
+                await self._await_event(connected)
+            with tracing.phase("broadcast", method_name):
+                tran_req = utils.build_tx_req((endorsements, proposal, header))
+                tx_context_tx = create_tx_context(
+                    self.user_org1,
+                    self.user_org1.cryptoSuite,
+                    tran_req
+                )
+                replies = utils.send_transaction(self.cli.orderers, tran_req, tx_context_tx)
+                async for reply in replies:
+                    if reply.status != 200:
+                        return reply.message
+            with tracing.phase("commit", method_name):
+                status = await self._await_event(committed)
+        finally:
+            connected.cancel()
+            if not committed.done():
+                committed.cancel()
+                hub.disconnect()
+        if status != "VALID":
+            # same format as chaincode_invoke, so read conflicts are recognized
+            raise InvalidTransactionError([status])
+        response = decode_proposal_response_payload(endorsements[0].payload)
+        payload = response["extension"]["response"]["payload"].decode("utf-8")
+        tracing.payload("response", method_name, payload)
+        return payload
+
+    async def evaluate(self, chaincode_name, method_name, args):
+        """
+        Asks the fastest healthy peer to evaluate a chaincode function,
+        nothing is sent to the orderer.
+        A slow peer is raced against the next fastest one.
+        """
+        traced_method = tracing.method_of(args, method_name)
+        tracing.payload("request", traced_method, args)
+        with tracing.phase("endorse", traced_method):
+            response = await self._peer_pool.hedged(lambda peer: self.cli.chaincode_query(
+                requestor=self.user_org1,
+                channel_name=CHANNEL,
+                peers=[peer],
+                args=args,
+                cc_name=chaincode_name,
+                cc_type=CC_TYPE_NODE,
+                fcn=method_name
+            ), chaincode_name)
+        tracing.payload("response", traced_method, response)
+        return response
+
+    def _endorsement_policy(self):
+        """ Requires endorsements by members of ENDORSING_ORGS distinct organizations """
+        return {
+            "identities": [
+                {"role": {"name": "member", "mspId": msp_id}} for msp_id in self._msp_ids
+            ],
+            "policy": {
+                "%d-of" % self._peer_pool.endorsing_orgs: [
+                    {"signed-by": index} for index in range(len(self._msp_ids))
+                ]
+            }
+        }
+
+    async def deploy_chaincode(self, chaincode_name):
+        """
+        Installs a chaincode on every peer, each organization with its own admin,
+        so any of them can endorse, and instantiates it
+        """
+        await asyncio.gather(*[
+            self.cli.chaincode_install(
+                requestor=admin,
+                peers=self._peer_pool.peers_of(org),
+                cc_path=CHAINCODE_PATH,
+                cc_name=chaincode_name,
+                cc_type=CC_TYPE_NODE,
+                cc_version=self.chaincode_version
+            )
+            for org, admin in self._org_admins.items()
+        ])
+        async with self._deploy_lock:
+            return await self.cli.chaincode_instantiate(
+                requestor=self.user_org1,
+                channel_name=CHANNEL,
+                peers=self._peer_pool.endorsers(chaincode_name),
+                args=[],
+                cc_name=chaincode_name,
+                cc_version=self.chaincode_version,
+                cc_type=CC_TYPE_NODE,
+                cc_endorsement_policy=self._endorsement_policy(),
+                wait_for_event=True # optional, for being sure chaincode is instantiated
+            )
+
+    async def listen_blocks(self, start, on_block):
+        """ Streams full blocks from a peer's deliver service to on_block """
+        channel = self.cli.get_channel(CHANNEL)
+        event_hub = channel.newChannelEventHub(
+            self.cli.get_peer(self._peer_pool.fastest()[0]),
+            self.user_org1
+        )
+        event_hub.registerBlockEvent(unregister=False, onEvent=on_block)
+        await event_hub.connect(filtered=False, start=start)
+
+    async def get_channel_height(self):
+        """ Returns the number of blocks in the channel """
+        info = await self.cli.query_info(
+            requestor=self.user_org1,
+            channel_name=CHANNEL,
+            peers=self._peer_pool.fastest()
+        )
+        return info.height
+
+    def is_stale(self):
+        """ Checks whether the network profile or an identity changed since the client was built """
+        return self.cli.profile.is_stale()
+
+    async def close(self):
+        """ Closes grpc channels """
+        await self.cli.close_grpc_channels()
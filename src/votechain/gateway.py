@@ -0,0 +1,163 @@
+""" Module admitting ledger calls under per-poll limits, a bounded queue and a circuit breaker """
+import asyncio
+import concurrent.futures
+import threading
+import time
+from votechain import metrics
+from votechain.peer_pool import is_peer_failure
+
+rejected = metrics.counter(
+    "gateway_rejected",
+    "Ledger calls refused because the gateway was saturated"
+)
+queue_depth = metrics.gauge("gateway_queue_depth", "Ledger calls waiting for a free slot")
+breaker_trips = metrics.counter("gateway_breaker_trips", "Times the circuit breaker opened")
+
+_request = threading.local()
+
+
+def set_deadline(timeout):
+    """ Sets the deadline of ledger calls made by the current thread, None clears it """
+    _request.deadline = None if timeout is None else time.monotonic() + timeout
+
+
+def get_deadline():
+    """ Returns the deadline of the current thread as a time.monotonic() value, or None """
+    return getattr(_request, "deadline", None)
+
+
+class GatewayBusyError(Exception):
+    """ Raised when a ledger call is refused, retry_after tells when to try again, in seconds """
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class DeadlineExceededError(concurrent.futures.TimeoutError):
+    """ Raised instead of calling the ledger once the deadline of the request passed """
+
+
+class CircuitBreaker():
+    """
+    Stops sending calls to a ledger that keeps failing.
+    Opens after threshold consecutive failures, then lets a single probe through
+    once cooldown seconds passed; a successful probe closes it again.
+    Only failures of the network count, errors answered by the chaincode do not.
+    """
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def check(self, probe=False):
+        """
+        Raises GatewayBusyError while the breaker is open.
+        With probe, a call allowed through a breaker waiting for a probe becomes that probe.
+        """
+        if self.opened_at is None:
+            return
+        remaining = self.opened_at + self.cooldown - time.monotonic()
+        if remaining > 0 or self._probing:
+            raise GatewayBusyError("Ledger is unavailable", max(remaining, 0) or self.cooldown)
+        self._probing = probe
+
+    def record(self, error=None):
+        """ Records the outcome of an admitted call """
+        if error is not None and not (is_peer_failure(error) or isinstance(error, TimeoutError)):
+            error = None
+        was_probing, self._probing = self._probing, False
+        if error is None:
+            self.failures = 0
+            self.opened_at = None
+            return
+        self.failures += 1
+        if was_probing or (self.threshold and self.failures >= self.threshold):
+            if self.opened_at is None or was_probing:
+                breaker_trips.inc()
+            self.opened_at = time.monotonic()
+
+
+class Gateway():
+    """
+    Runs ledger calls of a poll with at most max_in_flight of them at a time.
+    Callers with a deadline queue for a slot until it passes, at most max_queue of them,
+    and are refused right away when the queue is full;
+    callers without one, i.e. background jobs bounded by their worker pool, always queue.
+    Must be used from the network client's event loop.
+    """
+    def __init__(self, max_in_flight, max_queue, retry_after, breaker):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self.breaker = breaker
+        self.waiting = 0
+        self._slots = {}
+
+    def _slot(self, poll_id):
+        """ Returns the semaphore of a poll and takes a reference to it """
+        entry = self._slots.get(poll_id)
+        if entry is None:
+            entry = self._slots[poll_id] = [asyncio.Semaphore(self.max_in_flight), 0]
+        entry[1] += 1
+        return entry[0]
+
+    def _release(self, poll_id):
+        """ Drops a reference to the semaphore of a poll and forgets it once unused """
+        entry = self._slots[poll_id]
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self._slots[poll_id]
+
+    async def _acquire(self, slot, deadline):
+        """ Waits for a slot, until the deadline if any """
+        if not slot.locked():
+            await slot.acquire()
+            return
+        if deadline is not None and self.waiting >= self.max_queue:
+            rejected.inc()
+            raise GatewayBusyError("Too many requests waiting for the ledger", self.retry_after)
+        self.waiting += 1
+        queue_depth.inc()
+        try:
+            if deadline is None:
+                await slot.acquire()
+            else:
+                await asyncio.wait_for(slot.acquire(), max(deadline - time.monotonic(), 0))
+        except asyncio.TimeoutError as ex:
+            rejected.inc()
+            raise GatewayBusyError(
+                "Deadline passed waiting for the ledger",
+                self.retry_after
+            ) from ex
+        finally:
+            self.waiting -= 1
+            queue_depth.dec()
+
+    async def call(self, poll_id, request, deadline=None):
+        """ Calls request (a coroutine function) once the breaker and the poll's limit allow it """
+        self.breaker.check()
+        if not self.max_in_flight:
+            return await self._run(request)
+        slot = self._slot(poll_id)
+        try:
+            await self._acquire(slot, deadline)
+            try:
+                return await self._run(request)
+            finally:
+                slot.release()
+        finally:
+            self._release(poll_id)
+
+    async def _run(self, request):
+        """ Calls request, reporting its outcome to the breaker """
+        # the breaker may have opened while the call was queued
+        self.breaker.check(probe=True)
+        try:
+            result = await request()
+        except Exception as ex:
+            self.breaker.record(ex)
+            raise
+        self.breaker.record()
+        return result
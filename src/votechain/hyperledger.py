@@ -1,91 +1,353 @@
 import asyncio
+import concurrent.futures
+import json
+import logging
 import os
-from hfc.fabric import Client
-from hfc.fabric.transaction.tx_proposal_request import CC_TYPE_NODE
-from votechain.settings import INTEGRATE_BLOCKCHAIN
+import random
+import threading
+import time
+from votechain import tracing
+from votechain.batching import VoteBatcher
+from votechain.gateway import Gateway, CircuitBreaker, GatewayBusyError, DeadlineExceededError, \
+    get_deadline
+from votechain.memory_ledger import Latency, MemoryLedger
+from votechain.scheduler import VoteScheduler, VoteConflictError, InvalidTransactionError
+from votechain.settings import LEDGER_TIMEOUT, NETWORK_PROFILE_CHECK_INTERVAL, VOTE_BATCH_SIZE, \
+    VOTE_BATCH_WINDOW, VOTE_MAX_RETRIES, VOTE_RETRY_BACKOFF, VOTE_RETRY_MAX_BACKOFF, \
+    RESULTS_CACHE_TTL, LEDGER_BACKEND, MEMORY_LEDGER_ENDORSE_LATENCY, MEMORY_LEDGER_ORDER_LATENCY, \
+    MEMORY_LEDGER_COMMIT_LATENCY, MEMORY_LEDGER_BATCH_SIZE, MEMORY_LEDGER_BATCH_TIMEOUT, \
+    MEMORY_LEDGER_RETAINED_BLOCKS, GATEWAY_MAX_IN_FLIGHT_PER_POLL, GATEWAY_QUEUE_SIZE, \
+    GATEWAY_RETRY_AFTER, BREAKER_FAILURE_THRESHOLD, BREAKER_COOLDOWN
+
+logger = logging.getLogger(__name__)
 
 CHANNEL = "businesschannel"
-CHAINCODE_PATH = os.environ.get("CHAINCODE_PATH", "hyperledger/chaincode")
 GET_RESULTS = "GetResults"
 GET_RESULT = "GetResult"
+GET_SHARDED_RESULTS = "GetShardedResults"
 SEND_VOTE = "SendVote"
+SEND_VOTES = "SendVotes"
+SEND_SHARDED_VOTE = "SendShardedVote"
+SEND_SHARDED_VOTES = "SendShardedVotes"
 ADD_CANDIDATES = "AddCandidates"
 DELETE_CANDIDATES = "DeleteCandidates"
 VERIFY_VOTE = "VerifyVote"
 CHAINCODE_PREFIX = os.environ.get("CHAINCODE_PREFIX", "Votechain-")
+SHARED_CHAINCODE_NAME = os.environ.get("SHARED_CHAINCODE_NAME", CHAINCODE_PREFIX + "shared")
+POLL_METHOD = "Poll"
+
+
+class LedgerTimeoutError(concurrent.futures.TimeoutError):
+    """
+    Raised when a ledger call did not finish in time,
+    future is the call, which may still succeed
+    """
+    def __init__(self, message, future):
+        super().__init__(message)
+        self.future = future
+
+
+class VoteRejectedError(Exception):
+    """
+    Raised when a peer or the orderer refused a vote transaction,
+    its message is their answer
+    """
+
+
+def is_rejected(error):
+    """
+    Checks whether a vote failed for good: it was refused before being sent,
+    refused by a peer or the orderer, or committed as invalid.
+    Any other error, e.g. a timeout, leaves the outcome unknown, the transaction may still commit.
+    """
+    return isinstance(error, (
+        GatewayBusyError,
+        DeadlineExceededError,
+        VoteRejectedError,
+        VoteConflictError,
+        InvalidTransactionError
+    ))
+
+
+def _accepted(response):
+    """
+    Returns a vote transaction's response,
+    raises VoteRejectedError unless it is the chaincode's JSON
+    """
+    try:
+        json.loads(response)
+    except ValueError:
+        raise VoteRejectedError(response) from None
+    return response
 
 
 class VotechainNetworkClient():
+    """
+    Long-lived ledger client owning its own event loop.
+    The loop runs on a background thread, request threads hand coroutines over
+    to it through submit/run, so network setup happens once per process.
+    Transactions go through the ledger backend chosen by LEDGER_BACKEND.
+    """
     def __init__(self):
-        if INTEGRATE_BLOCKCHAIN:
-            self.loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(self.loop)
-            self.cli = Client(net_profile="hyperledger-network.json")
-            self.cli.new_channel(CHANNEL)
-            self.user_org1 = self.cli.get_user(org_name="org1.example.com", name="Admin")
-            self.user_org2 = self.cli.get_user(org_name="org2.example.com", name="Admin")
-            self.chaincode_peers = ['peer0.org1.example.com', 'peer1.org1.example.com']
-            self.chaincode_version = "v0"
+        self._results_cache = {}
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._run_loop,
+            name="votechain-ledger-loop",
+            daemon=True
+        )
+        self._thread.start()
+        try:
+            self.run(self._connect())
+        except Exception:
+            # e.g. a malformed network profile, the loop thread would be left running
+            self._stop()
+            raise
+
+    def _run_loop(self):
+        """ Body of the background thread, serves the event loop until closed """
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    async def _connect(self):
+        """
+        Connects the ledger backend chosen by LEDGER_BACKEND.
+        Runs on the loop thread, because grpc channels bind to the loop they are created on.
+        """
+        if LEDGER_BACKEND == "memory":
+            self.ledger = MemoryLedger(
+                Latency(MEMORY_LEDGER_ENDORSE_LATENCY),
+                Latency(MEMORY_LEDGER_ORDER_LATENCY),
+                Latency(MEMORY_LEDGER_COMMIT_LATENCY),
+                MEMORY_LEDGER_BATCH_SIZE,
+                MEMORY_LEDGER_BATCH_TIMEOUT,
+                MEMORY_LEDGER_RETAINED_BLOCKS
+            )
+        else:
+            # imported here, so hfc is only needed with the Fabric backend
+            # pylint: disable=import-outside-toplevel
+            from votechain.fabric_ledger import FabricLedger
+            self.ledger = FabricLedger()
+        self._scheduler = VoteScheduler(
+            VOTE_MAX_RETRIES,
+            VOTE_RETRY_BACKOFF,
+            VOTE_RETRY_MAX_BACKOFF
+        )
+        self._gateway = Gateway(
+            GATEWAY_MAX_IN_FLIGHT_PER_POLL,
+            GATEWAY_QUEUE_SIZE,
+            GATEWAY_RETRY_AFTER,
+            CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_COOLDOWN)
+        )
+        self._batcher = None
+        if VOTE_BATCH_SIZE > 1:
+            self._batcher = VoteBatcher(self._send_vote_batch, VOTE_BATCH_SIZE, VOTE_BATCH_WINDOW)
+
+    def submit(self, coroutine):
+        """ Schedules a coroutine on the client's loop, returns a concurrent.futures.Future """
+        if self._thread is None:
+            raise RuntimeError("The network client is closed")
+        return asyncio.run_coroutine_threadsafe(self._timed(coroutine, time.monotonic()), self.loop)
+
+    @staticmethod
+    async def _timed(coroutine, submitted):
+        """ Records how long a submitted coroutine waited for the loop """
+        tracing.loop_delay.observe(time.monotonic() - submitted)
+        return await coroutine
+
+    def run(self, coroutine, timeout=LEDGER_TIMEOUT):
+        """
+        Runs a coroutine on the client's loop and waits for its result.
+        A coroutine still running after timeout seconds is not cancelled,
+        LedgerTimeoutError holds its future.
+        """
+        if threading.current_thread() is self._thread:
+            raise RuntimeError("Cannot block the ledger loop thread on its own coroutine")
+        future = self.submit(coroutine)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError as ex:
+            raise LedgerTimeoutError(
+                "Ledger call timed out after {0}s".format(timeout),
+                future
+            ) from ex
+
+    def _call(self, poll_id, request):
+        """
+        Runs request (a coroutine function) for a poll through the gateway and waits for its result.
+        Waits no longer than the deadline of the HTTP request being served, if any,
+        and submits nothing once it passed.
+        """
+        deadline = get_deadline()
+        timeout = LEDGER_TIMEOUT
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise DeadlineExceededError("Deadline passed before calling the ledger")
+            timeout = min(timeout, remaining)
+        return self.run(self._gateway.call(poll_id, request, deadline), timeout)
+
+    def is_stale(self):
+        """ Checks whether the configuration the ledger backend was built from changed """
+        return self.ledger.is_stale()
+
+    def close(self):
+        """ Closes grpc channels and stops the background loop """
+        if self._thread is None:
+            return
+        try:
+            self.run(self.ledger.close())
+        finally:
+            self._stop()
+
+    def _stop(self):
+        """ Stops the background loop """
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self._thread = None
 
     def _get_chaincode_name(self, poll_id):
-        """ Returns chaincode name based on poll id and predefined prefix """
+        """
+        Returns name of the chaincode bound to a poll,
+        polls without a bound chaincode use one named after poll id and predefined prefix
+        """
+        if _chaincode_resolver is not None:
+            chaincode_name = _chaincode_resolver.get_chaincode_name(poll_id)
+            if chaincode_name is not None:
+                return chaincode_name
         return CHAINCODE_PREFIX + str(poll_id)
 
+    def _get_route(self, poll_id):
+        """
+        Returns chaincode name of a poll and the arguments preceding its method calls,
+        polls of the shared chaincode call their methods through Poll with their id
+        """
+        chaincode_name = self._get_chaincode_name(poll_id)
+        if chaincode_name == SHARED_CHAINCODE_NAME:
+            return chaincode_name, (POLL_METHOD, str(poll_id))
+        return chaincode_name, ()
+
+    def get_poll_id(self, chaincode_name, namespace=None):
+        """
+        Returns id of the poll served by a chaincode, None for foreign chaincodes.
+        Polls of the shared chaincode are identified by the namespace their calls run in.
+        """
+        if chaincode_name == SHARED_CHAINCODE_NAME:
+            return int(namespace) if namespace is not None and namespace.isdigit() else None
+        if _chaincode_resolver is not None:
+            poll_id = _chaincode_resolver.get_poll_id(chaincode_name)
+            if poll_id is not None:
+                return poll_id
+        if not chaincode_name.startswith(CHAINCODE_PREFIX):
+            return None
+        poll_id = chaincode_name[len(CHAINCODE_PREFIX):]
+        return int(poll_id) if poll_id.isdigit() else None
+
+    def _query_chaincode(self, poll_id, method_name, params):
+        """
+        Evaluates a read-only chaincode function and returns result string (JSON format).
+        The proposal is only endorsed, so no transaction is ordered or written to the ledger.
+        """
+        try:
+            chaincode_name, namespace = self._get_route(poll_id)
+            args = [str(param) for param in params]
+            if namespace:
+                args = [namespace[1], method_name] + args
+                method_name = namespace[0]
+            return self._call(
+                poll_id,
+                lambda: self.ledger.evaluate(chaincode_name, method_name, args)
+            )
+        except Exception as ex:
+            print(ex)
+            raise ex
+
     def _invoke_chaincode(self, poll_id, method_name, params):
         """ Invokes a chaincode function and returns result string (JSON format) """
-        if INTEGRATE_BLOCKCHAIN:
-            try:
-                chaincode_name = self._get_chaincode_name(poll_id)
-                args = [method_name]
-                for param in params:
-                    args.append(str(param))
-                return self.loop.run_until_complete(
-                    self.cli.chaincode_invoke(
-                        requestor=self.user_org1,
-                        channel_name=CHANNEL,
-                        peers=self.chaincode_peers,
-                        args=args,
-                        cc_name=chaincode_name,
-                        cc_type=CC_TYPE_NODE,
-                        wait_for_event=True
-                    )
-                )
-            except Exception as ex:
-                print(ex)
-                raise ex
-        return ""
+        try:
+            chaincode_name, namespace = self._get_route(poll_id)
+            args = list(namespace) + [method_name]
+            for param in params:
+                args.append(str(param))
+            return self._call(poll_id, lambda: self.ledger.send_transaction(chaincode_name, args))
+        except Exception as ex:
+            print(ex)
+            raise ex
+
+    async def _send_vote(self, route, candidate, shards):
+        """
+        Sends a single vote through the conflict-aware scheduler.
+        Sharded polls increment one of their candidate's shards, chosen at random.
+        """
+        chaincode_name, namespace = route
+        candidate = str(candidate)
+        if shards:
+            shard = str(random.randrange(shards))
+            keys = [(route, candidate, shard)]
+            method_name = SEND_SHARDED_VOTE
+            args = list(namespace) + [method_name, candidate, shard]
+        else:
+            keys = [(route, candidate)]
+            method_name = SEND_VOTE
+            args = list(namespace) + [method_name, candidate]
+        return _accepted(await self._scheduler.run(
+            keys,
+            lambda: self.ledger.send_transaction(chaincode_name, args),
+            method_name
+        ))
+
+    async def _send_vote_batch(self, key, votes):
+        """ Sends (receipt, candidate) pairs of a poll as a single batched transaction """
+        route, shards = key
+        chaincode_name, namespace = route
+        if shards:
+            shard = str(random.randrange(shards))
+            method_name = SEND_SHARDED_VOTES
+            args = list(namespace) + [method_name, shard]
+            keys = [(route, str(candidate), shard) for _, candidate in votes]
+        else:
+            method_name = SEND_VOTES
+            args = list(namespace) + [method_name]
+            keys = [(route, str(candidate)) for _, candidate in votes]
+        for receipt, candidate in votes:
+            args += [receipt, str(candidate)]
+        return _accepted(await self._scheduler.run(
+            keys,
+            lambda: self.ledger.send_transaction(chaincode_name, args),
+            method_name
+        ))
+
+    async def _send_receipted_vote(self, route, candidate, shards, receipt):
+        """ Sends a single vote recorded under a given receipt, resending it is harmless """
+        response = await self._send_vote_batch((route, shards), [(receipt, candidate)])
+        if receipt not in json.loads(response)["receipts"]:
+            raise RuntimeError("Vote is missing from the committed transaction")
+        return json.dumps({"txId": receipt})
+
+    def listen_blocks(self, start, on_block):
+        """
+        Calls on_block(block) for every block committed from block number start on,
+        a block decoded by hfc or, from the in-memory ledger, an already decoded block.
+        on_block runs on the loop thread and must not block.
+        Returns a future that ends when the stream breaks.
+        """
+        return self.submit(self.ledger.listen_blocks(start, on_block))
+
+    def get_channel_height(self):
+        """ Returns the number of blocks in the channel """
+        return self.run(self.ledger.get_channel_height())
+
+    def deploy_chaincode(self, chaincode_name):
+        """ Installs and instantiates a chaincode under a given name """
+        try:
+            return self.run(self.ledger.deploy_chaincode(chaincode_name))
+        except Exception as ex:
+            print(ex)
+            raise ex
 
     def add_poll(self, poll_id):
         """ Creates a poll as a new chaincode instance """
-        if INTEGRATE_BLOCKCHAIN:
-            try:
-                chaincode_name = self._get_chaincode_name(poll_id)
-                self.loop.run_until_complete(
-                    self.cli.chaincode_install(
-                        requestor=self.user_org1,
-                        peers=self.chaincode_peers,
-                        cc_path=CHAINCODE_PATH,
-                        cc_name=chaincode_name,
-                        cc_type=CC_TYPE_NODE,
-                        cc_version=self.chaincode_version
-                    )
-                )
-                return self.loop.run_until_complete(
-                    self.cli.chaincode_instantiate(
-                    requestor=self.user_org1,
-                    channel_name=CHANNEL,
-                    peers=self.chaincode_peers,
-                    args=[],
-                    cc_name=chaincode_name,
-                    cc_version=self.chaincode_version,
-                    cc_type=CC_TYPE_NODE,
-                    wait_for_event=True # optional, for being sure chaincode is instantiated
-                    )
-                )
-            except Exception as ex:
-                print(ex)
-                raise ex
-        return ""
+        return self.deploy_chaincode(self._get_chaincode_name(poll_id))
 
     def add_candidates(self, poll_id, candidates):
         """ Adds candidates to a poll """
@@ -95,18 +357,135 @@ class VotechainNetworkClient():
         """ Deletes candidates from a poll """
         return self._invoke_chaincode(poll_id, DELETE_CANDIDATES, candidates)
 
-    def get_results(self, poll_id):
+    def get_results(self, poll_id, shards=0):
         """ Returns poll results for all candidates """
-        return self._invoke_chaincode(poll_id, GET_RESULTS, [])
+        if shards:
+            return self._get_sharded_results(poll_id)
+        return self._query_chaincode(poll_id, GET_RESULTS, [])
+
+    def _get_sharded_results(self, poll_id):
+        """
+        Merges per-shard partial sums of a sharded poll into GetResults format.
+        Merged results are cached for RESULTS_CACHE_TTL seconds.
+        """
+        cached = self._results_cache.get(poll_id)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+        response = self._query_chaincode(poll_id, GET_SHARDED_RESULTS, [])
+        if not response:
+            return response
+        partials = json.loads(response)
+        results = json.dumps({
+            candidate: str(sum(partials[candidate])) for candidate in partials
+        })
+        self._results_cache[poll_id] = (time.monotonic() + RESULTS_CACHE_TTL, results)
+        return results
 
     def get_results_for_candidate(self, poll_id, candidate):
         """ Returns poll results for one candidate """
-        return self._invoke_chaincode(poll_id, GET_RESULT, [candidate])
+        return self._query_chaincode(poll_id, GET_RESULT, [candidate])
 
-    def cast_vote(self, poll_id, candidate):
-        """ Casts a vote on given candidate """
-        return self._invoke_chaincode(poll_id, SEND_VOTE, [candidate])
+    def cast_vote(self, poll_id, candidate, shards=0, receipt=None):
+        """
+        Casts a vote on given candidate.
+        A vote cast with a receipt is counted once, no matter how many times it is sent.
+        """
+        try:
+            # resolved here, the loop thread must not touch the database
+            route = self._get_route(poll_id)
+            if self._batcher is not None:
+                return self._call(
+                    poll_id,
+                    lambda: self._batcher.submit((route, shards), candidate, receipt)
+                )
+            if receipt is not None:
+                return self._call(
+                    poll_id,
+                    lambda: self._send_receipted_vote(route, candidate, shards, receipt)
+                )
+            return self._call(poll_id, lambda: self._send_vote(route, candidate, shards))
+        except Exception as ex:
+            print(ex)
+            raise ex
 
     def verify_vote(self, poll_id, token):
         """ Returns candidate who was casted in a given transaction """
-        return self._invoke_chaincode(poll_id, VERIFY_VOTE, [token])
+        return self._query_chaincode(poll_id, VERIFY_VOTE, [token])
+
+
+_chaincode_resolver = None  # pylint: disable=invalid-name
+
+
+def set_chaincode_resolver(resolver):
+    """
+    Registers an object mapping polls to the chaincodes bound to them,
+    through get_chaincode_name(poll_id) and get_poll_id(chaincode_name),
+    both returning None when unknown
+    """
+    global _chaincode_resolver  # pylint: disable=global-statement
+    _chaincode_resolver = resolver
+
+
+_network_client = None  # pylint: disable=invalid-name
+_network_client_pid = None  # pylint: disable=invalid-name
+_network_client_lock = threading.Lock()
+_next_profile_check = 0.0  # pylint: disable=invalid-name
+
+
+def _profile_check_due():
+    """ Checks whether NETWORK_PROFILE_CHECK_INTERVAL passed since the client was last checked """
+    global _next_profile_check  # pylint: disable=global-statement
+    now = time.monotonic()
+    if now < _next_profile_check:
+        return False
+    _next_profile_check = now + NETWORK_PROFILE_CHECK_INTERVAL
+    return True
+
+
+def _retire(client):
+    """ Closes a replaced client once the requests still using it had time to finish """
+    timer = threading.Timer(LEDGER_TIMEOUT, client.close)
+    timer.daemon = True
+    timer.start()
+
+
+def get_network_client():
+    """
+    Returns the process-wide network client, creating it on first use.
+    The client is recreated in a forked child (e.g. a gunicorn worker),
+    because the parent's loop thread does not survive the fork,
+    and when its network profile or an identity changed on disk.
+    A client that cannot be rebuilt stays in use until the files are fixed.
+    """
+    global _network_client, _network_client_pid  # pylint: disable=global-statement
+    pid = os.getpid()
+    client = _network_client
+    if client is None or _network_client_pid != pid:
+        with _network_client_lock:
+            if _network_client is None or _network_client_pid != pid:
+                _network_client = VotechainNetworkClient()
+                _network_client_pid = pid
+    elif _profile_check_due() and client.is_stale():
+        with _network_client_lock:
+            if _network_client is client:
+                try:
+                    _network_client = VotechainNetworkClient()
+                except Exception:
+                    logger.exception("Network client could not be rebuilt, keeping the stale one")
+                    return client
+                _retire(client)
+    return _network_client
+
+
+def _reset_after_fork():
+    """ Drops the inherited client and lock in a freshly forked child """
+    # pylint: disable=global-statement
+    global _network_client, _network_client_pid, _network_client_lock, _next_profile_check
+    _network_client = None
+    _network_client_pid = None
+    _network_client_lock = threading.Lock()
+    _next_profile_check = 0.0
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
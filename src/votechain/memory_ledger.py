@@ -0,0 +1,427 @@
+"""
+Module simulating the Fabric ledger and the Votechain chaincode in process,
+for development and benchmarks
+"""
+import asyncio
+import collections
+import json
+import math
+import random
+import secrets
+from datetime import datetime, timezone
+from votechain import tracing
+from votechain.block_events import DecodedBlock, changes_of_call
+from votechain.scheduler import InvalidTransactionError
+
+VALID = "VALID"
+MVCC_READ_CONFLICT = "MVCC_READ_CONFLICT"
+RECEIPT_KEY = "receipt"
+TALLY_KEY = "tally"
+POLL_METHOD = "Poll"
+
+
+class Latency():
+    """
+    Random delay drawn from a distribution given as "<name>:<parameters in ms>":
+    fixed:5, uniform:5,20, normal:20,5, lognormal:20,0.5 (median and sigma) or exponential:20 (mean)
+    """
+    def __init__(self, spec):
+        name, _, params = spec.partition(":")
+        self.name = name
+        self.params = [float(param) for param in params.split(",") if param]
+        if name not in ("fixed", "uniform", "normal", "lognormal", "exponential"):
+            raise ValueError("Unknown latency distribution: " + spec)
+
+    def sample(self):
+        """ Returns a delay in seconds """
+        if self.name == "fixed":
+            delay = self.params[0]
+        elif self.name == "uniform":
+            delay = random.uniform(self.params[0], self.params[1])
+        elif self.name == "normal":
+            delay = random.gauss(self.params[0], self.params[1])
+        elif self.name == "lognormal":
+            delay = random.lognormvariate(math.log(self.params[0]), self.params[1])
+        else:
+            delay = random.expovariate(1 / self.params[0])
+        return max(delay, 0) / 1000
+
+
+class ChaincodeError(Exception):
+    """ Error returned by the chaincode, like shim.error """
+
+
+def _increment(state, amount):
+    """ Adds to a counter like the chaincode's parseInt, a missing counter becomes NaN """
+    try:
+        return str(int(state) + amount)
+    except ValueError:
+        return "NaN"
+
+
+class Simulation():
+    """
+    Executes a chaincode call against the committed state, like an endorsing peer.
+    Reads see committed values only, never the call's own writes, as in Fabric.
+    """
+    def __init__(self, world, tx_id):
+        self.world = world
+        self.tx_id = tx_id
+        self.reads = {}
+        self.writes = {}
+        # poll changes published in the block, once the transaction is valid
+        self.changes = []
+
+    def get_state(self, key):
+        """ Returns a committed value or "" and records its version in the read set """
+        value, version = self.world.state.get(key, ("", None))
+        self.reads[key] = version
+        return value
+
+    def put_state(self, key, value):
+        """ Adds a write to the write set """
+        self.writes[key] = value
+
+    def del_state(self, key):
+        """ Adds a delete to the write set """
+        self.writes[key] = None
+
+    def candidates(self):
+        """ Range scan over candidate keys, composite keys are excluded """
+        return sorted(
+            (key, value) for key, (value, _) in self.world.state.items() if isinstance(key, str)
+        )
+
+    def composite(self, object_type):
+        """ Scan over the composite keys of a type """
+        return sorted(
+            (key, value) for key, (value, _) in self.world.state.items()
+            if isinstance(key, tuple) and key[0] == object_type
+        )
+
+    def history(self, key):
+        """ Returns ids of transactions that wrote a key """
+        return self.world.history.get(key, [])
+
+
+class World():
+    """ State of one chaincode, or of one poll's namespace of the shared chaincode """
+    def __init__(self):
+        self.state = {}
+        self.history = {}
+
+
+# pylint: disable=invalid-name,missing-function-docstring
+class Chaincode():
+    """ Python mirror of hyperledger/chaincode/votechain.js, methods keep their chaincode names """
+    METHODS = (
+        "GetResults", "GetResult", "SendVote", "SendVotes", "SendShardedVote", "SendShardedVotes",
+        "GetShardedResults", "AddCandidates", "DeleteCandidates", "VerifyVote"
+    )
+
+    @staticmethod
+    def _record_votes(sim, pairs, counter_key):
+        """ Mirrors recordVotes: a receipt is counted once, also within one batch """
+        increments = {}
+        receipts = []
+        seen = set()
+        for i in range(0, len(pairs) - 1, 2):
+            receipt, candidate = pairs[i], pairs[i + 1]
+            receipts.append(receipt)
+            if receipt in seen:
+                continue
+            seen.add(receipt)
+            if sim.get_state((RECEIPT_KEY, receipt)):
+                continue
+            sim.put_state((RECEIPT_KEY, receipt), candidate)
+            increments[candidate] = increments.get(candidate, 0) + 1
+        for candidate, amount in increments.items():
+            exists = sim.get_state(candidate)
+            if exists == "":
+                raise ChaincodeError('Candidate "{0}" doesn\'t exist'.format(candidate))
+            key = counter_key(candidate)
+            state = exists if key == candidate else sim.get_state(key)
+            sim.put_state(key, _increment(state or "0", amount))
+        return receipts
+
+    def GetResults(self, sim, args):
+        if args:
+            raise ChaincodeError("Incorrect number of arguments. Expected none")
+        return json.dumps(dict(sim.candidates()), separators=(",", ":"))
+
+    def GetResult(self, sim, args):
+        if len(args) != 1:
+            raise ChaincodeError("Incorrect number of arguments. Expected 1")
+        return '{result: "' + sim.get_state(args[0]) + '"}'
+
+    def SendVote(self, sim, args):
+        if len(args) != 1:
+            raise ChaincodeError("Incorrect number of arguments. Expecting 1")
+        sim.put_state(args[0], _increment(sim.get_state(args[0]), 1))
+        return '{"txId": "' + sim.tx_id + '"}'
+
+    def SendVotes(self, sim, args):
+        if not args or len(args) % 2 != 0:
+            raise ChaincodeError(
+                "Incorrect number of arguments. Expecting receipt and candidate pairs"
+            )
+        receipts = self._record_votes(sim, args, lambda candidate: candidate)
+        return json.dumps({"txId": sim.tx_id, "receipts": receipts}, separators=(",", ":"))
+
+    def SendShardedVote(self, sim, args):
+        if len(args) != 2:
+            raise ChaincodeError("Incorrect number of arguments. Expecting candidate and shard")
+        candidate, shard = args
+        self._record_votes(sim, [sim.tx_id, candidate], lambda name: (TALLY_KEY, name, shard))
+        return '{"txId": "' + sim.tx_id + '"}'
+
+    def SendShardedVotes(self, sim, args):
+        if len(args) < 3 or len(args) % 2 != 1:
+            raise ChaincodeError(
+                "Incorrect number of arguments. Expecting shard, receipt and candidate pairs"
+            )
+        shard = args[0]
+        receipts = self._record_votes(sim, args[1:], lambda name: (TALLY_KEY, name, shard))
+        return json.dumps({"txId": sim.tx_id, "receipts": receipts}, separators=(",", ":"))
+
+    def GetShardedResults(self, sim, args):
+        if args:
+            raise ChaincodeError("Incorrect number of arguments. Expected none")
+        partials = {key: [int(value)] for key, value in sim.candidates()}
+        for key, value in sim.composite(TALLY_KEY):
+            if key[1] in partials:
+                partials[key[1]].append(int(value))
+        return json.dumps(partials, separators=(",", ":"))
+
+    def AddCandidates(self, sim, args):
+        if not args:
+            raise ChaincodeError("Incorrect number of arguments. Expecting 1 or more")
+        for candidate in args:
+            sim.put_state(candidate, "0")
+        return '{"txId": "' + sim.tx_id + '"}'
+
+    def DeleteCandidates(self, sim, args):
+        if not args:
+            raise ChaincodeError("Incorrect number of arguments. Expecting 1 or more")
+        for candidate in args:
+            sim.del_state(candidate)
+        return '{"txId": "' + sim.tx_id + '"}'
+
+    def VerifyVote(self, sim, args):
+        if len(args) != 1:
+            raise ChaincodeError("Incorrect number of arguments. Expected 1 - transaction id")
+        tx_id = args[0]
+        receipt = sim.get_state((RECEIPT_KEY, tx_id))
+        if receipt:
+            return json.dumps({"candidate": receipt}, separators=(",", ":"))
+        result = ""
+        for key, _ in sim.candidates():
+            if tx_id in sim.history(key):
+                result = key
+        if result == "":
+            raise ChaincodeError('{detail: "Could not find the transaction in the ledger"}')
+        return '{"candidate": "' + result + '"}'
+# pylint: enable=invalid-name,missing-function-docstring
+
+
+class MemoryLedger():
+    """
+    In-process stand-in for the Fabric ledger backend.
+    Transactions are endorsed against committed state, cut into blocks like the orderer does
+    (batch_size transactions or batch_timeout seconds) and validated block by block,
+    so concurrent votes on the same counter fail with MVCC_READ_CONFLICT as they would on Fabric.
+    Latencies of endorsement, ordering and block commit are drawn from the given distributions.
+    The last retained_blocks committed blocks are kept decoded, for block listeners.
+    Must be used from the network client's event loop.
+    """
+    def __init__(self, endorse_latency, order_latency, commit_latency, batch_size, batch_timeout,
+                 retained_blocks=1000):
+        self.endorse_latency = endorse_latency
+        self.order_latency = order_latency
+        self.commit_latency = commit_latency
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        self.height = 0
+        self._chaincode = Chaincode()
+        self._chaincodes = set()
+        self._worlds = {}
+        self._block = []
+        self._block_timer = None
+        self._commit_lock = asyncio.Lock()
+        self._blocks = collections.deque(maxlen=retained_blocks)
+        self._listeners = []
+
+    def _simulate(self, chaincode_name, method_name, args, tx_id):
+        """ Runs a chaincode method like the chaincode's Invoke and Poll do """
+        if chaincode_name not in self._chaincodes:
+            raise ChaincodeError(
+                "make sure the chaincode {0} has been successfully instantiated"
+                .format(chaincode_name)
+            )
+        if method_name == "invoke" and args:
+            method_name, args = args[0], args[1:]
+        namespace = None
+        if method_name == POLL_METHOD:
+            if len(args) < 2:
+                raise ChaincodeError("Incorrect number of arguments. Expecting poll id and method")
+            namespace, method_name, args = args[0], args[1], args[2:]
+        if method_name not in Chaincode.METHODS:
+            raise ChaincodeError('Method "{0}" doesn\'t exist'.format(method_name))
+        world = self._worlds.setdefault((chaincode_name, namespace), World())
+        sim = Simulation(world, tx_id)
+        return sim, getattr(self._chaincode, method_name)(sim, list(args))
+
+    async def evaluate(self, chaincode_name, method_name, args):
+        """ Evaluates a chaincode function on one peer, nothing is ordered """
+        traced_method = tracing.method_of(args, method_name)
+        tracing.payload("request", traced_method, args)
+        with tracing.phase("endorse", traced_method):
+            await asyncio.sleep(self.endorse_latency.sample())
+            try:
+                _, payload = self._simulate(
+                    chaincode_name,
+                    method_name,
+                    args,
+                    secrets.token_hex(32)
+                )
+            except ChaincodeError as ex:
+                raise Exception(str(ex)) from ex
+        tracing.payload("response", traced_method, payload)
+        return payload
+
+    async def send_transaction(self, chaincode_name, args):
+        """
+        Endorses, orders and commits a transaction, returning the chaincode response.
+        Like hfc, a failed endorsement returns its message and an invalidated transaction raises.
+        """
+        method_name = tracing.method_of(args)
+        tracing.payload("request", method_name, args)
+        tx_id = secrets.token_hex(32)
+        with tracing.phase("endorse", method_name):
+            await asyncio.sleep(self.endorse_latency.sample())
+            try:
+                sim, payload = self._simulate(chaincode_name, "invoke", args, tx_id)
+            except ChaincodeError as ex:
+                return str(ex)
+            sim.changes = changes_of_call(chaincode_name, tx_id, args)
+        with tracing.phase("broadcast", method_name):
+            await asyncio.sleep(self.order_latency.sample())
+            committed = self._order(sim)
+        with tracing.phase("commit", method_name):
+            status = await committed
+        if status != VALID:
+            raise InvalidTransactionError([status])
+        tracing.payload("response", method_name, payload)
+        return payload
+
+    def _order(self, sim):
+        """ Adds a transaction to the block being cut, returns a future of its validation code """
+        future = asyncio.get_event_loop().create_future()
+        self._block.append((sim, future))
+        if len(self._block) >= self.batch_size:
+            self._cut_block()
+        elif self._block_timer is None:
+            self._block_timer = asyncio.get_event_loop().call_later(
+                self.batch_timeout,
+                self._cut_block
+            )
+        return future
+
+    def _cut_block(self):
+        """ Sends the pending transactions to the peers as one block """
+        if self._block_timer is not None:
+            self._block_timer.cancel()
+            self._block_timer = None
+        block, self._block = self._block, []
+        if block:
+            asyncio.ensure_future(self._commit(block))
+
+    async def _commit(self, block):
+        """ Validates and applies a block; blocks are committed one at a time, in order """
+        async with self._commit_lock:
+            await asyncio.sleep(self.commit_latency.sample())
+            block_number = self.height
+            changes = []
+            for index, (sim, future) in enumerate(block):
+                status = self._validate(sim, (block_number, index))
+                if status == VALID:
+                    changes += sim.changes
+                if not future.done():
+                    future.set_result(status)
+            self._append_block(changes)
+
+    def _append_block(self, changes):
+        """ Adds a committed block to the chain and hands it to the block listeners """
+        block = DecodedBlock(self.height, datetime.now(timezone.utc), changes)
+        self.height += 1
+        self._blocks.append(block)
+        for on_block, stream in list(self._listeners):
+            try:
+                on_block(block)
+            except Exception as ex:
+                self._listeners.remove((on_block, stream))
+                if not stream.done():
+                    stream.set_exception(ex)
+
+    def _validate(self, sim, version):
+        """ Applies a transaction whose read set is still current """
+        state = sim.world.state
+        if any(state.get(key, (None, None))[1] != read for key, read in sim.reads.items()):
+            return MVCC_READ_CONFLICT
+        for key, value in sim.writes.items():
+            if value is None:
+                sim.world.state.pop(key, None)
+            else:
+                sim.world.state[key] = (value, version)
+            sim.world.history.setdefault(key, []).append(sim.tx_id)
+        return VALID
+
+    async def deploy_chaincode(self, chaincode_name):
+        """ Instantiates an empty chaincode """
+        await asyncio.sleep(
+            self.endorse_latency.sample()
+            + self.order_latency.sample()
+            + self.commit_latency.sample()
+        )
+        if chaincode_name in self._chaincodes:
+            raise Exception("chaincode with name '{0}' already exists".format(chaincode_name))
+        self._chaincodes.add(chaincode_name)
+        self._append_block([])
+        return True
+
+    async def listen_blocks(self, start, on_block):
+        """
+        Calls on_block with every block committed from block number start on,
+        until the ledger is closed.
+        Raises ValueError when blocks from start on are no longer retained.
+        A failing on_block ends the stream with its error.
+        """
+        start = max(start, 0)
+        first_retained = self.height - len(self._blocks)
+        if start < first_retained:
+            raise ValueError("blocks before {0} are no longer retained".format(first_retained))
+        stream = asyncio.get_event_loop().create_future()
+        listener = (on_block, stream)
+        self._listeners.append(listener)
+        try:
+            for block in list(self._blocks)[start - first_retained:]:
+                on_block(block)
+            await stream
+        finally:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    async def get_channel_height(self):
+        """ Returns the number of committed blocks """
+        return self.height
+
+    def is_stale(self):
+        """ The in-memory ledger has no configuration to reload """
+        return False
+
+    async def close(self):
+        """ Flushes the block being cut and ends the block streams """
+        self._cut_block()
+        for _, stream in self._listeners:
+            if not stream.done():
+                stream.set_result(None)
@@ -0,0 +1,179 @@
+""" Module holding in-process metrics of the ledger client """
+import bisect
+import threading
+
+# upper bounds of histogram buckets, in seconds and in bytes
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20)
+
+
+class Counter():
+    """ Monotonically increasing, thread-safe counter """
+    def __init__(self, name, description=""):
+        self.name = name
+        self.description = description
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        """ Increases the counter """
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self):
+        """ Returns current value """
+        return self._value
+
+    def export(self):
+        """ Returns a JSON serializable representation """
+        return self._value
+
+
+class Gauge():
+    """ Thread-safe value that can go up and down """
+    def __init__(self, name, description=""):
+        self.name = name
+        self.description = description
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def set(self, value):
+        """ Sets the gauge """
+        with self._lock:
+            self._value = value
+
+    def inc(self, amount=1):
+        """ Increases the gauge """
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1):
+        """ Decreases the gauge """
+        with self._lock:
+            self._value -= amount
+
+    @property
+    def value(self):
+        """ Returns current value """
+        return self._value
+
+    def export(self):
+        """ Returns a JSON serializable representation """
+        return self._value
+
+
+class Histogram():
+    """
+    Thread-safe distribution of observed values over fixed buckets.
+    Quantiles are estimated by interpolating within the bucket they fall into.
+    """
+    def __init__(self, name, description="", buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._count = 0
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        """ Records a value """
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._count += 1
+            self._sum += value
+
+    @property
+    def count(self):
+        """ Returns the number of observed values """
+        return self._count
+
+    def quantile(self, fraction):
+        """ Returns an estimate of the given quantile, None before the first value """
+        with self._lock:
+            counts = list(self._counts)
+            total = self._count
+        if not total:
+            return None
+        rank = fraction * total
+        seen = 0
+        for index, count in enumerate(counts):
+            if count and seen + count >= rank:
+                if index == len(self.buckets):
+                    # values above the last bucket are reported as its bound
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index else 0
+                return lower + (self.buckets[index] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def export(self):
+        """ Returns a JSON serializable representation, buckets are cumulative """
+        with self._lock:
+            counts = list(self._counts)
+            total = self._count
+            total_sum = self._sum
+        cumulative = []
+        seen = 0
+        for bound, count in zip(self.buckets + ("+Inf",), counts):
+            seen += count
+            cumulative.append([bound, seen])
+        return {
+            "count": total,
+            "sum": total_sum,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "buckets": cumulative,
+        }
+
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def _get_or_create(metric_class, name, description, **kwargs):
+    """ Returns a registered metric, registering it on first use """
+    metric = _registry.get(name)
+    if metric is None:
+        with _registry_lock:
+            metric = _registry.get(name)
+            if metric is None:
+                metric = metric_class(name, description, **kwargs)
+                _registry[name] = metric
+    return metric
+
+
+def _labelled(name, labels):
+    """
+    Returns the name of a metric with labels,
+    e.g. chaincode_endorse_seconds{method="SendVote"}
+    """
+    if not labels:
+        return name
+    return name + "{" + ",".join(
+        '{0}="{1}"'.format(key, value) for key, value in sorted(labels.items())
+    ) + "}"
+
+
+def counter(name, description=""):
+    """ Returns a counter with the given name """
+    return _get_or_create(Counter, name, description)
+
+
+def gauge(name, description=""):
+    """ Returns a gauge with the given name """
+    return _get_or_create(Gauge, name, description)
+
+
+def histogram(name, description="", buckets=LATENCY_BUCKETS, **labels):
+    """ Returns a histogram with the given name and labels """
+    return _get_or_create(Histogram, _labelled(name, labels), description, buckets=buckets)
+
+
+def snapshot():
+    """ Returns current values of all registered metrics """
+    return {name: metric.export() for name, metric in sorted(_registry.items())}
@@ -0,0 +1,148 @@
+""" Module parsing the network profile and loading signing identities once per process """
+import json
+import os
+import threading
+from hfc.fabric import Client
+from hfc.fabric.certificateAuthority import create_ca
+from hfc.fabric.orderer import Orderer
+from hfc.fabric.organization import create_org
+from hfc.fabric.peer import Peer
+from hfc.util.keyvaluestore import FileKeyValueStore
+
+
+class NetworkProfileError(ValueError):
+    """ Raised when the network profile is malformed """
+
+
+def _stamp(path):
+    """ Returns what identifies a version of a file, None when it is missing """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _require(condition, message, *args):
+    """ Raises NetworkProfileError unless condition holds """
+    if not condition:
+        raise NetworkProfileError(message.format(*args))
+
+
+def _validate(info):
+    """
+    Checks the parts of the profile the client relies on, so a broken profile fails
+    with a clear message instead of a KeyError, or a peer hfc silently skips
+    """
+    for section in ("organizations", "peers", "orderers"):
+        _require(
+            isinstance(info.get(section), dict),
+            'Network profile has no "{0}" section', section
+        )
+    for kind in ("peers", "orderers"):
+        for name, node in info[kind].items():
+            _require("url" in node, '{0} "{1}" has no url', kind, name)
+            _require(
+                "grpc.ssl_target_name_override" in node.get("grpcOptions", {}),
+                '{0} "{1}" has no grpc.ssl_target_name_override option', kind, name
+            )
+            _require(
+                "path" in node.get("tlsCACerts", {}),
+                '{0} "{1}" has no tlsCACerts path', kind, name
+            )
+    for org_name, org in info["organizations"].items():
+        _require("mspid" in org, 'Organization "{0}" has no mspid', org_name)
+        for peer in org.get("peers", []):
+            _require(
+                peer in info["peers"],
+                'Organization "{0}" lists unknown peer "{1}"', org_name, peer
+            )
+        for user_name, user in org.get("users", {}).items():
+            for field in ("cert", "private_key"):
+                _require(
+                    field in user,
+                    'User "{0}" of "{1}" has no {2}', user_name, org_name, field
+                )
+
+
+class NetworkProfile():
+    """
+    Parsed and validated network profile with the organizations it describes,
+    whose signing identities are loaded from disk once.
+    Remembers the version of every file it was built from, so changes are noticed.
+    """
+    def __init__(self, path):
+        stamp = _stamp(path)
+        with open(path, "r", encoding="utf-8") as profile:
+            self.info = json.load(profile)
+        _validate(self.info)
+        self.stamps = {path: stamp}
+        self.kv_store_path = self.info.get("client", {}).get("credentialStore", {}).get("path")
+        self.state_store = FileKeyValueStore(self.kv_store_path) if self.kv_store_path else None
+        self.organizations = {}
+        for name, org in self.info["organizations"].items():
+            for user in org.get("users", {}).values():
+                for field in ("cert", "private_key"):
+                    if isinstance(user[field], str):
+                        self.stamps[user[field]] = _stamp(user[field])
+            self.organizations[name] = create_org(name, org, self.state_store)
+        self.cas = {
+            name: create_ca(name, ca)
+            for name, ca in self.info.get("certificateAuthorities", {}).items()
+        }
+
+    def is_stale(self):
+        """ Checks whether the profile or an identity file changed since it was loaded """
+        return any(_stamp(path) != stamp for path, stamp in self.stamps.items())
+
+
+_profiles = {}
+_profiles_lock = threading.Lock()
+
+
+def load_profile(path):
+    """ Returns the network profile at path, reloading it only when one of its files changed """
+    key = os.path.abspath(path)
+    profile = _profiles.get(key)
+    if profile is None or profile.is_stale():
+        with _profiles_lock:
+            profile = _profiles.get(key)
+            if profile is None or profile.is_stale():
+                profile = _profiles[key] = NetworkProfile(path)
+    return profile
+
+
+class CachedClient(Client):
+    """
+    hfc client built from the cached network profile.
+    Only peers and orderers are created anew, because their grpc channels bind to the running loop.
+    """
+    def __init__(self, net_profile=None):
+        # Client sets them too, then loads the profile when given one
+        self.profile = None
+        self.network_info = {}
+        self.kv_store_path = None
+        self._state_store = None
+        self._organizations = {}
+        super().__init__(net_profile)
+
+    def init_with_net_profile(self, profile_path="network.json"):
+        """ Builds the client from the network profile at profile_path, loaded once per change """
+        profile = load_profile(profile_path)
+        # kept, so the client can tell when it was built from an outdated profile
+        self.profile = profile
+        self.network_info = profile.info
+        self.kv_store_path = profile.kv_store_path
+        self._state_store = profile.state_store
+        self._organizations = dict(profile.organizations)
+        # filled through the property, Client keeps them in an attribute of its own
+        self.CAs.clear()
+        self.CAs.update(profile.cas)
+        for name, info in profile.info["orderers"].items():
+            orderer = Orderer(name=name, endpoint=info["url"])
+            orderer.init_with_bundle(info)
+            self._orderers[name] = orderer
+        for name, info in profile.info["peers"].items():
+            peer = Peer(name=name)
+            peer.init_with_bundle(info)
+            self._peers[name] = peer
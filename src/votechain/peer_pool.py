@@ -0,0 +1,248 @@
+""" Module choosing endorsing peers by their observed latency and health """
+import asyncio
+import time
+from contextlib import asynccontextmanager
+import grpc
+from votechain import metrics
+
+peer_errors = metrics.counter("peer_errors", "Failed requests to endorsing peers")
+hedged_requests = metrics.counter("peer_hedged_requests", "Requests raced against a second peer")
+# answers of a peer the chaincode of a request is not installed on
+NOT_INSTALLED = ("cannot retrieve package for chaincode", "is not installed")
+
+
+def is_peer_failure(ex):
+    """
+    Checks whether an exception means the peer itself failed.
+    Errors returned by a responsive peer, e.g. a chaincode error, are not held against it.
+    """
+    return isinstance(ex, (grpc.RpcError, ConnectionError, asyncio.TimeoutError))
+
+
+def is_not_installed(error):
+    """
+    Checks whether a peer refused a request because the chaincode is not installed on it,
+    e.g. chaincodes of polls created before chaincodes were installed on every organization
+    """
+    message = str(error)
+    return any(pattern in message for pattern in NOT_INSTALLED)
+
+
+class PeerStats():
+    """ Latency and health of a single peer """
+    def __init__(self, name, org):
+        self.name = name
+        self.org = org
+        self.latency = None
+        self.in_flight = 0
+        self.failures = 0
+        self.unhealthy_until = 0.0
+        self.slots = None
+
+    def healthy(self, now):
+        """ Checks whether the peer is out of its error cooldown """
+        return self.unhealthy_until <= now
+
+    def score(self):
+        """
+        Expected latency of the next request, lower is better.
+        Peers never measured score 0, so every peer gets sampled,
+        requests in flight inflate the score, so load spreads over similar peers.
+        """
+        return (self.latency or 0.0) * (1 + self.in_flight)
+
+
+class PeerPool():
+    """
+    Pool of every peer of the network profile.
+    Keeps an exponentially weighted moving average of each peer's latency,
+    puts failing peers on an exponentially growing cooldown and picks the fastest
+    healthy peers for a request.
+    Peers found without a request's chaincode are left out of that chaincode's requests
+    for missing_cooldown seconds.
+    With max_in_flight, requests beyond that many per peer wait for one to finish.
+    """
+    def __init__(self, peers_by_org, endorsing_orgs=1, alpha=0.2, hedge_delay=0.25,
+                 error_cooldown=5.0, max_error_cooldown=60.0, max_in_flight=0,
+                 missing_cooldown=300.0):
+        self.peers = {
+            name: PeerStats(name, org)
+            for org, names in peers_by_org.items() for name in names
+        }
+        self.orgs = [org for org, names in peers_by_org.items() if names]
+        self.endorsing_orgs = max(1, min(endorsing_orgs, len(self.orgs)))
+        self.alpha = alpha
+        self.hedge_delay = hedge_delay
+        self.error_cooldown = error_cooldown
+        self.max_error_cooldown = max_error_cooldown
+        self.max_in_flight = max_in_flight
+        self.missing_cooldown = missing_cooldown
+        self._missing = {}
+
+    def _observe(self, stats, latency):
+        """ Folds a latency sample into the peer's moving average """
+        if stats.latency is None:
+            stats.latency = latency
+        else:
+            stats.latency += self.alpha * (latency - stats.latency)
+
+    def record_success(self, name, latency):
+        """ Records a request the peer answered """
+        stats = self.peers[name]
+        self._observe(stats, latency)
+        stats.failures = 0
+        stats.unhealthy_until = 0.0
+
+    def record_error(self, name):
+        """ Puts a failed peer on cooldown, doubling it on every consecutive failure """
+        peer_errors.inc()
+        stats = self.peers[name]
+        stats.failures += 1
+        cooldown = min(
+            self.error_cooldown * 2 ** (stats.failures - 1),
+            self.max_error_cooldown
+        )
+        stats.unhealthy_until = time.monotonic() + cooldown
+
+    def _ranked(self, candidates):
+        """ Orders peers healthy first, then by score; unhealthy ones by cooldown expiry """
+        now = time.monotonic()
+        return sorted(
+            candidates,
+            key=lambda stats: (
+                not stats.healthy(now),
+                stats.unhealthy_until if not stats.healthy(now) else 0.0,
+                stats.score()
+            )
+        )
+
+    def mark_missing(self, chaincode_name, name):
+        """ Records that a chaincode is not installed on a peer """
+        expiry = time.monotonic() + self.missing_cooldown
+        self._missing.setdefault(chaincode_name, {})[name] = expiry
+
+    def _candidates(self, chaincode_name=None):
+        """
+        Returns the peers a chaincode is not known to be missing from,
+        every peer when it is missing from all of them, so the error reaches the caller
+        """
+        missing = self._missing.get(chaincode_name)
+        if not missing:
+            return list(self.peers.values())
+        now = time.monotonic()
+        candidates = [stats for stats in self.peers.values() if missing.get(stats.name, 0) <= now]
+        return candidates or list(self.peers.values())
+
+    def fastest(self, count=1, chaincode_name=None):
+        """ Returns names of the count fastest peers having the chaincode, healthy ones first """
+        return [stats.name for stats in self._ranked(self._candidates(chaincode_name))[:count]]
+
+    def endorsers(self, chaincode_name=None):
+        """
+        Returns the minimal set of peers satisfying the endorsement policy:
+        the fastest peer having the chaincode of each of the endorsing_orgs fastest organizations.
+        """
+        candidates = self._candidates(chaincode_name)
+        best_of_org = [
+            self._ranked(of_org)[0]
+            for of_org in (
+                [stats for stats in candidates if stats.org == org] for org in self.orgs
+            )
+            if of_org
+        ]
+        return [stats.name for stats in self._ranked(best_of_org)[:self.endorsing_orgs]]
+
+    def peers_of(self, org):
+        """ Returns names of all peers of an organization """
+        return [stats.name for stats in self.peers.values() if stats.org == org]
+
+    @asynccontextmanager
+    async def reserve(self, names):
+        """
+        Holds a request slot on each of the given peers.
+        Slots are taken in sorted order, so overlapping reservations cannot deadlock.
+        """
+        held = []
+        try:
+            for name in sorted(set(names)) if self.max_in_flight else []:
+                stats = self.peers[name]
+                if stats.slots is None:
+                    stats.slots = asyncio.Semaphore(self.max_in_flight)
+                await stats.slots.acquire()
+                held.append(stats)
+            yield
+        finally:
+            for stats in held:
+                stats.slots.release()
+
+    async def call(self, name, request):
+        """ Runs request(name) against a peer once it has a free slot, measuring it """
+        async with self.reserve([name]):
+            return await self.measure(name, request)
+
+    async def measure(self, name, request):
+        """ Runs request(name) against a peer, measuring it """
+        stats = self.peers[name]
+        stats.in_flight += 1
+        started = time.monotonic()
+        try:
+            result = await request(name)
+        except asyncio.CancelledError:
+            # a request losing a race took at least this long
+            self._observe(stats, time.monotonic() - started)
+            raise
+        except Exception as ex:
+            if is_peer_failure(ex):
+                self.record_error(name)
+            else:
+                self.record_success(name, time.monotonic() - started)
+            raise
+        finally:
+            stats.in_flight -= 1
+        self.record_success(name, time.monotonic() - started)
+        return result
+
+    async def hedged(self, request, chaincode_name=None):
+        """
+        Runs request(peer) against the fastest peer having the chaincode; when it does not answer
+        within hedge_delay, or fails, the request is raced against the next fastest peer.
+        Returns the first successful result, the slower request is cancelled,
+        raises ValueError when there is no peer to ask.
+        An error answered by a responsive peer is raised right away,
+        unless the chaincode is not installed on it.
+        Only meant for read-only requests, which are safe to send twice.
+        """
+        names = self.fastest(len(self.peers), chaincode_name)
+        pending = set()
+        error = None
+        try:
+            for index, name in enumerate(names):
+                task = asyncio.ensure_future(self.call(name, request))
+                task.peer_name = name
+                pending.add(task)
+                is_last = index == len(names) - 1
+                while pending:
+                    timeout = None if is_last or not self.hedge_delay else self.hedge_delay
+                    done, pending = await asyncio.wait(
+                        pending,
+                        timeout=timeout,
+                        return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for task in done:
+                        if task.exception() is None:
+                            return task.result()
+                        error = task.exception()
+                        if is_not_installed(error):
+                            self.mark_missing(chaincode_name, task.peer_name)
+                        elif not is_peer_failure(error):
+                            raise error
+                    if not done or not pending:
+                        break
+                if pending and not is_last:
+                    hedged_requests.inc()
+        finally:
+            for task in pending:
+                task.cancel()
+        if error is None:
+            raise ValueError("no peer has chaincode {0}".format(chaincode_name))
+        raise error
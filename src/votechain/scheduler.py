@@ -0,0 +1,103 @@
+""" Module scheduling vote transactions around MVCC read conflicts """
+import asyncio
+import random
+from votechain import metrics, tracing
+
+CONFLICT_CODES = ("MVCC_READ_CONFLICT", "PHANTOM_READ_CONFLICT")
+
+conflicts = metrics.counter("vote_conflicts", "Vote transactions invalidated by a read conflict")
+retries = metrics.counter("vote_retries", "Vote transactions resent after a read conflict")
+failures = metrics.counter("vote_conflict_failures", "Votes still conflicting after all retries")
+
+
+class VoteConflictError(Exception):
+    """ Raised when a vote keeps conflicting after all retries """
+
+
+class InvalidTransactionError(Exception):
+    """
+    Raised when a transaction was committed as invalid, it never takes effect.
+    Its message holds the validation code, in the same format as hfc's chaincode_invoke.
+    """
+
+
+def is_conflict(error):
+    """ Checks whether a transaction failed because its read set became stale """
+    message = str(error)
+    return any(code in message for code in CONFLICT_CODES)
+
+
+class VoteScheduler():
+    """
+    Serialises vote transactions touching the same (poll, candidate) counters
+    and resends the ones invalidated by a read conflict, with jittered exponential backoff.
+    Must be used from the Fabric client's event loop.
+    """
+    def __init__(self, max_retries, backoff, max_backoff):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._locks = {}
+
+    def _backoff(self, attempt):
+        """ Full jitter backoff, in seconds """
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def _lock(self, key):
+        """ Returns the lock guarding a key and takes a reference to it """
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        return entry[0]
+
+    def _release(self, key, held):
+        """ Releases the lock guarding a key if held and forgets it once unused """
+        entry = self._locks[key]
+        if held:
+            entry[0].release()
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self._locks[key]
+
+    async def run(self, keys, send, method_name=None):
+        """
+        Calls send (a coroutine function) while holding the locks of all given keys.
+        Locks are taken in sorted order, so overlapping batches cannot deadlock.
+        Resends are recorded per chaincode method when method_name is given.
+        """
+        referenced = []
+        held = []
+        try:
+            for key in sorted(set(keys)):
+                lock = self._lock(key)
+                referenced.append(key)
+                await lock.acquire()
+                held.append(key)
+            return await self._send_with_retries(send, method_name)
+        finally:
+            for key in referenced:
+                self._release(key, key in held)
+
+    async def _send_with_retries(self, send, method_name=None):
+        """ Resends a transaction as long as it fails on a read conflict """
+        attempt = 0
+        try:
+            while True:
+                try:
+                    return await send()
+                except Exception as ex:
+                    if not is_conflict(ex):
+                        raise
+                    conflicts.inc()
+                    if attempt >= self.max_retries:
+                        failures.inc()
+                        raise VoteConflictError(
+                            "Vote conflicted {0} times".format(attempt + 1)
+                        ) from ex
+                    attempt += 1
+                    retries.inc()
+                    await asyncio.sleep(self._backoff(attempt))
+        finally:
+            if method_name is not None:
+                tracing.retries(method_name, attempt)
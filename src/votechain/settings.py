@@ -64,6 +64,7 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
+    'core.middleware.LedgerDeadlineMiddleware',
 ]
 
 ROOT_URLCONF = 'votechain.urls'
@@ -219,3 +220,107 @@ EMAIL_HOST_USER = os.environ.get('SMTP_USER', None)
 EMAIL_HOST_PASSWORD = os.environ.get('SMTP_PASSWORD', None)
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 EMAIL_USE_TLS = True
+
+# Hyperledger Fabric client
+LEDGER_TIMEOUT = float(os.environ.get("LEDGER_TIMEOUT", 60))
+# seconds between checks whether the network profile or an identity changed,
+# which rebuilds the client
+NETWORK_PROFILE_CHECK_INTERVAL = float(os.environ.get("NETWORK_PROFILE_CHECK_INTERVAL", 5))
+# seconds a transaction waits for the commit event stream to start and for its commit event
+COMMIT_EVENT_TIMEOUT = float(os.environ.get("COMMIT_EVENT_TIMEOUT", 30))
+# votes are batched into one transaction when the batch size is greater than 1
+VOTE_BATCH_SIZE = int(os.environ.get("VOTE_BATCH_SIZE", 1))
+VOTE_BATCH_WINDOW = float(os.environ.get("VOTE_BATCH_WINDOW_MS", 50)) / 1000
+# votes invalidated by an MVCC read conflict are resent with jittered exponential backoff
+VOTE_MAX_RETRIES = int(os.environ.get("VOTE_MAX_RETRIES", 5))
+VOTE_RETRY_BACKOFF = float(os.environ.get("VOTE_RETRY_BACKOFF_MS", 50)) / 1000
+VOTE_RETRY_MAX_BACKOFF = float(os.environ.get("VOTE_RETRY_MAX_BACKOFF_MS", 1000)) / 1000
+# new polls spread votes over this many counter shards per candidate, 0 keeps a single counter
+VOTE_SHARDS = int(os.environ.get("VOTE_SHARDS", 0))
+RESULTS_CACHE_TTL = float(os.environ.get("RESULTS_CACHE_TTL", 5))
+# number of organizations whose peers endorse transactions of new polls
+ENDORSING_ORGS = int(os.environ.get("ENDORSING_ORGS", 1))
+PEER_LATENCY_ALPHA = float(os.environ.get("PEER_LATENCY_ALPHA", 0.2))
+# queries slower than this are raced against a second peer, 0 disables hedging
+PEER_HEDGE_DELAY = float(os.environ.get("PEER_HEDGE_DELAY_MS", 250)) / 1000
+PEER_ERROR_COOLDOWN = float(os.environ.get("PEER_ERROR_COOLDOWN", 5))
+# "shared" hosts new polls in a single multi-poll chaincode, "dedicated" instantiates one per poll
+CHAINCODE_MODE = os.environ.get("CHAINCODE_MODE", "dedicated")
+# instantiated chaincodes kept ready to be bound to new polls by the provisioner
+CHAINCODE_POOL_SIZE = int(os.environ.get("CHAINCODE_POOL_SIZE", 2))
+# "fabric" talks to the network profile, "memory" simulates the ledger in process,
+# the default without blockchain integration; its chaincodes and votes live in the memory
+# of each process, so they are lost on restart and not shared between workers,
+# polls provisioned before a restart stay ready without a chaincode: not for production
+LEDGER_BACKEND = os.environ.get("LEDGER_BACKEND", "fabric" if INTEGRATE_BLOCKCHAIN else "memory")
+# latency distributions of the in-memory ledger in ms,
+# e.g. fixed:5, uniform:5,20 or lognormal:20,0.5
+MEMORY_LEDGER_ENDORSE_LATENCY = os.environ.get("MEMORY_LEDGER_ENDORSE_LATENCY", "lognormal:20,0.5")
+MEMORY_LEDGER_ORDER_LATENCY = os.environ.get("MEMORY_LEDGER_ORDER_LATENCY", "lognormal:10,0.5")
+MEMORY_LEDGER_COMMIT_LATENCY = os.environ.get("MEMORY_LEDGER_COMMIT_LATENCY", "lognormal:50,0.5")
+# block cutting of the in-memory orderer, defaults match configtx.yaml
+MEMORY_LEDGER_BATCH_SIZE = int(os.environ.get("MEMORY_LEDGER_BATCH_SIZE", 10))
+MEMORY_LEDGER_BATCH_TIMEOUT = float(os.environ.get("MEMORY_LEDGER_BATCH_TIMEOUT_MS", 2000)) / 1000
+# committed blocks kept for block listeners, older ones are dropped
+MEMORY_LEDGER_RETAINED_BLOCKS = int(os.environ.get("MEMORY_LEDGER_RETAINED_BLOCKS", 1000))
+# ledger calls in flight at a time per poll and per peer, 0 means unlimited
+GATEWAY_MAX_IN_FLIGHT_PER_POLL = int(os.environ.get("GATEWAY_MAX_IN_FLIGHT_PER_POLL", 16))
+GATEWAY_MAX_IN_FLIGHT_PER_PEER = int(os.environ.get("GATEWAY_MAX_IN_FLIGHT_PER_PEER", 32))
+# requests waiting for a slot, the ones beyond are answered with 503 and Retry-After right away
+GATEWAY_QUEUE_SIZE = int(os.environ.get("GATEWAY_QUEUE_SIZE", 64))
+GATEWAY_RETRY_AFTER = float(os.environ.get("GATEWAY_RETRY_AFTER", 1))
+# consecutive network failures opening the circuit breaker,
+# and seconds until it lets a probe through
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("BREAKER_FAILURE_THRESHOLD", 5))
+BREAKER_COOLDOWN = float(os.environ.get("BREAKER_COOLDOWN", 10))
+# seconds an HTTP request may spend on the ledger, clients can ask for less with X-Request-Timeout
+REQUEST_DEADLINE = float(os.environ.get("REQUEST_DEADLINE", 30))
+
+# Background processing
+BACKGROUND_WORKERS = int(os.environ.get("BACKGROUND_WORKERS", 4))
+# votes are accepted with 202 and committed to the ledger in the background
+VOTE_ASYNC = os.getenv("VOTE_ASYNC", "False") == "True"
+# votes are written to a local spool before they are acknowledged and replayed if the ledger fails
+VOTE_SPOOL = os.getenv("VOTE_SPOOL", "False") == "True"
+# an accepted vote's candidate is only kept by the spool, without it a vote is lost on restart
+if VOTE_ASYNC and not VOTE_SPOOL:
+    raise EnvironmentError("VOTE_ASYNC requires VOTE_SPOOL")
+VOTE_SPOOL_PATH = os.environ.get(
+    "VOTE_SPOOL_PATH",
+    os.path.join(BASE_DIR, "spool", "votes.sqlite3")
+)
+VOTE_SPOOL_RETENTION = int(os.environ.get("VOTE_SPOOL_RETENTION", 86400))
+# results and verifications are served from the local block index
+# once it caught up with an ended poll
+LEDGER_INDEX = os.getenv("LEDGER_INDEX", "False") == "True"
+LEDGER_INDEX_GRACE = float(os.environ.get("LEDGER_INDEX_GRACE", 30))
+# emails are written to an outbox table and delivered by the deliver_outbox command
+# over this many parallel SMTP connections
+OUTBOX_WORKERS = int(os.environ.get("OUTBOX_WORKERS", 4))
+OUTBOX_BATCH_SIZE = int(os.environ.get("OUTBOX_BATCH_SIZE", 100))
+# failed deliveries are retried with jittered exponential backoff, then given up
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", 8))
+OUTBOX_RETRY_BACKOFF = float(os.environ.get("OUTBOX_RETRY_BACKOFF", 30))
+OUTBOX_RETRY_MAX_BACKOFF = float(os.environ.get("OUTBOX_RETRY_MAX_BACKOFF", 3600))
+# seconds a worker holds the emails it took, a crashed worker's emails are retried after that
+OUTBOX_LEASE = float(os.environ.get("OUTBOX_LEASE", 300))
+# seconds sent and failed emails are kept, for checking on deliveries, before they are deleted
+OUTBOX_RETENTION = int(os.environ.get("OUTBOX_RETENTION", 604800))
+# uploaded electorate files are kept here until their job is done
+ELECTORATE_UPLOAD_PATH = os.environ.get("ELECTORATE_UPLOAD_PATH", os.path.join(BASE_DIR, "uploads"))
+# lines of an electorate file assigned tokens per transaction
+ELECTORATE_CHUNK_SIZE = int(os.environ.get("ELECTORATE_CHUNK_SIZE", 1000))
+# emails per second sent to the SMTP relay by all connections together, 0 means unlimited
+MAIL_RATE_LIMIT = float(os.environ.get("MAIL_RATE_LIMIT", 0))
+# emails sent over an SMTP connection before it is opened again, 0 means no limit
+MAIL_MAX_PER_CONNECTION = int(os.environ.get("MAIL_MAX_PER_CONNECTION", 100))
+# vvpats are encrypted with this urlsafe base64 AES key (16, 24 or 32 bytes) instead of only signed
+VVPAT_ENCRYPTION_KEY = os.environ.get("VVPAT_ENCRYPTION_KEY", None)
+# issued vvpats are also recorded in the Trail table, in the background, for audits
+VVPAT_AUDIT_TRAIL = os.getenv("VVPAT_AUDIT_TRAIL", "False") == "True"
+# polls per page of cursor paginated poll listings, when no page_size is asked for,
+# and the most allowed
+POLL_PAGE_SIZE = int(os.environ.get("POLL_PAGE_SIZE", 50))
+POLL_MAX_PAGE_SIZE = int(os.environ.get("POLL_MAX_PAGE_SIZE", 500))
+# read-only listings and voter data are serialized from .values() rows instead of DRF serializers
+FAST_SERIALIZERS = os.getenv("FAST_SERIALIZERS", "True") == "True"
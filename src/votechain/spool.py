@@ -0,0 +1,225 @@
+""" Module keeping a durable local write-ahead spool of votes """
+import hashlib
+import hmac
+import logging
+import os
+import sqlite3
+import threading
+import time
+from votechain import metrics
+from votechain.settings import SECRET_KEY, VOTE_SPOOL_PATH
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+DRAINED = "drained"
+
+depth = metrics.gauge("vote_spool_depth", "Votes waiting in the spool for the ledger")
+drained = metrics.counter("vote_spool_drained", "Votes replayed from the spool into the ledger")
+drain_rate = metrics.gauge("vote_spool_drain_rate", "Votes drained per second during the last pass")
+
+
+def receipt_for(vit):
+    """
+    Derives the ledger receipt of a vote from its vit.
+    The chaincode records a receipt once, so replaying a vote cannot count it twice.
+    """
+    return hmac.new(SECRET_KEY.encode(), str(vit).encode(), hashlib.sha256).hexdigest()
+
+
+class SpooledVote():
+    """ Single vote stored in the spool """
+    def __init__(self, receipt, poll_id, candidate, shards):
+        self.receipt = receipt
+        self.poll_id = poll_id
+        self.candidate = candidate
+        self.shards = shards
+
+
+class VoteSpool():
+    """
+    SQLite backed spool of votes keyed by their ledger receipt.
+    Votes are appended before they are acknowledged and marked drained once the ledger
+    committed them, so pending votes survive ledger outages and process crashes.
+    Vits are mailed to named voters, so the spool keeps only the receipt derived from them
+    and holds no more than the ledger itself: which receipt voted for which candidate.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS ballots ("
+                "receipt TEXT PRIMARY KEY, "
+                "poll_id INTEGER NOT NULL, "
+                "candidate TEXT NOT NULL, "
+                "shards INTEGER NOT NULL, "
+                "state TEXT NOT NULL, "
+                "attempts INTEGER NOT NULL DEFAULT 0, "
+                "created REAL NOT NULL, "
+                "drained REAL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS ballots_state ON ballots (state, receipt)"
+            )
+            self._drop_vits(connection)
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        self._refresh_depth()
+
+    @staticmethod
+    def _drop_vits(connection):
+        """ Moves the votes of a spool keyed by vit, as it used to be, over to ballots """
+        legacy = connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'votes'"
+        ).fetchone()
+        if legacy is None:
+            return
+        connection.execute(
+            "INSERT OR IGNORE INTO ballots "
+            "(receipt, poll_id, candidate, shards, state, attempts, created, drained) "
+            "SELECT receipt, poll_id, candidate, shards, state, attempts, created, drained "
+            "FROM votes"
+        )
+        connection.execute("DROP TABLE votes")
+
+    def _connection(self):
+        """ Returns a connection owned by the current thread and process """
+        pid = os.getpid()
+        if getattr(self._local, "pid", None) != pid:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=FULL")
+            self._local.connection = connection
+            self._local.pid = pid
+        return self._local.connection
+
+    def _refresh_depth(self):
+        """ Updates the spool depth gauge """
+        row = self._connection().execute(
+            "SELECT COUNT(*) FROM ballots WHERE state = ?", (PENDING,)
+        ).fetchone()
+        depth.set(row[0])
+
+    def append(self, vit, poll_id, candidate, shards):
+        """
+        Durably stores a vote cast with a vit before it is acknowledged.
+        Appending a vote of the same vit again keeps the first vote.
+        """
+        receipt = receipt_for(vit)
+        connection = self._connection()
+        cursor = connection.execute(
+            "INSERT OR IGNORE INTO ballots "
+            "(receipt, poll_id, candidate, shards, state, created) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (receipt, poll_id, candidate, shards, PENDING, time.time())
+        )
+        if cursor.rowcount:
+            depth.inc()
+        row = connection.execute(
+            "SELECT receipt, poll_id, candidate, shards FROM ballots WHERE receipt = ?",
+            (receipt,)
+        ).fetchone()
+        return SpooledVote(*row)
+
+    def mark_drained(self, receipt):
+        """ Marks a vote as committed to the ledger """
+        cursor = self._connection().execute(
+            "UPDATE ballots SET state = ?, drained = ? WHERE receipt = ? AND state = ?",
+            (DRAINED, time.time(), receipt, PENDING)
+        )
+        if cursor.rowcount:
+            depth.dec()
+            drained.inc()
+        return cursor.rowcount > 0
+
+    def mark_failed_attempt(self, receipt):
+        """ Counts an unsuccessful replay of a vote """
+        self._connection().execute(
+            "UPDATE ballots SET attempts = attempts + 1 WHERE receipt = ?", (receipt,)
+        )
+
+    def drained_receipts(self, receipts):
+        """ Returns the receipts among the given ones whose votes were drained """
+        receipts = list(receipts)
+        found = set()
+        # stays below SQLite's default limit of 999 parameters
+        for offset in range(0, len(receipts), 500):
+            chunk = receipts[offset:offset + 500]
+            rows = self._connection().execute(
+                "SELECT receipt FROM ballots WHERE state = ? AND receipt IN ({0})".format(
+                    ", ".join("?" * len(chunk))
+                ),
+                [DRAINED] + chunk
+            ).fetchall()
+            found.update(row[0] for row in rows)
+        return found
+
+    def pending(self, chunk_size=100):
+        """
+        Streams pending votes in receipt order, chunk_size rows at a time,
+        so replaying a large spool keeps memory bounded.
+        """
+        last_receipt = ""
+        while True:
+            rows = self._connection().execute(
+                "SELECT receipt, poll_id, candidate, shards FROM ballots "
+                "WHERE state = ? AND receipt > ? ORDER BY receipt LIMIT ?",
+                (PENDING, last_receipt, chunk_size)
+            ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield SpooledVote(*row)
+            last_receipt = rows[-1][0]
+
+    def prune(self, older_than):
+        """ Removes votes drained more than older_than seconds ago """
+        self._connection().execute(
+            "DELETE FROM ballots WHERE state = ? AND drained < ?",
+            (DRAINED, time.time() - older_than)
+        )
+
+    def drain(self, replay, chunk_size=100):
+        """
+        Replays every pending vote with replay(vote) and marks successful ones drained.
+        Returns the number of drained and failed votes.
+        """
+        started = time.monotonic()
+        succeeded = 0
+        failed = 0
+        for vote in self.pending(chunk_size):
+            try:
+                replay(vote)
+            except Exception:
+                logger.exception("Spooled vote %s could not be replayed", vote.receipt)
+                self.mark_failed_attempt(vote.receipt)
+                failed += 1
+                continue
+            if self.mark_drained(vote.receipt):
+                succeeded += 1
+        elapsed = time.monotonic() - started
+        drain_rate.set(succeeded / elapsed if elapsed > 0 else 0)
+        self._refresh_depth()
+        return succeeded, failed
+
+
+_spool = None  # pylint: disable=invalid-name
+_spool_lock = threading.Lock()
+
+
+def get_vote_spool():
+    """ Returns the process-wide spool stored at VOTE_SPOOL_PATH """
+    global _spool  # pylint: disable=global-statement
+    if _spool is None:
+        with _spool_lock:
+            if _spool is None:
+                _spool = VoteSpool(VOTE_SPOOL_PATH)
+    return _spool
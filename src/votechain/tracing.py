@@ -0,0 +1,68 @@
+""" Module recording per-phase latency, payload sizes and retries of chaincode calls """
+import time
+from contextlib import contextmanager
+from votechain import metrics
+
+POLL_METHOD = "Poll"
+PHASES = {
+    "endorse": "Time spent collecting endorsements (or evaluating a query) on peers",
+    "connect": "Time spent waiting for the commit event stream to deliver its first block",
+    "broadcast": "Time spent sending endorsed transactions to the orderer",
+    "commit": "Time spent waiting for the commit event of an ordered transaction",
+}
+
+loop_delay = metrics.histogram(
+    "ledger_loop_delay_seconds",
+    "Time between a request thread submitting a coroutine and the client's loop starting it"
+)
+
+
+def method_of(args, fcn="invoke"):
+    """
+    Returns the chaincode method a call runs,
+    unwrapping invoke arguments and calls namespaced through Poll
+    """
+    args = list(args)
+    if fcn != "invoke":
+        args = [fcn] + args
+    if len(args) > 2 and args[0] == POLL_METHOD:
+        return args[2]
+    return args[0] if args else fcn
+
+
+@contextmanager
+def phase(name, method_name):
+    """ Times the enclosed block into the histogram of a phase of a chaincode method """
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        metrics.histogram(
+            "chaincode_{0}_seconds".format(name),
+            PHASES[name],
+            method=method_name
+        ).observe(time.monotonic() - started)
+
+
+def payload(direction, method_name, data):
+    """ Records the size of a request (its arguments) or of a response """
+    if isinstance(data, (list, tuple)):
+        size = sum(len(str(item).encode("utf-8")) for item in data)
+    else:
+        size = len(data if isinstance(data, bytes) else str(data).encode("utf-8"))
+    metrics.histogram(
+        "chaincode_{0}_bytes".format(direction),
+        "Size of chaincode {0} payloads".format(direction),
+        buckets=metrics.SIZE_BUCKETS,
+        method=method_name
+    ).observe(size)
+
+
+def retries(method_name, count):
+    """ Records how many times a transaction was resent before it committed or gave up """
+    metrics.histogram(
+        "chaincode_retries",
+        "Resends of a transaction after read conflicts",
+        buckets=metrics.COUNT_BUCKETS,
+        method=method_name
+    ).observe(count)